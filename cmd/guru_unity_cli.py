@@ -6,27 +6,32 @@ GuruSDK CLI Tool
 A command line interface for managing GuruSDK installation and publishing
 """
 
+import time
+
+# the first timing mark of the --timing report
+STARTUP_TIME = time.perf_counter()
+
 import argparse
+import codecs
+import contextlib
+import copy
+import functools
+import glob
 import os
 import shutil
 import json
+import stat
+import sys
 import datetime
+import hashlib
+import secrets
 import subprocess
+import threading
+import weakref
 from os.path import expanduser
 
-# 确保导入库可用
-try:
-    import requests
-except ImportError:
-    print("Installing required dependencies...")
-    subprocess.check_call(
-        [
-            "pip3",
-            "install",
-            "requests",
-        ]
-    )
-    import requests
+# requests is only imported by the actions which need the network, see import_requests()
+requests = None
 
 # Define constants
 VERSION = '0.6.0'
@@ -35,26 +40,84 @@ DESC = 'Restructured the entire UPM Repos from scattered repos to one big repo.
 
 # Define paths
 SDK_CONFIG_JSON = 'sdk-config.json'  # SDK 开发者定义的 upm 包的配置关系，包含所有包体的可选以及从属关系, [需要配置在 DEV 项目]
+PACKAGE_HASHES_JSON = 'package-hashes.json'  # 发布时记录版本内每个包的内容哈希, 用于增量发布
+FILE_MANIFEST_JSON = 'file-manifest.json'  # 发布时记录版本内每个文件的 size 和 sha1, 用于校验本地缓存
 SDK_HOME_PATH = '.guru/unity/guru-sdk'  # 用户设备上缓存 SDK 各个版本的路径
 SDK_TEMP_PATH = '.guru/unity/temp'  # 用户设备上临时缓存路径
+PUBLISH_WORKSPACE_PATH = '.guru/unity/publish-workspace'  # 发布用的 lib 仓库工作区 (partial + sparse), 每次发布复用
+GIT_MIRROR_PATH = '.guru/unity/mirrors'  # 发布时 git upm 依赖的本地 bare 镜像 (按 repo url 区分)
+LFS_STORAGE_PATH = '.guru/unity/lfs-objects'  # 所有仓库共享的 LFS 对象目录, 相同的文件只下载一次
+LFS_EXCLUDES_JSON = 'guru-lfs-excludes.json'  # 记录 sdk_home 中没有拉取 LFS 文件的包 (存放在 .git 下)
+ARCHIVE_PATH = 'archives'  # lib 仓库中每个包的 tar.gz 压缩包 (按包的哈希命名) 和每个版本的压缩包索引
+ARCHIVE_DOWNLOAD_PATH = '.guru/unity/downloads'  # 下载中的压缩包, 中断后按 Range 续传
+FULL_SPARSE_PATTERNS = ['/*', f'!/{ARCHIVE_PATH}/']  # 完整 clone 的 sparse-checkout: 除压缩包外的所有文件
+ARCHIVE_MAX_MB = 95  # 单个压缩包的上限 (MB), 压缩包是普通的 git 文件, 不能超过 GitHub 100 MB 的单文件限制
+SDK_LOCK = '.guru/unity/sync.lock'  # 同步 sdk_home 时的跨进程文件锁
+CACHE_LOCK = '.guru/unity/cache.lock'  # 写入/淘汰 SDK 缓存和索引时的跨进程文件锁
+PUBLISH_LOCK = '.guru/unity/publish.lock'  # 使用发布工作区 (从拉取到推送) 时的跨进程文件锁
+LOCK_TIMEOUT = 600  # 等待其他进程释放文件锁的超时时间 (秒)
+PUBLISH_LOCK_TIMEOUT = 3600  # 等待另一个发布完成的超时时间 (秒)
+SDK_CACHE_PATH = '.guru/unity/sdk-cache'  # 用户设备上按 version@ts 分开存放的 SDK 缓存
+SDK_CACHE_INDEX = 'index.json'  # SDK 缓存的索引文件（大小，最近使用时间）
+SDK_CACHE_BUDGET_MB = 10240  # SDK 缓存默认的磁盘上限 (MB)
 SDK_LIB_REPO = 'git@github.com:castbox/unity-gurusdk-library.git'  # 线上发布的 SDK 静态库的 repo
+SDK_LIB_BRANCH = 'main'  # 线上发布的 SDK 静态库的分支
 SDK_DEV_REPO = 'git@github.com:castbox/unity-gurusdk-dev.git'  # SDK 开发者所使用的开发 Repo
 SDK_LIB_V2 = 'com.guru.unity.sdk.v2'  # SDK upm 整体合并后的 lib 版本（V2）
 UPM_PREFIX = '.upm.'  # 在用户的项目中 Packages 的路径前缀
 UNITY_MANIFEST_JSON = 'manifest.json'  # unity 项目自身的 UPM 包清单文件
 UNITY_PACKAGES_LOCK_JSON = 'packages-lock.json'  # unity 项目自身的 UPM 包清单文件
 UNITY_PACKAGES_ROOT = 'Packages'  # unity 项目自身的 UPM 包清单文件
+UNITY_REGISTRY_URL = 'https://packages.unity.com'  # unity 官方的 UPM registry
+UNITY_BUILTIN_PREFIX = 'com.unity.modules.'  # unity 内置模块的包名前缀 (source: builtin)
 UNITY_DEV_PROJECT = 'GuruSDKDev'  # unity 开发项目中 Unity 工程路径的二级目录
 VERSION_LIST = 'version_list.json'  # SDK 版本描述文件
 VERSION_LIST_URL = 'https://raw.githubusercontent.com/castbox/unity-gurusdk-library/refs/heads/main/version_list.json'
+VERSION_LIST_CACHE = '.guru/unity/version_list.cache.json'  # 线上 version_list 的本地缓存 (ETag, Last-Modified, 拉取时间)
+VERSION_INDEX_PATH = 'index'  # lib 仓库中的分片版本索引: root.json (latest, channels, 分片指针) + 按 major.minor 分开的不可变分片
+VERSION_ROOT_CACHE = '.guru/unity/version_root.cache.json'  # 线上 index/root.json 的本地缓存 (同 version_list)
+VERSION_SHARD_CACHE = '.guru/unity/version-shards'  # 下载过的版本分片 (按内容命名, 不会改变)
+VERSION_INDEX_CACHE = '.guru/unity/version_index.json'  # 解析并排序后的版本索引, version_list 变化时才重建
+VERSION_LIST_TTL = 600  # 本地缓存的有效时间 (秒), 过期后再向服务器验证
+HTTP_CONNECT_TIMEOUT = 5  # 连接超时 (秒)
+HTTP_READ_TIMEOUT = 20  # 读取超时 (秒)
+HTTP_RETRIES = 3  # 网络请求的重试次数 (指数退避)
+PUBLISH_JOBS = 4  # 发布时并行拉取 git upm 包的数量, 也是同时运行的命令数量
+MATERIALIZE_JOBS = 8  # 复制/链接包体文件的线程数
+DOWNLOAD_JOBS = 4  # 同时下载的压缩包数量
+CMD_TIMEOUT = 3600  # 单条命令的超时时间 (秒)
 LOG_TXT = 'log.txt'
+DAEMON_JSON = '.guru/unity/daemon.json'  # 本地常驻进程的端口和 token
+DAEMON_IDLE_TIMEOUT = 3600  # 常驻进程空闲多久后自动退出 (秒)
+DAEMON_ACTIONS = ['sync', 'install', 'unity_install']  # 可以交给常驻进程执行的 action
+HASH_MEMO_JSON = '.guru/unity/hash-memo.json'  # 文件哈希的缓存 (按 path, size, mtime), 未修改的文件不再重复读取
+STARTUP_BUDGET_MS = 150  # 启动 (import + 解析参数) 的耗时预算, 超出时 --timing 会给出警告
+CO_COROUTINE = 0x80  # inspect.CO_COROUTINE, 'async def' 函数的 code flag
 GURU_SERVICES='Assets/Guru/Resources/guru_services.txt'
+INSTALLER_JSON = 'ProjectSettings/guru-sdk-installer.json'  # unity 中的安装器保存的版本 (install_version, install_ts)
+INSTALL_STAMP_JSON = 'ProjectSettings/guru-sdk-install-stamp.json'  # 安装后写入项目的记录 (版本, ts, 功能开关, 输入的哈希), 未变化时跳过安装
+MACRO_PLATFORMS = ['Android', 'iPhone']  # 安装时需要写入宏的平台
+# Unity 2020 及更早的版本中 scriptingDefineSymbols 使用 BuildTargetGroup 的 id 作为 key
+UNITY_BUILD_TARGET_IDS = {
+    'Standalone': '1',
+    'iPhone': '4',
+    'Android': '7',
+    'WebGL': '13',
+    'Metro': '14',
+    'tvOS': '25',
+}
 
 ERROR_UNITY_PROJECT_NOT_FOUND = 100
 ERROR_WRONG_VERSION = 101
 ERROR_WRONG_SOURCE_PATH = 102
 ERROR_SDK_CONFIG_NOT_FOUND = 103
 ERROR_SDK_CONFIG_LOAD_ERROR = 104
+ERROR_GIT_PACKAGE_FAILED = 105
+ERROR_BATCH_INSTALL_FAILED = 106
+ERROR_CMD_FAILED = 107
+ERROR_VERIFY_FAILED = 108
+ERROR_LOCK_TIMEOUT = 109
+ERROR_CMD_TIMEOUT = 124
 ERROR_PATH_NOT_FOUND = 405
 ERROR_WRONG_ARGS_FORMAT = 501
 
@@ -92,24 +155,239 @@ setting_to_package = {
         "macro": "GURU_THINKINGDATA"
     },
 }
+# the default enable of each selectable package, every project starts from it
+default_package_enables = {k: v['enable'] for k, v in setting_to_package.items()}
+
+# disk budget of the sdk cache, can be changed by --cache_size
+sdk_cache_budget_mb = SDK_CACHE_BUDGET_MB
+# trust the local caches and never touch the network, set by --offline
+offline_mode = False
+# ttl of the cached version_list, can be changed by --ttl
+version_list_ttl = VERSION_LIST_TTL
+# install even if the install stamp says the project is up to date, set by --force
+force_install = False
+# install from the package archives when the version has them, set off by --no_archive
+archive_mode = True
+# where the archives are downloaded from, set by --archive_url (default: next to VERSION_LIST_URL)
+archive_base_url = ''
+# the pooled http session, created on the first request
+http_session = None
+# how many git upm packages are fetched at the same time on publish, set by --jobs
+publish_jobs = PUBLISH_JOBS
+# one lock per git mirror, packages from the same repo may be fetched at the same time
+git_mirror_locks = {}
+git_mirror_locks_guard = threading.Lock()
+# parsed json files by (path, mtime, size), kept warm inside the daemon
+json_file_memo = {}
+# the file hashes by (path, size, mtime), loaded from HASH_MEMO_JSON on the first hash_file
+file_hash_memo = None
+# the copy method which works between two devices: {(source dev, dest dev): method}
+copy_methods = {}
+# the dependency graphs of the immutable cache entries: {(version_home, packages): graph}
+dependency_graph_memo = {}
+# the marks of the --timing report: [(name, perf_counter)]
+timing_marks = [('start', STARTUP_TIME)]
+# how many commands were started by run_cmd / exec_cmd, used by the benchmarks
+cmd_count = 0
+# the limiter of the running commands, one for each event loop
+cmd_semaphores = weakref.WeakKeyDictionary()
+# the stderr of the commands is printed (to the daemon client or the batch worker log) instead of inherited
+forward_cmd_stderr = False
+# the file locks held by the current thread, a held lock is taken again without waiting
+held_locks = threading.local()
 
 removeList = ["com.google.firebase.app", "com.coffee.git-dependency-resolver", "com.coffee.upm-git-extension"]
 
+# ---------------------- TRACE ----------------------
+# nested spans of the commands, file operations and http calls, exported by --trace as chrome trace events
+# (open it in chrome://tracing or ui.perfetto.dev). None means tracing is off
+trace_events = None
+
+
+# record a span, the yielded dict is the span args, e.g. 'bytes' and 'exit' can be set inside the block
+@contextlib.contextmanager
+def trace_span(name: str, cat: str = 'cli', **args):
+    if trace_events is None:
+        yield args
+        return
+
+    start = time.perf_counter()
+    try:
+        yield args
+    except SystemExit as e:
+        args.setdefault('exit', e.code)
+        raise
+    except Exception as e:
+        args.setdefault('error', str(e))
+        raise
+    finally:
+        trace_events.append({
+            'name': name,
+            'cat': cat,
+            'ph': 'X',
+            'ts': round((start - STARTUP_TIME) * 1000000, 1),
+            'dur': round((time.perf_counter() - start) * 1000000, 1),
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'args': args,
+        })
+
+
+# trace the whole function as one span
+def traced(name: str, cat: str = 'cli'):
+    def wrap(func):
+        # an 'async def' function, checked by the code flag (inspect.CO_COROUTINE) to keep asyncio out of the startup
+        if func.__code__.co_flags & CO_COROUTINE:
+            @functools.wraps(func)
+            async def call_async(*args, **kwargs):
+                with trace_span(name, cat):
+                    return await func(*args, **kwargs)
+            return call_async
+
+        @functools.wraps(func)
+        def call(*args, **kwargs):
+            with trace_span(name, cat):
+                return func(*args, **kwargs)
+        return call
+    return wrap
+
+
+def start_trace():
+    global trace_events
+    trace_events = []
+
+
+def export_trace(path: str):
+    global trace_events
+    if trace_events is None:
+        return
+
+    events = list(trace_events)
+    trace_events = None
+    threads = {e['tid'] for e in events}
+    meta = [{'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': tid,
+             'args': {'name': 'main' if tid == threading.main_thread().ident else f'worker-{tid}'}}
+            for tid in threads]
+    write_file(path, json.dumps({'traceEvents': meta + events, 'displayTimeUnit': 'ms'}))
+    print(f'trace saved: {path}')
+
+
 # ---------------------- UTILS ----------------------
-# call cmd
+# call cmd inside work_path, return the output (stderr goes to the console, or is printed with forward_cmd_stderr)
+# check: exit the cli when the cmd failed, otherwise the failure is only printed
 def run_cmd(cmdline: str,
             work_path: str = '',
-            show_log: bool = True):
-    if len(work_path) > 0:
-        os.chdir(work_path)
-    if show_log:
-        log = os.popen(cmdline).read()
-        print(log)
-    else:
-        os.popen(cmdline)
+            show_log: bool = True,
+            check: bool = False,
+            timeout: float = CMD_TIMEOUT):
+    code, log = run_async(run_cmd_async(cmdline, work_path, show_log, check, timeout))
+    return log
+
+
+# call cmd inside work_path without changing the cwd of the process (safe to use in worker threads)
+# return the exit code and the output (stdout + stderr)
+def exec_cmd(cmdline: str, work_path: str = '', timeout: float = CMD_TIMEOUT):
+    return run_async(run_cmd_async(cmdline, work_path, False, False, timeout, True))
+
+
+# the async cmd engine: per-cmd cwd, streamed output, exit code and timeout,
+# and at most 'publish_jobs' commands of the same event loop are running at the same time
+async def run_cmd_async(cmdline: str,
+                        work_path: str = '',
+                        show_log: bool = True,
+                        check: bool = False,
+                        timeout: float = CMD_TIMEOUT,
+                        with_stderr: bool = False):
+    import asyncio
+
+    global cmd_count
+    cmd_count += 1
+
+    loop = asyncio.get_running_loop()
+    if loop not in cmd_semaphores:
+        cmd_semaphores[loop] = asyncio.Semaphore(max(1, publish_jobs))
+
+    # the forwarded stderr is printed but not part of the output, the callers parse the stdout
+    forward = forward_cmd_stderr and not with_stderr
+    stderr = asyncio.subprocess.STDOUT if with_stderr else asyncio.subprocess.PIPE if forward else None
+
+    async with cmd_semaphores[loop]:
+        with trace_span(get_cmd_name(cmdline), 'cmd', cmd=cmdline, cwd=work_path) as span:
+            proc = await asyncio.create_subprocess_shell(cmdline,
+                                                         cwd=work_path if len(work_path) > 0 else None,
+                                                         stdout=asyncio.subprocess.PIPE,
+                                                         stderr=stderr)
+            lines = []
+
+            # read fixed-size chunks, a line could be longer than the line limit of the stream reader
+            async def stream(reader, keep: bool):
+                decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+                while True:
+                    chunk = await reader.read(65536)
+                    txt = decoder.decode(chunk, final=len(chunk) == 0)
+                    if len(txt) > 0:
+                        if keep:
+                            lines.append(txt)
+                        if show_log or not keep:
+                            print(txt, end='', flush=True)
+                    if len(chunk) == 0:
+                        break
+
+            async def run():
+                readers = [stream(proc.stdout, True)] + ([stream(proc.stderr, False)] if forward else [])
+                await asyncio.gather(*readers)
+                return await proc.wait()
+
+            try:
+                code = await asyncio.wait_for(run(), timeout)
+            except asyncio.TimeoutError:
+                proc.kill()
+                await proc.wait()
+                print(f'timeout after {timeout}s: {cmdline}')
+                code = ERROR_CMD_TIMEOUT
+            except asyncio.CancelledError:
+                # another cmd of the same stage failed
+                proc.kill()
+                raise
+
+            log = ''.join(lines)
+            span['exit'] = code
+            span['bytes'] = len(log)
+
+    if code != 0 and not with_stderr:
+        print(f'[exit {code}] {cmdline}')
+    if code != 0 and check:
+        raise CmdFailed(cmdline, code)
+    return code, log
+
+
+# raised by run_cmd_async(check=True), the other running cmds are cancelled and the cli exits in run_async
+class CmdFailed(Exception):
+
+    def __init__(self, cmdline: str, code: int):
+        super().__init__(f'[exit {code}] {cmdline}')
+        self.cmdline = cmdline
+        self.code = code
+
+
+# run the async cmds from the sync code
+def run_async(coro):
+    import asyncio
+    try:
+        return asyncio.run(coro)
+    except CmdFailed as e:
+        print(f'cmd failed: {e}')
+        exit(ERROR_CMD_FAILED)
+
+
+# the short name of a cmdline in the trace, e.g. 'git fetch'
+def get_cmd_name(cmdline: str):
+    words = [w for w in cmdline.split(' ') if len(w) > 0 and not w.startswith('-')]
+    return ' '.join(words[:2])
 
 
 # delete full dir
+@traced('delete_dir', 'file')
 def delete_dir(dir_path: str):
     if os.path.exists(dir_path):
         print(f'delete dir: {dir_path}')
@@ -131,7 +409,8 @@ def ensure_dir(dir_path: str):
     if os.path.exists(dir_path):
         return
 
-    os.makedirs(dir_path)
+    # the dir could be made by another worker at the same time
+    os.makedirs(dir_path, exist_ok=True)
 
 
 def get_user_home():
@@ -169,55 +448,116 @@ def to_safe_path(path: str):
     return path.replace('\\', '/')  # mac or liunx os
 
 # 设置 Unity 的宏
-def setup_unity_marcos(add_macros: list, remove_macros: list, unity_proj_path: str):
+# platforms: the keys under 'scriptingDefineSymbols' to edit, None means MACRO_PLATFORMS (Android and iPhone)
+@traced('setup_unity_marcos', 'install')
+def setup_unity_marcos(add_macros: list, remove_macros: list, unity_proj_path: str, platforms: list = None):
     print(f'开始处理 Unity Macro: {unity_proj_path}')
 
+    if platforms is None:
+        platforms = MACRO_PLATFORMS
     proj_settings_path = os.path.join(unity_proj_path, "ProjectSettings/ProjectSettings.asset")
+    return edit_scripting_defines(proj_settings_path, add_macros, remove_macros, platforms)
 
-    lines = read_all_lines(proj_settings_path)
 
-    for i in range(len(lines)):
-        line = lines[i]
-        and_idx = -1
-        ios_idx = -1
-        
-        if 'scriptingDefineSymbols:' in line:
-            # 从当前行向下读取 20 行
-            for j in range(1, 20):
-                t_line = lines[i + j]
-                if 'Android:' in t_line:
-                    and_idx = i+j
-                elif 'iPhone:' in t_line:
-                    ios_idx = i+j
-
-                if and_idx > 0 and ios_idx > 0:
-                    all_idx = [and_idx, ios_idx]
-                    break
+# edit the defines of ProjectSettings.asset, the file is only replaced when the defines are changed
+# platforms: the keys to edit, None means every platform in the block
+def edit_scripting_defines(path: str, add_macros: list, remove_macros: list, platforms: list = None):
+    with open(path, 'rb') as f:
+        data = f.read()
 
-            if len(all_idx) > 0:
-                break        
+    block = find_scripting_defines(data)
+    if block is None:
+        print(f'scriptingDefineSymbols not found in {path}')
+        return False
 
-    for idx in all_idx:
-        raw = lines[idx].split(': ')
-        marcos = raw[1].strip().split(';')
+    defines = block['defines']
+    keys = list(defines.keys()) if platforms is None else platforms
+    if block['numeric']:
+        # unity 2020 and older use the BuildTargetGroup ids as keys
+        keys = [UNITY_BUILD_TARGET_IDS.get(k, k) for k in keys]
 
-        print(f'marcos: {marcos}')
-        print(f'remove_macros: {remove_macros}')
-        print(f'add_macros: {add_macros}')
+    changed = False
+    for key in keys:
+        marcos = list(defines.get(key, []))
 
         for r in remove_macros:
             if r in marcos:
-                print(f'remove {r} from {marcos}')
+                print(f'remove {r} from {key}: {marcos}')
                 marcos.remove(r)
 
         for a in add_macros:
             if a not in marcos:
-                print(f'add {a} to {marcos}')
+                print(f'add {a} to {key}: {marcos}')
                 marcos.append(a)
 
-        lines[idx] = f"{raw[0]}: {';'.join(marcos)}\n"
+        if key not in defines and len(marcos) == 0:
+            continue
+        if marcos != defines.get(key):
+            defines[key] = marcos
+            changed = True
+
+    if not changed:
+        return False
+
+    eol = block['eol']
+    if len(defines) == 0:
+        text = f"{block['indent']}scriptingDefineSymbols: {{}}{eol}"
+    else:
+        text = f"{block['indent']}scriptingDefineSymbols:{eol}"
+        for key, marcos in defines.items():
+            text += f"{block['indent']}  {key}: {';'.join(marcos)}{eol}"
+
+    data = data[:block['start']] + text.encode('utf-8') + data[block['end']:]
+    write_file_atomic(path, data)
+    return True
+
+
+# locate the 'scriptingDefineSymbols' block by its byte offset, one scan over the file
+# return { start, end, indent, eol, numeric, defines: {platform: [macro]} } or None
+def find_scripting_defines(data: bytes):
+    key = b'scriptingDefineSymbols:'
+    pos = data.find(key)
+    if pos < 0:
+        return None
+
+    start = data.rfind(b'\n', 0, pos) + 1
+    indent = data[start:pos].decode('utf-8')
+    eol = '\r\n' if b'\r\n' in data[start:data.find(b'\n', pos) + 1] else '\n'
+
+    # the key line, maybe 'scriptingDefineSymbols: {}' for an empty block
+    end = data.find(b'\n', pos)
+    end = len(data) if end < 0 else end + 1
+
+    # the children lines are indented deeper than the key
+    defines = {}
+    while end < len(data):
+        line_end = data.find(b'\n', end)
+        line_end = len(data) if line_end < 0 else line_end + 1
+        line = data[end:line_end].decode('utf-8').rstrip('\r\n')
+        child = line.lstrip(' ')
+        if len(line) - len(child) <= len(indent) or ':' not in child:
+            break
+
+        name, value = child.split(':', 1)
+        defines[name.strip()] = [m for m in value.strip().split(';') if len(m) > 0]
+        end = line_end
+
+    numeric = len(defines) > 0 and all(k.isdigit() for k in defines)
+    return {'start': start, 'end': end, 'indent': indent, 'eol': eol, 'numeric': numeric, 'defines': defines}
+
+
+# write to a temp file in the same folder, then rename it to the path
+def write_file_atomic(path: str, data: bytes):
+    temp = f'{path}.{os.getpid()}.tmp'
+    with trace_span('write_file_atomic', 'file', path=path, bytes=len(data)):
+        with open(temp, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(path):
+            shutil.copymode(path, temp)
+        os.replace(temp, path)
 
-    write_all_lines(lines, proj_settings_path)
 
 def write_all_lines(lines: list, path: str):
     with open(path, 'w', encoding='utf-8') as f:
@@ -243,11 +583,42 @@ def read_file(path: str):
         return txt
 
 
+# load a json file, the parsed doc is reused until the file changes
+def load_json_file(path: str):
+    st = os.stat(path)
+    key = (st.st_mtime_ns, st.st_size)
+    memo = json_file_memo.get(path)
+    if memo is None or memo[0] != key:
+        memo = (key, json.loads(read_file(path)))
+        json_file_memo[path] = memo
+    return copy.deepcopy(memo[1])
+
+
+# add a mark to the --timing report
+def mark_timing(name: str):
+    timing_marks.append((name, time.perf_counter()))
+
+
+def print_timing_report():
+    print('===== timing =====')
+    last = STARTUP_TIME
+    for name, t in timing_marks[1:]:
+        print(f'{name:<10} {(t - last) * 1000:8.1f} ms')
+        last = t
+    print(f'{"total":<10} {(last - STARTUP_TIME) * 1000:8.1f} ms')
+    print(f'requests loaded: {"requests" in sys.modules}, asyncio loaded: {"asyncio" in sys.modules}')
+
+    startup = dict(timing_marks).get('args', last) - STARTUP_TIME
+    if startup * 1000 > STARTUP_BUDGET_MS:
+        print(f'WARN: startup {startup * 1000:.1f} ms is over the budget {STARTUP_BUDGET_MS} ms')
+
+
 # write sth into a file
 def write_file(path: str, content: str):
-    with open(path, 'w', encoding='utf-8') as f:
-        f.write(content)
-        f.close()
+    with trace_span('write_file', 'file', path=path, bytes=len(content)):
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+            f.close()
 
 
 def clear_log():
@@ -281,28 +652,1468 @@ def get_timestamp():
     return int(datetime.datetime.utcnow().timestamp())
 
 
+# sha1 of a file, unchanged files (same size and mtime) are not read again
+def hash_file(path: str):
+    global file_hash_memo
+    if file_hash_memo is None:
+        memo_path = to_safe_path(f'{get_user_home()}/{HASH_MEMO_JSON}')
+        try:
+            file_hash_memo = load_json_file(memo_path) if os.path.exists(memo_path) else {}
+        except ValueError:
+            file_hash_memo = {}
+
+    key = os.path.abspath(path)
+    st = os.stat(path)
+    memo = file_hash_memo.get(key)
+    if memo is not None and memo[0] == st.st_size and memo[1] == st.st_mtime_ns:
+        return memo[2]
+
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(chunk)
+    file_hash_memo[key] = [st.st_size, st.st_mtime_ns, sha.hexdigest()]
+    return file_hash_memo[key][2]
+
+
+# save the memo of hash_file, the files which were deleted are dropped
+def save_hash_memo():
+    if file_hash_memo is None:
+        return
+    memo = {k: v for k, v in file_hash_memo.items() if os.path.exists(k)}
+    ensure_dir(to_safe_path(f'{get_user_home()}/.guru/unity'))
+    write_file(to_safe_path(f'{get_user_home()}/{HASH_MEMO_JSON}'), json.dumps(memo))
+
+
+# content hash of a folder: the relative path and the content hash of every file
+def hash_tree(root: str):
+    sha = hashlib.sha1()
+    for dir_path, dirs, files in os.walk(root):
+        dirs[:] = sorted([d for d in dirs if d != '.git'])
+        for f in sorted(files):
+            path = os.path.join(dir_path, f)
+            rel = os.path.relpath(path, root).replace('\\', '/')
+            sha.update(f'{rel}\0{hash_file(path)}\n'.encode('utf-8'))
+    return sha.hexdigest()
+
+
+# {path: [size, sha1]} of the files, hashed in a thread pool
+def hash_files(paths: list):
+    from concurrent.futures import ThreadPoolExecutor
+
+    def hash_one(path: str):
+        return [os.path.getsize(path), hash_file(path)] if os.path.isfile(path) else None
+
+    with ThreadPoolExecutor(max_workers=MATERIALIZE_JOBS) as pool:
+        return dict(zip(paths, pool.map(hash_one, paths)))
+
+
+# {relative path: [size, sha1]} of every file in the folder
+def hash_tree_files(root: str):
+    paths = []
+    for dir_path, dirs, files in os.walk(root):
+        if '.git' in dirs:
+            dirs.remove('.git')
+        paths += [os.path.join(dir_path, f) for f in files]
+    return {os.path.relpath(p, root).replace('\\', '/'): h for p, h in hash_files(paths).items()}
+
+
+# ---------------------- Materialize ----------------------
+# build the files of source in dest as cheap as the file system allows:
+# hardlink (only for immutable sources) > reflink > copy_file_range > plain copy,
+# the files are materialized in a thread pool, and the files which are already up to date are skipped
+# prune: delete the files in dest which are not in source
+# return the count of each method, e.g. {'reflink': 10, 'skip': 2}
+def materialize_tree(source: str, dest: str, hardlink: bool = False, prune: bool = False):
+    jobs = []
+    for root, dirs, files in os.walk(source):
+        if '.git' in dirs:
+            dirs.remove('.git')
+        to_root = path_join(dest, os.path.relpath(root, source))
+        ensure_dir(to_root)
+        for f in files:
+            jobs.append((path_join(root, f), path_join(to_root, f)))
+
+    if prune:
+        keep = {os.path.normpath(to_path) for _, to_path in jobs}
+        for root, dirs, files in os.walk(dest):
+            for f in files:
+                if os.path.normpath(path_join(root, f)) not in keep:
+                    os.remove(path_join(root, f))
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    stats = {}
+    with ThreadPoolExecutor(max_workers=MATERIALIZE_JOBS) as pool:
+        for method in pool.map(lambda job: materialize_file(job[0], job[1], hardlink), jobs):
+            stats[method] = stats.get(method, 0) + 1
+    return stats
+
+
+# materialize one file, the dest is replaced atomically (it may be a hardlink of another file)
+def materialize_file(source: str, dest: str, hardlink: bool = False):
+    if is_same_file(source, dest):
+        return 'skip'
+
+    methods = ['link', 'reflink', 'copy_range', 'copy'] if hardlink else ['reflink', 'copy_range', 'copy']
+    key = (os.stat(source).st_dev, os.stat(os.path.dirname(dest)).st_dev, hardlink)
+    if key in copy_methods:
+        methods = methods[methods.index(copy_methods[key]):]
+
+    temp = f'{dest}.{secrets.token_hex(4)}.tmp'
+    for method in methods:
+        try:
+            copy_file_by(method, source, temp)
+            break
+        except (OSError, AttributeError, ImportError):
+            if os.path.exists(temp):
+                os.remove(temp)
+            if method == methods[-1]:
+                raise
+    copy_methods[key] = method
+
+    if method != 'link':
+        shutil.copystat(source, temp)
+    os.replace(temp, dest)
+    return method
+
+
+def copy_file_by(method: str, source: str, dest: str):
+    if method == 'link':
+        os.link(source, dest)
+    elif method == 'reflink':
+        # copy on write clone (btrfs, xfs), linux only
+        import fcntl
+        with open(source, 'rb') as s, open(dest, 'wb') as d:
+            fcntl.ioctl(d.fileno(), 0x40049409, s.fileno())  # FICLONE
+    elif method == 'copy_range':
+        # in-kernel copy, no data goes through python
+        with open(source, 'rb') as s, open(dest, 'wb') as d:
+            left = os.fstat(s.fileno()).st_size
+            while left > 0:
+                n = os.copy_file_range(s.fileno(), d.fileno(), left)
+                if n == 0:
+                    break
+                left -= n
+    else:
+        shutil.copyfile(source, dest)
+
+
+# the dest file is the source, or has the same size and mtime (or content) as the source
+def is_same_file(source: str, dest: str):
+    if not os.path.exists(dest):
+        return False
+
+    s, d = os.stat(source), os.stat(dest)
+    if (s.st_dev, s.st_ino) == (d.st_dev, d.st_ino):
+        return True
+    if s.st_size != d.st_size:
+        return False
+    if s.st_mtime_ns == d.st_mtime_ns:
+        return True
+    return hash_file(source) == hash_file(dest)
+
+
+# ---------------------- Lock ----------------------
+# cross-process file locks, so many agents and editors can share one sdk_home and one sdk cache.
+# SDK_LOCK guards the sdk_home and CACHE_LOCK guards the cache entries and the index,
+# PUBLISH_LOCK guards the publish workspace from the fetch to the push,
+# when both are needed SDK_LOCK is always taken first
+@contextlib.contextmanager
+def file_lock(name: str, timeout: float = LOCK_TIMEOUT):
+    path = to_safe_path(f'{get_user_home()}/{name}')
+    held = held_locks.__dict__.setdefault('paths', set())
+    if path in held:
+        yield
+        return
+
+    ensure_dir(os.path.dirname(path))
+    f = open(path, 'a+b')
+    start = time.time()
+    with trace_span('file_lock', 'lock', path=path) as span:
+        while not try_lock_file(f):
+            if time.time() - start > timeout:
+                f.close()
+                print(f'can not lock {path} in {timeout}s, another guru_unity_cli is still running')
+                exit(ERROR_LOCK_TIMEOUT)
+            if 'waited' not in span:
+                print(f'waiting for another guru_unity_cli: {path}')
+            span['waited'] = round(time.time() - start, 3)
+            time.sleep(0.1)
+
+    held.add(path)
+    try:
+        yield
+    finally:
+        held.discard(path)
+        unlock_file(f)
+        f.close()
+
+
+def try_lock_file(f):
+    try:
+        if is_windows_platform():
+            import msvcrt
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+
+def unlock_file(f):
+    if is_windows_platform():
+        import msvcrt
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        import fcntl
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+# move the complete staging folder to dest, the old dest is renamed away first and deleted after,
+# so dest is always either the old tree or the new one
+def swap_dir(staging: str, dest: str):
+    old = f'{dest}.old-{secrets.token_hex(4)}'
+    if os.path.exists(dest):
+        os.rename(dest, old)
+    os.rename(staging, dest)
+    if os.path.exists(old):
+        delete_dir(old)
+
+
+# the staging and old folders left by a killed process
+def clean_stale_dirs(dest: str):
+    for d in glob.glob(f'{glob.escape(dest)}.staging-*') + glob.glob(f'{glob.escape(dest)}.old-*'):
+        delete_dir(d)
+
+
+# ---------------------- Cache ----------------------
+# every version@ts is an immutable entry under '~/.guru/unity/sdk-cache/versions',
+# files are stored once in 'objects' (by content hash) and hardlinked into the entries.
+# the objects are read-only, a write through the linked projects would change every entry which shares them.
+# index = { entries: {name: {version, ts, size, last_used, ...}}, projects: {project path: entry name} }
+def get_sdk_cache_home():
+    return to_safe_path(f'{get_user_home()}/{SDK_CACHE_PATH}')
+
+
+def get_cache_entry_name(version: str, ts: str):
+    return f'{version}@{ts}'
+
+
+def get_cache_entry_path(version: str, ts: str):
+    return path_join(get_sdk_cache_home(), f'versions/{get_cache_entry_name(version, ts)}')
+
+
+def has_cache_entry(version: str, ts: str):
+    if is_empty_str(version) or is_empty_str(ts):
+        return False
+    return os.path.exists(get_cache_entry_path(version, ts))
+
+
+def load_cache_index():
+    path = path_join(get_sdk_cache_home(), SDK_CACHE_INDEX)
+    if os.path.exists(path):
+        try:
+            return load_json_file(path)
+        except ValueError:
+            print(f'broken cache index, rebuild it: {path}')
+    return {'entries': {}}
+
+
+def save_cache_index(index: dict):
+    cache_home = get_sdk_cache_home()
+    ensure_dir(cache_home)
+    write_file_atomic(path_join(cache_home, SDK_CACHE_INDEX), json.dumps(index, indent=2).encode('utf-8'))
+
+
+# get the cached entry of version@ts, build it from the synced sdk_home if it's not cached yet
+# excludes: the packages the caller doesn't need, None means every package of the version is needed
+# archive_index: build the entry from the package archives instead of the sdk_home
+@traced('ensure_cache_entry', 'cache')
+def ensure_cache_entry(version: str, ts: str, excludes: list = None, archive_index: dict = None):
+    # the entry may be built or filled from the sdk_home, and the index is shared by all processes
+    with file_lock(SDK_LOCK), file_lock(CACHE_LOCK):
+        return ensure_cache_entry_locked(version, ts, excludes, archive_index)
+
+
+def ensure_cache_entry_locked(version: str, ts: str, excludes: list = None, archive_index: dict = None):
+    entry = get_cache_entry_path(version, ts)
+    name = get_cache_entry_name(version, ts)
+    index = load_cache_index()
+
+    if not os.path.exists(entry) and archive_index is not None:
+        print(f'Add [{name}] into sdk cache from archives: {entry}')
+        with trace_span('build_cache_entry_from_archives', 'file', path=entry) as span:
+            size, skipped = build_cache_entry_from_archives(archive_index, entry, excludes)
+            span['bytes'] = size
+        if size < 0:
+            return ''
+        # the packages which are not downloaded into the entry
+        index['entries'][name] = {'version': version, 'ts': ts, 'size': size, 'lfs_excluded': skipped,
+                                  'source': 'archive'}
+
+    if not os.path.exists(entry):
+        source = path_join(get_sdk_home(), version)
+        if not os.path.exists(source):
+            print(f'version not found in sdk home: {source}')
+            return ''
+
+        print(f'Add [{name}] into sdk cache: {entry}')
+        with trace_span('build_cache_entry', 'file', path=entry) as span:
+            size = build_cache_entry(source, entry)
+            span['bytes'] = size
+        # the packages which only have LFS pointers in the entry
+        lfs_excluded = load_lfs_excludes(get_sdk_home()).get(version, [])
+        index['entries'][name] = {'version': version, 'ts': ts, 'size': size, 'lfs_excluded': lfs_excluded}
+
+    if name not in index['entries']:
+        index['entries'][name] = {'version': version, 'ts': ts, 'size': get_dir_size(entry)}
+
+    # a package skipped by an earlier project is needed now
+    missing = [p for p in index['entries'][name].get('lfs_excluded', []) if excludes is None or p not in excludes]
+    if len(missing) > 0:
+        source = index['entries'][name].get('source', 'git')
+        index['entries'][name]['lfs_excluded'] = fill_cache_entry(version, ts, entry, missing, source) + \
+            [p for p in index['entries'][name]['lfs_excluded'] if p not in missing]
+
+    index['entries'][name]['last_used'] = time.time()
+    evict_cache_entries(index, name)
+    save_cache_index(index)
+    return entry
+
+
+# hardlink all files from source into a new entry, the entry only appears after it is complete
+def build_cache_entry(source: str, entry: str):
+    objects = path_join(get_sdk_cache_home(), 'objects')
+    temp = f'{entry}.tmp'
+    if os.path.exists(temp):
+        remove_cache_tree(temp)
+
+    jobs = []
+    for root, dirs, files in os.walk(source):
+        if '.git' in dirs:
+            dirs.remove('.git')
+        to_root = path_join(temp, os.path.relpath(root, source))
+        ensure_dir(to_root)
+        for f in files:
+            jobs.append((path_join(root, f), path_join(to_root, f)))
+
+    def build(job: tuple):
+        obj = store_cache_object(objects, job[0])
+        link_or_copy(obj, job[1])
+        return os.path.getsize(obj)
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(max_workers=MATERIALIZE_JOBS) as pool:
+        size = sum(pool.map(build, jobs))
+
+    os.rename(temp, entry)
+    return size
+
+
+# pull the LFS files of the packages which were skipped when the entry was built, and swap them into the entry
+# (an entry built from the archives downloads the archives of the packages instead)
+# return the packages which are still incomplete
+def fill_cache_entry(version: str, ts: str, entry: str, packages: list, source: str = 'git'):
+    if source == 'archive':
+        return fill_cache_entry_from_archives(version, ts, entry, packages)
+
+    sdk_home = get_sdk_home()
+    if offline_mode or get_local_version_ts(version) != ts:
+        print(f'LFS files of {", ".join(packages)} are not pulled for [{version}], sync the sdk first')
+        return packages
+
+    print(f'Pull LFS files of {", ".join(packages)} into [{get_cache_entry_name(version, ts)}]')
+    ensure_sparse_version(sdk_home, version)
+    excludes = load_lfs_excludes(sdk_home)
+    excludes[version] = [p for p in excludes.get(version, []) if p not in packages]
+    save_lfs_excludes(sdk_home, excludes)
+    pull_sdk_lfs(sdk_home, [version])
+
+    for p in packages:
+        source = path_join(sdk_home, f'{version}/{p}')
+        to_path = path_join(entry, p)
+        if not os.path.exists(source):
+            continue
+        build_cache_entry(source, f'{to_path}.new')
+        if os.path.exists(to_path):
+            os.rename(to_path, f'{to_path}.old')
+        os.rename(f'{to_path}.new', to_path)
+        if os.path.exists(f'{to_path}.old'):
+            remove_cache_tree(f'{to_path}.old')
+    return []
+
+
+# store a file into the objects by its content hash
+def store_cache_object(objects: str, path: str):
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(chunk)
+    digest = sha.hexdigest()
+
+    obj = path_join(objects, f'{digest[:2]}/{digest[2:]}')
+    if not os.path.exists(obj):
+        ensure_dir(os.path.dirname(obj))
+        materialize_file(path, obj)
+        set_read_only(obj)
+    return obj
+
+
+# store a file stream into the objects, the content is hashed while it is written
+def store_cache_stream(objects: str, stream, executable: bool = False):
+    temp = path_join(objects, f'tmp/{secrets.token_hex(8)}')
+    ensure_dir(os.path.dirname(temp))
+    sha = hashlib.sha1()
+    with open(temp, 'wb') as f:
+        for chunk in iter(lambda: stream.read(1024 * 1024), b''):
+            sha.update(chunk)
+            f.write(chunk)
+    os.chmod(temp, 0o555 if executable else 0o444)
+    digest = sha.hexdigest()
+
+    obj = path_join(objects, f'{digest[:2]}/{digest[2:]}')
+    if os.path.exists(obj):
+        os.remove(temp)
+    else:
+        ensure_dir(os.path.dirname(obj))
+        os.replace(temp, obj)
+    return obj
+
+
+def set_read_only(path: str):
+    os.chmod(path, stat.S_IMODE(os.stat(path).st_mode) & ~0o222)
+
+
+def set_writable(path: str):
+    os.chmod(path, stat.S_IMODE(os.stat(path).st_mode) | stat.S_IWUSR)
+
+
+# remove a folder of the sdk cache, windows can't delete the read-only files
+def remove_cache_tree(path: str):
+    def on_error(func, p, _exc):
+        set_writable(p)
+        func(p)
+
+    if sys.version_info >= (3, 12):
+        shutil.rmtree(path, onexc=on_error)
+    else:
+        shutil.rmtree(path, onerror=on_error)
+
+
+def link_or_copy(source: str, dest: str):
+    try:
+        os.link(source, dest)
+    except OSError:
+        # hardlink is not supported on this file system
+        shutil.copy2(source, dest)
+
+
+def get_dir_size(dir_path: str):
+    size = 0
+    for root, dirs, files in os.walk(dir_path):
+        for f in files:
+            size += os.path.getsize(os.path.join(root, f))
+    return size
+
+
+# evict least recently used entries until the objects fit into the disk budget
+@traced('evict_cache_entries', 'cache')
+def evict_cache_entries(index: dict, keep: str = ''):
+    cache_home = get_sdk_cache_home()
+    objects = path_join(cache_home, 'objects')
+    budget = sdk_cache_budget_mb * 1024 * 1024
+
+    total = collect_cache_objects(objects)
+    if total <= budget:
+        return
+
+    # the entries which are linked by the installed projects are never evicted
+    in_use = get_cache_entries_in_use(index)
+    entries = sorted(index['entries'].items(), key=lambda e: e[1].get('last_used', 0))
+    for name, info in entries:
+        if total <= budget:
+            break
+        if name == keep or name in in_use:
+            continue
+
+        print(f'Evict [{name}] from sdk cache')
+        entry = get_cache_entry_path(info['version'], info['ts'])
+        if os.path.exists(entry):
+            remove_cache_tree(entry)
+        del index['entries'][name]
+        total = collect_cache_objects(objects)
+
+    if total > budget:
+        print(f'sdk cache is over the budget ({total // (1024 * 1024)} MB of {sdk_cache_budget_mb} MB), '
+              f'{len(in_use)} entries are still linked by the installed projects')
+    pass
+
+
+# the entries which the install stamps of the known projects point to,
+# the projects which are gone (or installed from somewhere else) are dropped from the index
+def get_cache_entries_in_use(index: dict):
+    in_use = set()
+    for proj, name in list(index.get('projects', {}).items()):
+        path = get_install_stamp_path(proj)
+        try:
+            stamp = load_json_file(path) if os.path.exists(path) else {}
+        except ValueError:
+            stamp = {}
+        if get_cache_entry_name(stamp.get('version', ''), stamp.get('ts', '')) != name:
+            del index['projects'][proj]
+            continue
+        in_use.add(name)
+    return in_use
+
+
+# remember the project which links to the entry, so the entry is not evicted under it
+def register_cache_project(unity_proj_path: str, version_home: str):
+    versions = path_join(get_sdk_cache_home(), 'versions')
+    if os.path.dirname(os.path.abspath(version_home)) != os.path.abspath(versions):
+        return
+
+    proj = os.path.abspath(unity_proj_path)
+    name = os.path.basename(os.path.normpath(version_home))
+    with file_lock(CACHE_LOCK):
+        index = load_cache_index()
+        if index.get('projects', {}).get(proj) == name:
+            return
+        index.setdefault('projects', {})[proj] = name
+        save_cache_index(index)
+
+
+# delete objects which are not linked by any entry, return the size of the rest
+def collect_cache_objects(objects: str):
+    total = 0
+    if not os.path.exists(objects):
+        return total
+
+    for root, dirs, files in os.walk(objects):
+        for f in files:
+            path = os.path.join(root, f)
+            st = os.stat(path)
+            if st.st_nlink <= 1:
+                if is_windows_platform():
+                    set_writable(path)
+                os.remove(path)
+                continue
+            total += st.st_size
+    return total
+
+
+# ---------------------- Archives ----------------------
+# every published package is also a tar.gz under 'archives/<package>/<hash>.tar.gz' of the library repo,
+# and 'archives/<version>.json' is the index of a version:
+# { version, ts, root: {file, size, sha256}, packages: {package: {file, size, sha256}} }
+# the root archive holds the files of the version folder (sdk-config.json ...).
+# install downloads only the archives it needs over the pooled session, and extracts them into the cache.
+# the archives are plain git blobs (raw.githubusercontent.com serves LFS files as pointers), so they store
+# the LFS binaries of the packages a second time, and a version with an archive over ARCHIVE_MAX_MB
+# is published without archives (its clients install from the git library repo)
+def get_archive_base_url():
+    if not is_empty_str(archive_base_url):
+        return archive_base_url.rstrip('/')
+    return f'{VERSION_LIST_URL.rsplit("/", 1)[0]}/{ARCHIVE_PATH}'
+
+
+# the archive index of the version, None if the version has no archives (published before) or it can't be fetched
+@traced('fetch_archive_index', 'http')
+def fetch_archive_index(version: str):
+    if offline_mode or not archive_mode:
+        return None
+
+    url = f'{get_archive_base_url()}/{version}.json'
+    session = get_http_session()
+    with trace_span('GET archive index', 'http', url=url) as span:
+        try:
+            resp = session.get(url, timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+        except requests.RequestException as e:
+            print(f'fetch archive index failed: {e}')
+            span['error'] = str(e)
+            return None
+        span['status'] = resp.status_code
+        span['bytes'] = len(resp.content)
+
+    if resp.status_code != 200:
+        if resp.status_code != 404:
+            print(f'fetch archive index failed: [{resp.status_code}] {url}')
+        return None
+
+    try:
+        doc = resp.json()
+    except ValueError:
+        print(f'wrong archive index format: {url}')
+        return None
+    if 'root' not in doc or 'packages' not in doc:
+        return None
+    return doc
+
+
+# make sure the version@ts entry is cached, only the archives are downloaded (no git is needed)
+# return '' when the version has no archives, then the git library repo is used
+def prepare_sdk_version_from_archives(version: str, excludes: list = None):
+    if offline_mode or not archive_mode:
+        return ''
+
+    doc = fetch_version_doc(version)
+    if doc is None or version not in doc['versions']:
+        return ''
+    ts = str(doc['versions'][version]['ts'])
+
+    # the entry may be built from the git library repo before
+    if has_cache_entry(version, ts):
+        with file_lock(SDK_LOCK):
+            return ensure_cache_entry(version, ts, excludes)
+
+    archive_index = fetch_archive_index(version)
+    if archive_index is None or str(archive_index.get('ts')) != ts:
+        return ''
+    return ensure_cache_entry(version, ts, excludes, archive_index)
+
+
+# build a new entry from the archives of the version, the excluded packages are not downloaded
+# return (size, the packages which are not downloaded), size is -1 if any archive failed
+def build_cache_entry_from_archives(archive_index: dict, entry: str, excludes: list = None):
+    temp = f'{entry}.tmp'
+    if os.path.exists(temp):
+        remove_cache_tree(temp)
+
+    names = [n for n in archive_index['packages'] if excludes is None or n not in excludes]
+    jobs = [(archive_index['root'], temp)] + [(archive_index['packages'][n], path_join(temp, n)) for n in names]
+    size = fetch_archives(jobs)
+    if size < 0:
+        return -1, []
+
+    os.rename(temp, entry)
+    return size, [n for n in archive_index['packages'] if n not in names]
+
+
+# download the archives of the packages which were skipped when the entry was built, and swap them into the entry
+# return the packages which are still incomplete
+def fill_cache_entry_from_archives(version: str, ts: str, entry: str, packages: list):
+    archive_index = fetch_archive_index(version)
+    if archive_index is None or str(archive_index.get('ts')) != ts:
+        print(f'archives of {", ".join(packages)} can not be downloaded for [{version}]')
+        return packages
+
+    print(f'Download archives of {", ".join(packages)} into [{get_cache_entry_name(version, ts)}]')
+    packages = [p for p in packages if p in archive_index['packages']]
+    for p in packages:
+        if os.path.exists(path_join(entry, f'{p}.new')):
+            remove_cache_tree(path_join(entry, f'{p}.new'))
+    if fetch_archives([(archive_index['packages'][p], path_join(entry, f'{p}.new')) for p in packages]) < 0:
+        return packages
+
+    for p in packages:
+        to_path = path_join(entry, p)
+        if os.path.exists(to_path):
+            os.rename(to_path, f'{to_path}.old')
+        os.rename(f'{to_path}.new', to_path)
+        if os.path.exists(f'{to_path}.old'):
+            remove_cache_tree(f'{to_path}.old')
+    return []
+
+
+# download the archives in a thread pool, each one is extracted as soon as it is downloaded
+# jobs: [(archive, dest)], return the size of the extracted files, -1 if any of them failed
+# objects: where the extracted files are stored, the objects of the sdk cache by default
+@traced('fetch_archives', 'http')
+def fetch_archives(jobs: list, objects: str = ''):
+    import tarfile
+    from concurrent.futures import ThreadPoolExecutor
+
+    if is_empty_str(objects):
+        objects = path_join(get_sdk_cache_home(), 'objects')
+
+    def fetch(job: tuple):
+        archive, dest = job
+        path = download_archive(archive)
+        if path is None:
+            return -1
+        try:
+            with trace_span('extract_archive', 'file', path=dest):
+                size = extract_archive(path, dest, objects)
+        except (OSError, EOFError, tarfile.TarError) as e:
+            print(f'extract {archive["file"]} failed: {e}')
+            return -1
+        finally:
+            os.remove(path)
+        return size
+
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_JOBS) as pool:
+        sizes = list(pool.map(fetch, jobs))
+    if any(size < 0 for size in sizes):
+        return -1
+    return sum(sizes)
+
+
+# download one archive into ARCHIVE_DOWNLOAD_PATH, an interrupted download is resumed by a Range request
+# return the local path, None if it can't be downloaded or its sha256 doesn't match
+def download_archive(archive: dict):
+    url = f'{get_archive_base_url()}/{archive["file"]}'
+    path = to_safe_path(f'{get_user_home()}/{ARCHIVE_DOWNLOAD_PATH}/{archive["sha256"]}.tar.gz')
+    part = f'{path}.part'
+    ensure_dir(os.path.dirname(path))
+    session = get_http_session()
+
+    for attempt in range(HTTP_RETRIES + 1):
+        start = os.path.getsize(part) if os.path.exists(part) else 0
+        if start >= archive['size']:
+            # a complete (or broken) download left by the last run
+            if start == archive['size'] and hash_sha256(part) == archive['sha256']:
+                os.replace(part, path)
+                return path
+            os.remove(part)
+            start = 0
+
+        headers = {'Range': f'bytes={start}-'} if start > 0 else {}
+        with trace_span(f'GET {archive["file"]}', 'http', url=url, offset=start) as span:
+            try:
+                with session.get(url, headers=headers, stream=True,
+                                 timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)) as resp:
+                    span['status'] = resp.status_code
+                    if resp.status_code not in (200, 206):
+                        print(f'download {archive["file"]} failed: [{resp.status_code}] {url}')
+                        return None
+                    # 200: the server ignores the Range, start from the beginning
+                    with open(part, 'ab' if resp.status_code == 206 else 'wb') as f:
+                        for chunk in resp.iter_content(1024 * 1024):
+                            f.write(chunk)
+            except requests.RequestException as e:
+                print(f'download {archive["file"]} interrupted, resume it: {e}')
+                span['error'] = str(e)
+                continue
+            span['bytes'] = os.path.getsize(part) - start
+
+    if os.path.exists(part) and os.path.getsize(part) == archive['size'] and hash_sha256(part) == archive['sha256']:
+        os.replace(part, path)
+        return path
+    print(f'download {archive["file"]} failed: wrong size or sha256')
+    if os.path.exists(part):
+        os.remove(part)
+    return None
+
+
+def hash_sha256(path: str):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+# stream-extract an archive into dest, every file is stored once in the objects and hardlinked into dest
+def extract_archive(path: str, dest: str, objects: str):
+    import tarfile
+
+    size = 0
+    ensure_dir(dest)
+    with tarfile.open(path, 'r|gz') as tar:
+        for member in tar:
+            name = os.path.normpath(member.name)
+            if os.path.isabs(name) or name.split(os.sep)[0] == '..':
+                raise tarfile.TarError(f'unsafe path in archive: {member.name}')
+            to_path = path_join(dest, name)
+            if member.isdir():
+                ensure_dir(to_path)
+                continue
+            if not member.isfile():
+                continue
+            ensure_dir(os.path.dirname(to_path))
+            obj = store_cache_stream(objects, tar.extractfile(member), member.mode & 0o111 != 0)
+            link_or_copy(obj, to_path)
+            size += member.size
+    return size
+
+
+# ---------------------- Verify ----------------------
+# verify the cached version trees against the file manifest of each version, and repair the bad files
+# return False if any file can not be repaired
+@traced('verify_sdk_cache', 'cache')
+def verify_sdk_cache(version: str = ''):
+    # the repair checks out files in the sdk_home and rewrites the objects of the entries
+    with file_lock(SDK_LOCK), file_lock(CACHE_LOCK):
+        return verify_sdk_cache_locked(version)
+
+
+def verify_sdk_cache_locked(version: str = ''):
+    index = load_cache_index()
+    entries = [info for info in index['entries'].values() if is_empty_str(version) or info['version'] == version]
+    if len(entries) == 0:
+        print(f'nothing to verify in the sdk cache {version}')
+        return True
+
+    ok = True
+    for info in entries:
+        name = get_cache_entry_name(info['version'], info['ts'])
+        entry = get_cache_entry_path(info['version'], info['ts'])
+        start = time.time()
+
+        manifest = load_file_manifest(entry, info.get('lfs_excluded', []))
+        if manifest is None:
+            print(f'[SKIP] {name}  no {FILE_MANIFEST_JSON}, the version is published before the manifest')
+            continue
+
+        hashes = hash_files([path_join(entry, rel) for rel in manifest])
+        bad = {rel: expected for rel, expected in manifest.items() if hashes[path_join(entry, rel)] != expected}
+        if len(bad) == 0:
+            print(f'[ OK ] {name}  {len(manifest)} files  {time.time() - start:.1f}s')
+            continue
+
+        print(f'[ BAD] {name}  {len(bad)} of {len(manifest)} files are missing or changed')
+        for rel in list(bad)[:20]:
+            print(f'    {rel}')
+        failed = repair_cache_files(info['version'], info['ts'], entry, bad, info.get('source', 'git'))
+        if len(failed) > 0:
+            ok = False
+            print(f'[FAIL] {name}  {len(failed)} files can not be repaired, sync the version again')
+        else:
+            print(f'[ FIX] {name}  {len(bad)} files repaired  {time.time() - start:.1f}s')
+
+    save_hash_memo()
+    return ok
+
+
+# {relative path: [size, sha1]} of a cached version, the packages without LFS files are skipped
+def load_file_manifest(entry: str, lfs_excluded: list):
+    path = path_join(entry, FILE_MANIFEST_JSON)
+    if not os.path.exists(path):
+        return None
+    try:
+        doc = load_json_file(path)
+    except ValueError:
+        return None
+
+    manifest = dict(doc.get('files', {}))
+    for package, files in doc.get('packages', {}).items():
+        if package in lfs_excluded:
+            continue
+        for rel, expected in files.items():
+            manifest[f'{package}/{rel}'] = expected
+    return manifest
+
+
+# restore the bad files of a cache entry from the sdk home (checked out again from git when it's also bad),
+# or from the package archives when the entry was built from them (source 'archive')
+# the cache object is fixed in place, so every entry which links to it is fixed together
+# return the files which can not be repaired
+def repair_cache_files(version: str, ts: str, entry: str, bad: dict, source: str = 'git'):
+    if source == 'archive':
+        return repair_cache_files_from_archives(version, ts, entry, bad)
+
+    sdk_home = get_sdk_home()
+    if get_local_version_ts(version) != ts:
+        print(f'the sdk home is not at [{get_cache_entry_name(version, ts)}], can not repair from it')
+        return list(bad)
+
+    if not offline_mode:
+        ensure_sparse_version(sdk_home, version)
+    stale = [rel for rel in bad if not is_good_file(path_join(sdk_home, f'{version}/{rel}'), bad[rel])]
+    if len(stale) > 0 and not offline_mode:
+        print(f'checkout {len(stale)} files of [{version}] again')
+        pathspec = path_join(sdk_home, '.git/guru-repair-paths')
+        write_file(pathspec, '\n'.join([f'{version}/{rel}' for rel in stale]) + '\n')
+        run_cmd(f'git checkout HEAD --pathspec-from-file="{pathspec}"', sdk_home)
+        includes = ','.join([f'{version}/{rel}' for rel in stale])
+        run_cmd(f'{get_lfs_git()} lfs pull --include="{includes}"', sdk_home)
+
+    return restore_cache_files(path_join(sdk_home, version), entry, bad)
+
+
+# download the archives which hold the bad files again, the root files are in the root archive
+# return the files which can not be repaired
+def repair_cache_files_from_archives(version: str, ts: str, entry: str, bad: dict):
+    name = get_cache_entry_name(version, ts)
+    archive_index = fetch_archive_index(version)
+    if archive_index is None or str(archive_index.get('ts')) != ts:
+        print(f'the archives of [{name}] can not be downloaded, can not repair from them')
+        return list(bad)
+
+    temp = f'{entry}.repair-{secrets.token_hex(4)}'
+    packages = sorted({rel.split('/')[0] for rel in bad if '/' in rel})
+    jobs = [(archive_index['packages'][p], path_join(temp, p)) for p in packages if p in archive_index['packages']]
+    if any('/' not in rel for rel in bad):
+        jobs.append((archive_index['root'], temp))
+
+    print(f'download {len(jobs)} archives of [{name}] again')
+    try:
+        # extracted into their own objects, so the bad objects of the cache are not linked again
+        fetch_archives(jobs, path_join(temp, '.objects'))
+        return restore_cache_files(temp, entry, bad)
+    finally:
+        if os.path.exists(temp):
+            remove_cache_tree(temp)
+
+
+def is_good_file(path: str, expected: list):
+    return os.path.isfile(path) and os.path.getsize(path) == expected[0] and hash_file(path) == expected[1]
+
+
+# copy the good files of version_root into the objects and link them into the entry
+# return the files which are also bad in version_root
+def restore_cache_files(version_root: str, entry: str, bad: dict):
+    objects = path_join(get_sdk_cache_home(), 'objects')
+    failed = []
+    for rel, expected in bad.items():
+        source = path_join(version_root, rel)
+        if not is_good_file(source, expected):
+            failed.append(rel)
+            continue
+
+        obj = path_join(objects, f'{expected[1][:2]}/{expected[1][2:]}')
+        if not os.path.exists(obj):
+            ensure_dir(os.path.dirname(obj))
+            materialize_file(source, obj)
+            set_read_only(obj)
+        elif not is_good_file(obj, expected):
+            # write into the same inode, the hardlinks in the other entries are fixed too
+            set_writable(obj)
+            shutil.copyfile(source, obj)
+            set_read_only(obj)
+
+        to_path = path_join(entry, rel)
+        if not os.path.exists(to_path) or not os.path.samefile(obj, to_path):
+            ensure_dir(os.path.dirname(to_path))
+            temp = f'{to_path}.{secrets.token_hex(4)}.tmp'
+            link_or_copy(obj, temp)
+            if os.path.exists(to_path) and is_windows_platform():
+                set_writable(to_path)
+            os.replace(temp, to_path)
+    return failed
+
+
+# ---------------------- Network ----------------------
+# import requests on the first network call, it's only installed by pip when the import fails
+# (the import itself is the dependency check, the actions without network never pay for it)
+def import_requests():
+    global requests
+    if requests is not None:
+        return requests
+
+    try:
+        import requests as _requests
+    except ImportError:
+        print("Installing required dependencies...")
+        subprocess.check_call([sys.executable, '-m', 'pip', 'install', 'requests'])
+        import requests as _requests
+
+    requests = _requests
+    return requests
+
+
+# one pooled session for all requests, with retry and backoff on connection errors and 5xx
+def get_http_session():
+    global http_session
+    if http_session is not None:
+        return http_session
+
+    import_requests()
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retry = Retry(total=HTTP_RETRIES,
+                  backoff_factor=0.5,
+                  status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=('GET', 'HEAD'))
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=4, pool_maxsize=8)
+
+    http_session = requests.Session()
+    http_session.mount('https://', adapter)
+    http_session.mount('http://', adapter)
+    return http_session
+
+
+def get_version_list_cache_path(cache_name: str = VERSION_LIST_CACHE):
+    return to_safe_path(f'{get_user_home()}/{cache_name}')
+
+
+def load_version_list_cache(cache_name: str = VERSION_LIST_CACHE):
+    path = get_version_list_cache_path(cache_name)
+    if not os.path.exists(path):
+        return None
+
+    try:
+        cache = load_json_file(path)
+    except ValueError:
+        print(f'broken version_list cache: {path}')
+        return None
+
+    if cache is None or 'doc' not in cache:
+        return None
+    return cache
+
+
+def save_version_list_cache(cache: dict, cache_name: str = VERSION_LIST_CACHE):
+    path = get_version_list_cache_path(cache_name)
+    ensure_dir(os.path.dirname(path))
+    write_file(path, json.dumps(cache))
+
+
+# fetch the online version_list.json
+# the cached copy is used inside the ttl, then revalidated by ETag/If-Modified-Since,
+# and it's also the fallback when the server can not be reached or in offline mode
+# cache_name: the local cache of the url, the root of the sharded index has its own
+@traced('fetch_version_list', 'http')
+def fetch_version_list(url: str = '', cache_name: str = VERSION_LIST_CACHE):
+    if is_empty_str(url):
+        url = VERSION_LIST_URL
+    cache = load_version_list_cache(cache_name)
+    if cache is not None and cache.get('url', url) != url:
+        cache = None
+
+    if offline_mode:
+        if cache is None:
+            print('offline mode: no cached version_list')
+            return None
+        print('offline mode: use cached version_list')
+        return cache['doc']
+
+    if cache is not None and time.time() - cache.get('fetched_at', 0) < version_list_ttl:
+        return cache['doc']
+
+    headers = {}
+    if cache is not None:
+        if not is_empty_str(cache.get('etag')):
+            headers['If-None-Match'] = cache['etag']
+        if not is_empty_str(cache.get('last_modified')):
+            headers['If-Modified-Since'] = cache['last_modified']
+
+    session = get_http_session()
+    with trace_span('GET version_list', 'http', url=url) as span:
+        try:
+            resp = session.get(url, headers=headers, timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+        except requests.RequestException as e:
+            print(f'fetch version_list failed: {e}')
+            span['error'] = str(e)
+            return cache['doc'] if cache is not None else None
+        span['status'] = resp.status_code
+        span['bytes'] = len(resp.content)
+
+    if resp.status_code == 304 and cache is not None:
+        cache['fetched_at'] = time.time()
+        save_version_list_cache(cache, cache_name)
+        return cache['doc']
+
+    # not published (e.g. a library without the sharded index), don't ask again inside the ttl
+    if resp.status_code == 404:
+        save_version_list_cache({'url': url, 'fetched_at': time.time(), 'doc': None}, cache_name)
+        return None
+
+    if resp.status_code != 200:
+        print(f'fetch version_list failed: [{resp.status_code}] {url}')
+        return cache['doc'] if cache is not None else None
+
+    try:
+        doc = resp.json()
+    except ValueError:
+        print(f'wrong version_list format: {url}')
+        return cache['doc'] if cache is not None else None
+
+    save_version_list_cache({
+        'url': url,
+        'etag': resp.headers.get('ETag', ''),
+        'last_modified': resp.headers.get('Last-Modified', ''),
+        'fetched_at': time.time(),
+        'doc': doc,
+    }, cache_name)
+    return doc
+
+
+# ---------------------- Version index ----------------------
+# the sharded version index in the library repo:
+# 'index/root.json' = { latest, channels: {name: version}, shards: {major.minor: file} }
+# 'index/<major.minor>-<sha256>.json' = { versions: {version: {ts, desc}} }, a shard never changes once published,
+# a new publish writes a new shard file and points the root to it.
+# the clients fetch the root (revalidated like version_list.json) and only the shards they need
+def get_version_index_url(name: str):
+    return f'{VERSION_LIST_URL.rsplit("/", 1)[0]}/{VERSION_INDEX_PATH}/{name}'
+
+
+# '1.4.2-beta.1' -> '1.4', the shard of the version
+def get_version_shard_key(version: str):
+    core = version.strip().lstrip('vV').split('+')[0].split('-')[0]
+    return '.'.join(core.split('.')[:2])
+
+
+# the version_list of the version (only the versions in its shard), or of all versions when version is empty
+# it has the same shape as version_list.json, which is still used when the library has no sharded index
+@traced('fetch_version_doc', 'http')
+def fetch_version_doc(version: str = ''):
+    root = fetch_version_list(get_version_index_url('root.json'), VERSION_ROOT_CACHE)
+    if root is None or 'shards' not in root:
+        return fetch_version_list()
+
+    if is_empty_str(version):
+        names = list(root['shards'].values())
+    else:
+        key = get_version_shard_key(version)
+        names = [root['shards'][key]] if key in root['shards'] else []
+
+    versions = {}
+    for name in names:
+        shard = fetch_version_shard(name)
+        if shard is None:
+            return fetch_version_list()
+        versions.update(shard.get('versions', {}))
+    return {'latest': root.get('latest', ''), 'channels': root.get('channels', {}), 'versions': versions}
+
+
+# the version_list of the version from the local caches only: no network and no file writes
+# (the cached root + shard, or the cached version_list.json), None when nothing is cached
+# max_age: the caches which were fetched longer ago are ignored, None for any age
+def load_cached_version_doc(version: str, max_age: float = None):
+    def is_fresh(c: dict):
+        return c is not None and (max_age is None or time.time() - c.get('fetched_at', 0) < max_age)
+
+    cache = load_version_list_cache(VERSION_ROOT_CACHE)
+    root = cache['doc'] if is_fresh(cache) else None
+    if root is not None and 'shards' in root:
+        key = get_version_shard_key(version)
+        path = to_safe_path(f'{get_user_home()}/{VERSION_SHARD_CACHE}/{root["shards"].get(key, "")}')
+        if key in root['shards'] and os.path.exists(path):
+            try:
+                shard = load_json_file(path)
+                return {'latest': root.get('latest', ''), 'channels': root.get('channels', {}),
+                        'versions': shard.get('versions', {})}
+            except ValueError:
+                pass
+
+    cache = load_version_list_cache()
+    return cache['doc'] if is_fresh(cache) else None
+
+
+# a shard is immutable, it's downloaded once and then read from the local cache
+def fetch_version_shard(name: str):
+    path = to_safe_path(f'{get_user_home()}/{VERSION_SHARD_CACHE}/{name}')
+    if os.path.exists(path):
+        try:
+            return load_json_file(path)
+        except ValueError:
+            os.remove(path)
+    if offline_mode:
+        return None
+
+    url = get_version_index_url(name)
+    session = get_http_session()
+    with trace_span('GET version shard', 'http', url=url) as span:
+        try:
+            resp = session.get(url, timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+        except requests.RequestException as e:
+            print(f'fetch version shard failed: {e}')
+            span['error'] = str(e)
+            return None
+        span['status'] = resp.status_code
+        span['bytes'] = len(resp.content)
+
+    # the file name ends with the sha256 of the content
+    if resp.status_code != 200 or not name.endswith(f'-{hashlib.sha256(resp.content).hexdigest()[:16]}.json'):
+        print(f'fetch version shard failed: [{resp.status_code}] {url}')
+        return None
+    try:
+        doc = json.loads(resp.content)
+    except ValueError:
+        print(f'wrong version shard format: {url}')
+        return None
+
+    ensure_dir(os.path.dirname(path))
+    write_file_atomic(path, resp.content)
+    return doc
+
+
+# ---------------------- Versions ----------------------
+# the sorted version index built from version_list.json, it's rebuilt only when the version_list changes
+# index = { source: sha1 of the version_list, latest, channels: {name: version}, versions: [{version, ts, desc, key}] }
+@traced('get_version_index', 'versions')
+def get_version_index():
+    doc = fetch_version_doc()
+    if doc is None:
+        local = path_join(get_sdk_home(), VERSION_LIST)
+        if not os.path.exists(local):
+            return None
+        doc = load_json_file(local)
+
+    source = hashlib.sha1(json.dumps(doc, sort_keys=True).encode('utf-8')).hexdigest()
+    path = to_safe_path(f'{get_user_home()}/{VERSION_INDEX_CACHE}')
+    if os.path.exists(path):
+        try:
+            index = load_json_file(path)
+            if index.get('source') == source:
+                return index
+        except ValueError:
+            pass
+
+    versions = []
+    for v, info in doc.get('versions', {}).items():
+        key = version_key(v)
+        if key is None:
+            print(f'skip the version which is not semver: {v}')
+            continue
+        versions.append({'version': v, 'ts': str(info.get('ts', '')), 'desc': info.get('desc', ''), 'key': key})
+    versions.sort(key=lambda item: to_version_key(item['key']), reverse=True)
+
+    index = {
+        'source': source,
+        'latest': doc.get('latest', ''),
+        'channels': doc.get('channels', {}),
+        'versions': versions,
+    }
+    ensure_dir(os.path.dirname(path))
+    write_file(path, json.dumps(index))
+    return index
+
+
+# '1.4.2-beta.1' -> [[1, 4, 2], 0, [[1, 0, 'beta'], [0, 1, '']]], None if it's not a version
+# (the release flag is 1 for a release, so a release is sorted after its prereleases)
+def version_key(version: str):
+    core, _, pre = version.strip().lstrip('vV').split('+')[0].partition('-')
+    nums = []
+    for x in core.split('.'):
+        if not x.isdigit():
+            return None
+        nums.append(int(x))
+    nums = nums + [0] * (3 - len(nums))
+    pre_key = [[0, int(p), ''] if p.isdigit() else [1, 0, p] for p in pre.split('.')] if len(pre) > 0 else []
+    return [nums, 0 if len(pre) > 0 else 1, pre_key]
+
+
+# the version key (loaded from json) as a comparable tuple
+def to_version_key(key: list):
+    return tuple(key[0]), key[1], tuple(tuple(p) for p in key[2])
+
+
+# a plain version like '1.4.2', which doesn't need the index ('v1.4.2' is resolved to '1.4.2' first)
+def is_exact_version(spec: str):
+    if spec.startswith(('v', 'V')):
+        return False
+    key = version_key(spec)
+    return key is not None and len(spec.split('-')[0].split('.')) >= 3
+
+
+# the conditions of a range: [[(op, key)]], the inner lists are AND, the outer list is OR
+# supports: 1.4.x / 1.4.* / 1.4 / ^1.4.0 / ~1.4.2 / >=1.2.0 <2.0.0 / 1.2.0 || 1.3.x
+def parse_version_range(spec: str):
+    alternatives = []
+    for part in spec.split('||'):
+        conds = []
+        # a bare operator belongs to the next token: '>= 1.4.0' is '>=1.4.0'
+        tokens = []
+        for token in part.split():
+            if len(tokens) > 0 and tokens[-1] in ['>=', '<=', '>', '<', '=', '^', '~']:
+                tokens[-1] += token
+            else:
+                tokens.append(token)
+        if len(tokens) > 0 and tokens[-1] in ['>=', '<=', '>', '<', '=', '^', '~']:
+            return None
+
+        for token in tokens:
+            op = ''
+            for o in ['>=', '<=', '>', '<', '=', '^', '~']:
+                if token.startswith(o):
+                    op, token = o, token[len(o):]
+                    break
+            token = token.lstrip('vV')
+
+            if token in ['*', 'x', 'X']:
+                continue
+            parts = token.split('-')[0].split('.')
+            wild = [p for p in parts if p in ['*', 'x', 'X']]
+            nums = [p for p in parts if p not in ['*', 'x', 'X']]
+            if not all(p.isdigit() for p in nums):
+                return None
+
+            if op == '' and (len(wild) > 0 or len(nums) < 3):
+                # a partial version: every version with this prefix
+                op, token = '^prefix', '.'.join(nums)
+            key = to_version_key(version_key(token))
+            major, minor, patch = key[0][0], key[0][1], key[0][2]
+
+            if op == '^prefix':
+                upper = [int(n) for n in nums]
+                upper[-1] += 1
+                conds += [('>=', (key[0], 0, ())), ('<', (tuple(upper + [0] * (3 - len(upper))), 0, ()))]
+            elif op == '^':
+                upper = (major + 1, 0, 0) if major > 0 else (0, minor + 1, 0)
+                conds += [('>=', key), ('<', (upper, 0, ()))]
+            elif op == '~':
+                conds += [('>=', key), ('<', ((major, minor + 1, 0), 0, ()))]
+            else:
+                conds.append((op or '=', key))
+        alternatives.append(conds)
+    return alternatives
+
+
+def match_version_range(alternatives: list, key: tuple):
+    ops = {
+        '>=': lambda a, b: a >= b, '<=': lambda a, b: a <= b,
+        '>': lambda a, b: a > b, '<': lambda a, b: a < b, '=': lambda a, b: a == b,
+    }
+    return any(all(ops[op](key, k) for op, k in conds) for conds in alternatives)
+
+
+# the versions of the index which match the spec (a range, 'latest' or a channel), newest first
+def find_versions(index: dict, spec: str = ''):
+    if is_empty_str(spec) or spec in ['*', 'x']:
+        return [item['version'] for item in index['versions']]
+
+    if spec == 'latest' or spec in index['channels']:
+        v = index['latest'] if spec == 'latest' else index['channels'][spec]
+        if is_empty_str(v):
+            releases = [item['version'] for item in index['versions'] if item['key'][1] == 1]
+            v = releases[0] if len(releases) > 0 else ''
+        return [v] if not is_empty_str(v) else []
+
+    if spec in [item['version'] for item in index['versions']]:
+        return [spec]
+
+    alternatives = parse_version_range(spec)
+    if alternatives is None:
+        return []
+
+    # prereleases only match a range which asks for them
+    with_pre = '-' in spec
+    return [item['version'] for item in index['versions']
+            if (with_pre or item['key'][1] == 1) and match_version_range(alternatives, to_version_key(item['key']))]
+
+
+# resolve the --version value to an exact version, '' if nothing matches
+def resolve_version(spec: str):
+    spec = spec.strip()
+    if is_exact_version(spec.lstrip('vV')):
+        return spec.lstrip('vV')
+
+    index = get_version_index()
+    if index is None:
+        print('version_list not found, can not resolve the version')
+        return ''
+
+    found = find_versions(index, spec)
+    return found[0] if len(found) > 0 else ''
+
+
+# print the versions which match the spec
+def list_versions(spec: str = ''):
+    index = get_version_index()
+    if index is None:
+        print('version_list not found')
+        exit(ERROR_PATH_NOT_FOUND)
+
+    tags = {}
+    tags.setdefault(index['latest'], []).append('latest')
+    for name, v in index['channels'].items():
+        tags.setdefault(v, []).append(name)
+
+    items = {item['version']: item for item in index['versions']}
+    found = find_versions(index, spec)
+    for v in found:
+        item = items.get(v, {'ts': '', 'desc': ''})
+        tag = f'  [{", ".join(tags[v])}]' if v in tags else ''
+        print(f'{v:<16} {item["ts"]:<12} {item["desc"]}{tag}')
+    print(f'{len(found)} versions')
+
+
 # ---------------------- Install ----------------------
 # install from unity project
 def install_by_unit_proj(unity_proj: str):
-    sdk_data = path_join(unity_proj, f'ProjectSettings/guru-sdk-installer.json')
-    if not os.path.exists(sdk_data):
+    version, error = load_unity_proj_version(unity_proj)
+    if version is None:
+        print(f'{error}: {unity_proj}')
         exit(ERROR_PATH_NOT_FOUND)
 
-    doc = json.loads(read_file(sdk_data))
-    version = doc['install_version']
     sync_and_install_sdk(unity_proj, version)
 
 
+# the version saved by the installer in the unity project, None when there is none
+def get_unity_proj_version(unity_proj: str):
+    return load_unity_proj_version(unity_proj)[0]
+
+
+# (version, '') or (None, why there is no version)
+def load_unity_proj_version(unity_proj: str):
+    sdk_data = path_join(unity_proj, INSTALLER_JSON)
+    if not os.path.exists(sdk_data):
+        return None, f'{INSTALLER_JSON} not found'
+
+    try:
+        doc = load_json_file(sdk_data)
+    except ValueError as e:
+        return None, f'wrong {INSTALLER_JSON}: {e}'
+    version = doc.get('install_version') if isinstance(doc, dict) else None
+    if not isinstance(version, str) or is_empty_str(version):
+        return None, f'no install_version in {INSTALLER_JSON}'
+    return version, ''
+
+
+# why the project can't be installed, '' when it can
+# the json files the install reads are parsed up front, so a broken one fails its own project with the real cause
+def check_unity_project(unity_proj: str):
+    if not os.path.isdir(unity_proj):
+        return 'unity project not found'
+
+    manifest_path = path_join(unity_proj, f'{UNITY_PACKAGES_ROOT}/{UNITY_MANIFEST_JSON}')
+    if not os.path.exists(manifest_path):
+        return f'{UNITY_PACKAGES_ROOT}/{UNITY_MANIFEST_JSON} not found'
+
+    for name in [f'{UNITY_PACKAGES_ROOT}/{UNITY_MANIFEST_JSON}', GURU_SERVICES]:
+        path = path_join(unity_proj, name)
+        if not os.path.exists(path):
+            continue
+        try:
+            load_json_file(path)
+        except ValueError as e:
+            return f'wrong {name}: {e}'
+    return ''
+
+
+# the ts which the installer pinned with the version in the unity project, '' when it's not pinned
+def get_unity_proj_ts(unity_proj: str, version: str):
+    sdk_data = path_join(unity_proj, INSTALLER_JSON)
+    if not os.path.exists(sdk_data):
+        return ''
+
+    try:
+        doc = load_json_file(sdk_data)
+    except ValueError:
+        return ''
+    if doc.get('install_version') != version or not doc.get('install_ts'):
+        return ''
+    return str(doc['install_ts'])
+
+
 # sync and install sdk from local cache
 def sync_and_install_sdk(unity_proj: str, version: str):
+    # nothing changed since the last install, leave the project and the log untouched
+    if not force_install and is_install_up_to_date(unity_proj, version):
+        print(f'[{version}] is up to date in {unity_proj}, use --force to install again')
+        return
+
     clear_log()
 
+    version_cache = prepare_sdk_version(version, get_disabled_packages(unity_proj))
+    install_sdk_to_project(unity_proj, version, version_cache)
+    pass
+
+
+# make sure the version is synced and cached, return the cached version entry
+# excludes: the packages which are turned off, their LFS files are not pulled
+@traced('prepare_sdk_version', 'install')
+def prepare_sdk_version(version: str, excludes: list = None):
+    # the published archives are enough, the library repo is not touched
+    entry = prepare_sdk_version_from_archives(version, excludes)
+    if not is_empty_str(entry):
+        return entry
+
     version_home = path_join(get_sdk_home(), VERSION_LIST)
 
     if not os.path.exists(version_home):
         # version not exists
         # 1st time try to sync latest lib repo
-        sync_sdk(False)
+        sync_sdk(False, version, excludes=excludes)
         # 2nd if version_home still not exists
         if not os.path.exists(version_home):
             print(f'Version not found {version}, check version_list first!')
@@ -310,59 +2121,361 @@ def sync_and_install_sdk(unity_proj: str, version: str):
             exit(ERROR_PATH_NOT_FOUND)
     else:
         # check version should update
-        local_version_list = json.loads(read_file(version_home))
-        need_update = True
-        if version in local_version_list['versions']:
-            need_update = should_update_sdk(version, str(local_version_list['versions'][version]['ts']))
+        ts = get_local_version_ts(version)
+        need_update = should_update_sdk(version, ts)
+
+        # the sparse clone may not contain this version yet
+        if not has_cache_entry(version, ts) and not os.path.exists(path_join(get_sdk_home(), version)):
+            need_update = True
 
         if need_update:
-            sync_sdk(False)
+            sync_sdk(False, version, excludes=excludes)
 
-    install_sdk_to_project(unity_proj, version)
-    pass
+    # link the project against the cached version@ts entry, another sync can't replace the sdk_home meanwhile
+    with file_lock(SDK_LOCK):
+        return ensure_cache_entry(version, get_local_version_ts(version), excludes)
+
+
+# install many projects in one run, versions: {project: version}
+# every distinct version is synced once, then the projects are installed in a process pool
+@traced('batch_install_sdk', 'install')
+def batch_install_sdk(versions: dict):
+    clear_log()
+    results = {}
+
+    # check every project first, a broken one fails alone with its own cause, then group the others by version
+    groups = {}
+    for proj, version in versions.items():
+        error = check_unity_project(proj)
+        if is_empty_str(error) and is_empty_str(version):
+            # unity_install: the version of guru-sdk-installer.json
+            error = load_unity_proj_version(proj)[1] or 'version not found'
+        if not is_empty_str(error):
+            results[proj] = {'ok': False, 'seconds': 0, 'error': error}
+            continue
+        groups.setdefault(version, []).append(proj)
+
+    jobs = []
+    for version, projs in groups.items():
+        # the projects which are up to date are skipped, as in sync_and_install_sdk
+        if not force_install:
+            for proj in [proj for proj in projs if is_install_up_to_date(proj, version)]:
+                results[proj] = {'ok': True, 'seconds': 0, 'error': '', 'up_to_date': True}
+                projs.remove(proj)
+        if len(projs) == 0:
+            continue
 
+        # a package is only skipped when every project of the version turns it off
+        excludes = None
+        for proj in projs:
+            disabled = get_disabled_packages(proj)
+            excludes = disabled if excludes is None else [p for p in excludes if p in disabled]
+
+        start = time.time()
+        try:
+            version_cache = prepare_sdk_version(version, excludes)
+        except SystemExit as e:
+            for proj in projs:
+                results[proj] = {'ok': False, 'seconds': 0, 'error': f'prepare {version} failed: {e.code}'}
+            continue
+        print(f'prepare [{version}] for {len(projs)} projects in {time.time() - start:.1f}s')
+        jobs += [(proj, version, version_cache) for proj in projs]
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    global cmd_count
+    with ProcessPoolExecutor(max_workers=max(1, publish_jobs)) as pool:
+        for proj, result in zip([j[0] for j in jobs], pool.map(install_project_worker, jobs)):
+            print(result.pop('log'), end='')
+            results[proj] = result
+            # the commands run inside the workers
+            cmd_count += result['cmds']
+
+    print('===== install projects =====')
+    failed = [proj for proj in results if not results[proj]['ok']]
+    for proj in versions:
+        r = results[proj]
+        if r.get('up_to_date'):
+            print(f'[ OK ] {proj}  [{versions[proj]}]  up to date, use --force to install again')
+        elif r['ok']:
+            print(f'[ OK ] {proj}  [{versions[proj]}]  {r["seconds"]:.1f}s')
+        else:
+            print(f'[FAIL] {proj}  [{versions[proj]}]  {r["seconds"]:.1f}s  {r["error"]}')
+    print(f'{len(results) - len(failed)} succeeded, {len(failed)} failed')
+
+    if len(failed) > 0:
+        log_failed(f'install failed: {", ".join(failed)}')
+        exit(ERROR_BATCH_INSTALL_FAILED)
+    log_success(f'install complete: {len(results)} projects')
+
+
+# install one project inside the process pool
+def install_project_worker(job: tuple):
+    global forward_cmd_stderr
+    proj, version, version_cache = job
+    start = time.time()
+    start_cmds = cmd_count
+    result = {'ok': False, 'seconds': 0, 'error': '', 'cmds': 0, 'log': ''}
+
+    # the output of the worker (and the stderr of its commands) is printed by the parent process,
+    # it goes where the parent prints, e.g. to the daemon client, and the projects don't interleave
+    import io
+    log = io.StringIO()
+    forward_cmd_stderr = True
+    try:
+        with contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+            install_sdk_to_project(proj, version, version_cache)
+        result['ok'] = True
+    except SystemExit as e:
+        result['error'] = f'exit {e.code}'
+    except Exception as e:
+        result['error'] = str(e)
+    result['seconds'] = time.time() - start
+    result['cmds'] = cmd_count - start_cmds
+    result['log'] = log.getvalue()
+    return result
+
+
+# expand the --proj values: a path, a glob, or @file with one path per line
+def expand_project_paths(items: list):
+    paths = []
+    for item in items or []:
+        if item.startswith('@'):
+            lines = read_file(item[1:]).splitlines()
+            found = [line.strip() for line in lines if len(line.strip()) > 0 and not line.strip().startswith('#')]
+        elif any(c in item for c in '*?['):
+            found = sorted(glob.glob(item))
+        else:
+            found = [item]
+
+        for p in found:
+            if p not in paths:
+                paths.append(p)
+    return paths
+
+
+# get the ts of the version in local version_list.json
+def get_local_version_ts(version: str):
+    version_home = path_join(get_sdk_home(), VERSION_LIST)
+    if not os.path.exists(version_home):
+        return ''
 
+    local_version_list = load_json_file(version_home)
+    if version not in local_version_list['versions']:
+        return ''
+    return str(local_version_list['versions'][version]['ts'])
+
+
+@traced('should_update_sdk', 'install')
 def should_update_sdk(version: str, ts: str):
     if is_empty_str(version) or is_empty_str(ts):
         return True
 
     # check online version list
-    resp = requests.get(VERSION_LIST_URL)
-    if resp.status_code == 200:
-        doc = resp.json()
-        for v in doc['versions']:
-            if v == version:
-                online_ts = str(doc['versions'][v]['ts'])
-                if online_ts == ts:
-                    print(f'Version [{version}] :: local:[{ts}] not match online:[{online_ts}], need to update sdk')
-                    return False
-        pass
+    doc = fetch_version_doc(version)
+    if doc is None:
+        # nothing to compare with, keep the local one in offline mode
+        return not offline_mode
+
+    if version in doc['versions']:
+        online_ts = str(doc['versions'][version]['ts'])
+        if online_ts == ts:
+            return False
+        print(f'Version [{version}] :: local:[{ts}] not match online:[{online_ts}], need to update sdk')
     return True
 
 
 # download latest sdk
-def sync_sdk(show_log: bool = True):
+# with a version the local clone is kept and only `version_list.json` + the version folder are fetched,
+# without a version (or with full=True) the whole library repo is cloned like before
+# excludes: the packages of the version whose LFS files are not pulled
+@traced('sync_sdk', 'sync')
+def sync_sdk(show_log: bool = True, version: str = '', full: bool = False, excludes: list = None):
     sdk_home = get_sdk_home()
 
-    # only support for quick clone, so every time it will remove all files, then clone it again
-    if os.path.exists(sdk_home):
-        # remove old files
-        delete_dir(sdk_home)
-        pass
-    os.makedirs(sdk_home)
-
-    print(f'Clone sdk into {sdk_home}')
-    run_cmd(f'git clone --depth 1 {SDK_LIB_REPO} .', sdk_home)
+    if offline_mode:
+        print(f'offline mode: skip sync, use local sdk at {sdk_home}')
+        if show_log and os.path.exists(path_join(sdk_home, VERSION_LIST)):
+            log_success('sync skipped (offline), use local sdk')
+        elif show_log:
+            log_failed(f'offline mode: no local sdk at {sdk_home}')
+        return
 
-    # 添加 LFS 文件拉取逻辑
-    cmd = f'git lfs install && git lfs pull'
-    run_cmd(cmd, sdk_home)
+    # one sync at a time, the other processes wait for it and then see the complete sdk_home
+    with file_lock(SDK_LOCK):
+        if full or not os.path.exists(path_join(sdk_home, '.git')):
+            clone_sdk_repo(sdk_home, version, full, excludes)
+        else:
+            fetch_sdk_repo(sdk_home, version, excludes)
 
     if show_log:
         log_success('sync complete')
     pass
 
+
+# fresh clone of the lib repo into a staging folder, it replaces the sdk_home only when it is complete
+@traced('clone_sdk_repo', 'sync')
+def clone_sdk_repo(sdk_home: str, version: str = '', full: bool = False, excludes: list = None):
+    clean_stale_dirs(sdk_home)
+    staging = f'{sdk_home}.staging-{secrets.token_hex(4)}'
+    os.makedirs(staging)
+
+    try:
+        # the LFS objects of the clone are kept in the shared storage
+        lfs_storage = f'-c lfs.storage="{get_lfs_storage()}"'
+        if full or is_empty_str(version):
+            # blob-less partial clone of every version, the archives are left out of the checkout so
+            # their blobs are never downloaded (install fetches them over http)
+            print(f'Clone sdk into {staging}')
+            run_cmd(f'git clone {lfs_storage} --depth 1 --filter=blob:none --no-checkout -b {SDK_LIB_BRANCH} '
+                    f'{SDK_LIB_REPO} .', staging)
+            run_cmd(f'git lfs install --local --skip-smudge', staging)
+            set_full_sparse_patterns(staging)
+            run_cmd(f'git checkout -q {SDK_LIB_BRANCH}', staging)
+
+            # 添加 LFS 文件拉取逻辑
+            run_cmd(f'{get_lfs_git()} lfs pull', staging)
+        else:
+            # blob-less partial clone, the cone only contains the root files (version_list.json) at first
+            print(f'Clone sdk [{version}] into {staging}')
+            run_cmd(f'git clone {lfs_storage} --depth 1 --filter=blob:none --sparse -b {SDK_LIB_BRANCH} '
+                    f'{SDK_LIB_REPO} .', staging)
+            # LFS files are pulled explicitly below, only for the checked out version and the enabled packages
+            run_cmd(f'git lfs install --local --skip-smudge', staging)
+            run_cmd(f'git sparse-checkout set {version}', staging)
+            save_lfs_excludes(staging, {version: excludes or []})
+            pull_sdk_lfs(staging, [version])
+
+        if not os.path.exists(path_join(staging, VERSION_LIST)):
+            print(f'clone sdk failed, keep the sdk at {sdk_home}')
+            return
+
+        swap_dir(staging, sdk_home)
+    finally:
+        if os.path.exists(staging):
+            delete_dir(staging)
+    pass
+
+
+# incremental update of an existing clone in sdk_home
+@traced('fetch_sdk_repo', 'sync')
+def fetch_sdk_repo(sdk_home: str, version: str = '', excludes: list = None):
+    # a full clone of an older cli still checks out the archives, it's turned into a blob-less one without them
+    if not is_sparse_sdk_repo(sdk_home):
+        run_cmd(f'git config remote.origin.promisor true', sdk_home)
+        run_cmd(f'git config remote.origin.partialclonefilter blob:none', sdk_home)
+        set_full_sparse_patterns(sdk_home)
+    sparse = not is_full_sdk_repo(sdk_home)
+
+    print(f'Fetch sdk updates into {sdk_home}')
+    run_cmd(f'git fetch --depth 1 --filter=blob:none origin {SDK_LIB_BRANCH}', sdk_home)
+    run_cmd(f'git reset --hard FETCH_HEAD', sdk_home)
+
+    lfs_excludes = load_lfs_excludes(sdk_home)
+    if not is_empty_str(version):
+        lfs_excludes[version] = excludes or []
+    save_lfs_excludes(sdk_home, lfs_excludes)
+
+    if not sparse:
+        if is_empty_str(version):
+            save_lfs_excludes(sdk_home, {})
+            run_cmd(f'{get_lfs_git()} lfs pull', sdk_home)
+        else:
+            pull_sdk_lfs(sdk_home, [version])
+        return
+
+    # the projects link the cache entries, a version which is cached is dropped from the cone,
+    # only the versions which are not cached yet stay checked out with the requested one
+    dirs = get_sparse_versions(sdk_home)
+    if not is_empty_str(version):
+        dirs = [d for d in dirs if d != version and not has_cache_entry(d, get_local_version_ts(d))] + [version]
+        run_cmd(f'git sparse-checkout set {" ".join(dirs)}', sdk_home)
+
+    pull_sdk_lfs(sdk_home, dirs)
+    pass
+
+
+# the version folders in the sparse cone of the sdk_home
+def get_sparse_versions(sdk_home: str):
+    dirs = [d.strip() for d in run_cmd(f'git sparse-checkout list', sdk_home, False).splitlines()]
+    return [d for d in dirs if len(d) > 0]
+
+
+# check out a version which was dropped from the sparse cone, e.g. to repair or fill its cache entry
+def ensure_sparse_version(sdk_home: str, version: str):
+    if not is_full_sdk_repo(sdk_home) and version not in get_sparse_versions(sdk_home):
+        run_cmd(f'git sparse-checkout add {version}', sdk_home)
+
+
+# pull the LFS files of the version folders, the packages recorded in the excludes are skipped
+def pull_sdk_lfs(sdk_home: str, versions: list):
+    if len(versions) == 0:
+        return
+
+    lfs_excludes = load_lfs_excludes(sdk_home)
+    includes = ','.join([f'{v}/**' for v in versions])
+    excludes = ','.join([f'{v}/{p}/**' for v in versions for p in lfs_excludes.get(v, [])])
+    if len(excludes) > 0:
+        print(f'skip LFS files: {excludes}')
+        run_cmd(f'{get_lfs_git()} lfs pull --include="{includes}" --exclude="{excludes}"', sdk_home)
+    else:
+        run_cmd(f'{get_lfs_git()} lfs pull --include="{includes}"', sdk_home)
+    pass
+
+
+# the packages whose LFS files are not pulled into sdk_home: {version: [package]}
+def load_lfs_excludes(sdk_home: str):
+    path = path_join(sdk_home, f'.git/{LFS_EXCLUDES_JSON}')
+    if not os.path.exists(path):
+        return {}
+    try:
+        return load_json_file(path)
+    except ValueError:
+        return {}
+
+
+def save_lfs_excludes(sdk_home: str, excludes: dict):
+    if not os.path.exists(path_join(sdk_home, '.git')):
+        return
+    write_file(path_join(sdk_home, f'.git/{LFS_EXCLUDES_JSON}'), json.dumps(excludes, indent=2))
+
+
+# the LFS objects are shared by the sdk repo, the publish repos and the git package mirrors
+def get_lfs_storage():
+    return to_safe_path(f'{get_user_home()}/{LFS_STORAGE_PATH}')
+
+
+# git with the shared LFS storage
+def get_lfs_git():
+    return f'git -c lfs.storage="{get_lfs_storage()}"'
+
+
+# the sdk_home is a partial clone with sparse checkout
+def is_sparse_sdk_repo(sdk_home: str):
+    return os.path.exists(path_join(sdk_home, '.git/info/sparse-checkout'))
+
+
+# the full clone checks out every version, only the archives are left out
+def set_full_sparse_patterns(sdk_home: str):
+    patterns = ' '.join([f'"{p}"' for p in FULL_SPARSE_PATTERNS])
+    run_cmd(f'git sparse-checkout set --no-cone {patterns}', sdk_home)
+
+
+def is_full_sdk_repo(sdk_home: str):
+    path = path_join(sdk_home, '.git/info/sparse-checkout')
+    return not os.path.exists(path) or read_file(path).split() == FULL_SPARSE_PATTERNS
+
+
+# the selectable packages which are turned off by the project
+def get_disabled_packages(unity_proj_path: str):
+    init_selectable_packages(unity_proj_path)
+    return sorted([s['package_name'] for s in setting_to_package.values() if s['enable'] is False])
+
+
 def init_selectable_packages(unity_proj_path: str):
+    for setting_name in setting_to_package:
+        setting_to_package[setting_name]["enable"] = default_package_enables[setting_name]
+
     guru_services_path = path_join(unity_proj_path, GURU_SERVICES)
     if os.path.exists(guru_services_path) is False:
         return
@@ -390,11 +2503,128 @@ def init_selectable_packages(unity_proj_path: str):
 
 
 # sync latest sdk repo to the path '~/.guru/unity/guru-sdk'
-def install_sdk_to_project(unity_proj_path: str, version: str):
+# version_home: the cached version entry to link, default is the version folder in sdk_home
+# only the changed links and files are touched, so Unity won't reimport an up-to-date project
+@traced('install_sdk_to_project', 'install')
+def install_sdk_to_project(unity_proj_path: str, version: str, version_home: str = ''):
     init_selectable_packages(unity_proj_path)
 
-    sdk_home = get_sdk_home()
-    version_home = path_join(sdk_home, version)
+    if is_empty_str(version_home):
+        version_home = path_join(get_sdk_home(), version)
+
+    plan = make_install_plan(unity_proj_path, version_home)
+    if plan is None:
+        return
+
+    apply_install_plan(unity_proj_path, plan)
+    save_install_stamp(unity_proj_path, version, version_home)
+    log_success('install complete')
+
+
+# ---------------------- Install stamp ----------------------
+# the stamp in the project records what the last install made: {version, ts, features, inputs, links}
+# inputs is the hash of everything the install reads from the project, so the next install with the same
+# version and ts can be skipped without the sync, the plan and any file write
+def get_install_stamp_path(unity_proj_path: str):
+    return path_join(unity_proj_path, INSTALL_STAMP_JSON)
+
+
+# the ts of the installed version, taken from the cache entry name (version@ts)
+def get_version_home_ts(version: str, version_home: str):
+    name = os.path.basename(os.path.normpath(version_home))
+    if name.startswith(f'{version}@'):
+        return name[len(version) + 1:]
+    return get_local_version_ts(version)
+
+
+# {setting: enable} of the selectable packages in the project
+def get_project_features(unity_proj_path: str):
+    init_selectable_packages(unity_proj_path)
+    return {k: v['enable'] for k, v in setting_to_package.items()}
+
+
+def hash_install_inputs(unity_proj_path: str, version: str, ts: str, features: dict):
+    sha = hashlib.sha1(json.dumps([VERSION, version, ts, features], sort_keys=True).encode('utf-8'))
+    manifest_path = path_join(unity_proj_path, f'{UNITY_PACKAGES_ROOT}/{UNITY_MANIFEST_JSON}')
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'rb') as f:
+            sha.update(f.read())
+    return sha.hexdigest()
+
+
+@traced('save_install_stamp', 'install')
+def save_install_stamp(unity_proj_path: str, version: str, version_home: str):
+    ts = get_version_home_ts(version, version_home)
+    features = get_project_features(unity_proj_path)
+    upm_root = path_join(unity_proj_path, UNITY_PACKAGES_ROOT)
+    stamp = {
+        'version': version,
+        'ts': ts,
+        'features': features,
+        'inputs': hash_install_inputs(unity_proj_path, version, ts, features),
+        'links': {d: os.readlink(path_join(upm_root, d)) for d in sorted(os.listdir(upm_root))
+                  if d.startswith(UPM_PREFIX) and os.path.islink(path_join(upm_root, d))},
+    }
+    register_cache_project(unity_proj_path, version_home)
+
+    path = get_install_stamp_path(unity_proj_path)
+    if os.path.exists(path):
+        try:
+            if load_json_file(path) == stamp:
+                return
+        except ValueError:
+            pass
+    write_file_atomic(path, json.dumps(stamp, indent=2).encode('utf-8'))
+
+
+# the stamp matches the version, its ts, the features and the inputs, and every link it made still points
+# to an existing package. nothing is fetched or written.
+# the ts is the one pinned in the project, or else the one of the cached version index inside the ttl (any age
+# in offline mode). without a fresh index the slow path checks the library
+@traced('is_install_up_to_date', 'install')
+def is_install_up_to_date(unity_proj_path: str, version: str):
+    path = get_install_stamp_path(unity_proj_path)
+    if not os.path.exists(path):
+        return False
+    try:
+        stamp = load_json_file(path)
+    except ValueError:
+        return False
+    if stamp.get('version') != version:
+        return False
+
+    pinned = get_unity_proj_ts(unity_proj_path, version)
+    if not is_empty_str(pinned):
+        if stamp.get('ts') != pinned:
+            return False
+    else:
+        doc = load_cached_version_doc(version, None if offline_mode else version_list_ttl)
+        if doc is None:
+            return False
+        if version in doc.get('versions', {}):
+            if str(doc['versions'][version]['ts']) != stamp.get('ts'):
+                return False
+        elif stamp.get('ts') != get_local_version_ts(version):
+            return False
+
+    features = get_project_features(unity_proj_path)
+    if stamp.get('features') != features:
+        return False
+    if stamp.get('inputs') != hash_install_inputs(unity_proj_path, version, stamp['ts'], features):
+        return False
+
+    upm_root = path_join(unity_proj_path, UNITY_PACKAGES_ROOT)
+    for name, target in stamp.get('links', {}).items():
+        link = path_join(upm_root, name)
+        if not is_same_link(link, target) or not os.path.exists(link):
+            return False
+    return True
+
+
+# compare the project with the sdk version, and collect what should be changed
+# plan = { links_add: {name: source}, links_remove: [name], manifest: dict|None, add_macros, remove_macros }
+@traced('make_install_plan', 'install')
+def make_install_plan(unity_proj_path: str, version_home: str):
     upm_root = path_join(unity_proj_path, UNITY_PACKAGES_ROOT)
     manifest_path = path_join(unity_proj_path, f'{UNITY_PACKAGES_ROOT}/{UNITY_MANIFEST_JSON}')
     sdk_config = path_join(version_home, SDK_CONFIG_JSON)
@@ -404,92 +2634,292 @@ def install_sdk_to_project(unity_proj_path: str, version: str):
         exit(ERROR_SDK_CONFIG_NOT_FOUND)
         pass
 
-    # clean old sdk files
-    clean_old_soft_links(upm_root)
+    if not os.path.exists(upm_root):
+        print(f'Path not found: {upm_root}')
+        exit(ERROR_PATH_NOT_FOUND)
 
     manifest_json = load_unity_manifest_json(manifest_path)
     if manifest_json is None:
-        return 
+        return None
+
+    cfg = json.loads(read_file(sdk_config))
+    if cfg is None or cfg['packages'] is None:
+        print('json parse error with', sdk_config, 'plz fix the errors')
+        return None
 
     add_macros = list()
     remove_macros = list()
     selectable_packages = {}
 
-    # install all packages from sdk-config
-    with open(sdk_config, 'r', encoding='utf-8') as f:
-        txt = f.read()
-        # print(txt)
-        cfg = json.loads(txt)
+    # 使用 for 循环遍历映射关系，动态设置 selectable_packages
+    for setting_key in setting_to_package:
+        enable = setting_to_package[setting_key]["enable"]
+        selectable_packages[setting_to_package[setting_key]["package_name"]] = enable
+        macro = setting_to_package[setting_key]["macro"]
+        if enable is True:
+            add_macros.append(macro)
+        else:
+            remove_macros.append(macro)
+
+    # the links which the project should have, only the dependency closure of the enabled packages
+    packages = []
+    for p in cfg['packages']:
+        if not os.path.exists(path_join(version_home, p)):
+            print(f'package [{p}] not found, skip install...')
+            continue
+        packages.append(p)
+
+    disabled = [p for p in packages if selectable_packages.get(p) is False]
+    closure = resolve_package_closure(version_home, packages, disabled)
+    if len(closure) < len(packages) - len(disabled):
+        print(f'link {len(closure)} of {len(packages)} packages, the others are not needed by the enabled packages')
+
+    links = {}
+    for p in closure:
+        links[f'{UPM_PREFIX}{p}'] = path_join(version_home, p)
+
+    # the links which the project has now
+    links_remove = []
+    for d in os.listdir(upm_root):
+        if not d.startswith(UPM_PREFIX):
+            continue
+        if d in links and is_same_link(path_join(upm_root, d), links[d]):
+            del links[d]
+            continue
+        links_remove.append(d)
+
+    # 先移除 sdk 包和废弃包的依赖, the manifest is only saved when it changes
+    deps = dict(manifest_json['dependencies'])
+    for p in list(cfg['packages']) + removeList:
+        if p in deps:
+            del deps[p]
+
+    new_manifest = None
+    if deps != manifest_json['dependencies']:
+        new_manifest = dict(manifest_json)
+        new_manifest['dependencies'] = deps
+
+    # the lock entries of the linked packages, so unity has nothing to resolve after the install
+    lock_path = path_join(unity_proj_path, f'{UNITY_PACKAGES_ROOT}/{UNITY_PACKAGES_LOCK_JSON}')
+    new_lock = make_packages_lock(lock_path, version_home, closure, list(cfg['packages']) + removeList,
+                                  new_manifest or manifest_json)
+
+    return {
+        'links_add': links,
+        'links_remove': links_remove,
+        'manifest': new_manifest,
+        'packages_lock': new_lock,
+        'add_macros': add_macros,
+        'remove_macros': remove_macros,
+    }
+
+
+# the packages-lock.json with an embedded entry for every linked package, derived from its package.json,
+# and an entry for every package they depend on, as unity writes it: the depth is the shortest path from the
+# manifest, the entries nothing depends on any more (e.g. the sdk packages which are not linked) are removed.
+# the entries unity wrote are kept, a registry package which is new to the lock gets the required version and
+# no dependencies, only the registry knows them (unity adds them when it resolves the package)
+# return None if the lock doesn't exist (unity resolves the whole project anyway) or nothing changes
+def make_packages_lock(lock_path: str, version_home: str, linked: list, sdk_packages: list, manifest: dict):
+    if not os.path.exists(lock_path):
+        return None
+    try:
+        lock = load_json_file(lock_path)
+    except ValueError:
+        print(f'wrong {UNITY_PACKAGES_LOCK_JSON}, unity will resolve it: {lock_path}')
+        return None
 
-        if cfg is None or cfg['packages'] is None:
-            print('json parse error with', sdk_config, 'plz fix the errors')
+    old = lock.get('dependencies', None) or {}
+    entries = {}
+    for name, item in old.items():
+        if name in linked or name in sdk_packages or not isinstance(item, dict):
+            continue
+        # an embedded package of an earlier sdk version
+        if item.get('source') == 'embedded' and str(item.get('version', '')).startswith(f'file:{UPM_PREFIX}'):
+            continue
+        entries[name] = item
+
+    for name in linked:
+        package_json = path_join(version_home, f'{name}/package.json')
+        requires = {}
+        if os.path.exists(package_json):
+            try:
+                requires = load_json_file(package_json).get('dependencies', None) or {}
+            except ValueError:
+                print(f'wrong package.json: {package_json}')
+        entries[name] = {
+            'version': f'file:{UPM_PREFIX}{name}',
+            'depth': 0,
+            'source': 'embedded',
+            'dependencies': dict(requires),
+        }
+
+    # walk from the manifest and the linked packages, the shortest path comes first
+    from collections import deque
+    queue = deque([(name, 0, v) for name, v in manifest.get('dependencies', {}).items()] +
+                  [(name, 0, None) for name in linked])
+    deps = {}
+    while len(queue) > 0:
+        name, depth, required = queue.popleft()
+        if name in deps:
+            raise_lock_version(deps[name], required)
+            continue
+        if name in entries:
+            item = dict(entries[name])
+        elif version_key(required or '') is not None:
+            item = make_registry_lock_entry(name, required, manifest)
+        else:
+            # a git or local package which unity has not resolved yet
+            continue
+        item['depth'] = depth
+        raise_lock_version(item, required)
+        deps[name] = item
+        for d, v in (item.get('dependencies', None) or {}).items():
+            queue.append((d, depth + 1, v))
+
+    if deps == old:
+        return None
+    # sorted by name as unity writes them, the modules come last
+    new_lock = dict(lock)
+    new_lock['dependencies'] = dict(sorted(deps.items(),
+                                           key=lambda d: (d[0].startswith(UNITY_BUILTIN_PREFIX), d[0])))
+    return new_lock
+
+
+# the lock entry of a registry (or builtin) package which is not in the lock yet
+def make_registry_lock_entry(name: str, version: str, manifest: dict):
+    if name.startswith(UNITY_BUILTIN_PREFIX):
+        return {'version': version, 'depth': 0, 'source': 'builtin', 'dependencies': {}}
+    return {'version': version, 'depth': 0, 'source': 'registry', 'dependencies': {},
+            'url': get_registry_url(name, manifest)}
+
+
+# unity resolves a registry package to the highest version which is required
+def raise_lock_version(item: dict, required: str):
+    if item.get('source') != 'registry' or required is None:
+        return
+    key, locked = version_key(required), version_key(str(item.get('version', '')))
+    if key is not None and locked is not None and to_version_key(key) > to_version_key(locked):
+        item['version'] = required
+
+
+# the registry of the package: the scoped registry of the manifest with the longest matching scope, or unity's
+def get_registry_url(name: str, manifest: dict):
+    scope, url = '', UNITY_REGISTRY_URL
+    for registry in manifest.get('scopedRegistries', None) or []:
+        for s in registry.get('scopes', None) or []:
+            if (name == s or name.startswith(f'{s}.')) and len(s) > len(scope):
+                scope, url = s, registry.get('url', url)
+    return url
+
+
+# ---------------------- Dependencies ----------------------
+# {package: [the packages of the same version it depends on]}, read from the package.json of each package
+@traced('get_dependency_graph', 'install')
+def get_dependency_graph(version_home: str, packages: list):
+    # the cache entries never change, their graphs are kept for the next install (daemon, batch)
+    key = (version_home, tuple(packages))
+    immutable = version_home.startswith(get_sdk_cache_home())
+    if immutable and key in dependency_graph_memo:
+        return dependency_graph_memo[key]
+
+    graph = {}
+    for p in packages:
+        package_json = path_join(version_home, f'{p}/package.json')
+        deps = {}
+        if os.path.exists(package_json):
+            try:
+                deps = load_json_file(package_json).get('dependencies', None) or {}
+            except ValueError:
+                print(f'wrong package.json: {package_json}')
+        graph[p] = [d for d in deps if d in packages and d != p]
+
+    if immutable:
+        dependency_graph_memo[key] = graph
+    return graph
+
+
+# the packages needed by the enabled packages, dependencies first
+# a package is dropped when it's disabled, or when every package which depends on it is dropped,
+# a disabled package is still linked when an enabled package depends on it
+def resolve_package_closure(version_home: str, packages: list, disabled: list):
+    graph = get_dependency_graph(version_home, packages)
+    dependents = {p: [q for q in packages if p in graph[q]] for p in packages}
+
+    dropped = set(disabled)
+    changed = True
+    while changed:
+        changed = False
+        for p in packages:
+            if p not in dropped and len(dependents[p]) > 0 and all(q in dropped for q in dependents[p]):
+                dropped.add(p)
+                changed = True
+    roots = [p for p in packages if p not in dropped]
+
+    order = []
+    visited = set()
+
+    def visit(p: str, parent: str):
+        if p in visited:
             return
+        visited.add(p)
+        if p in disabled:
+            print(f'[{p}] is turned off, but it is required by [{parent}]')
+        for d in graph[p]:
+            visit(d, p)
+        order.append(p)
 
-        # 先移除
-        for p in cfg['packages']:
-            if p in manifest_json['dependencies']:
-                del manifest_json['dependencies'][p]
-
-        for p in removeList:
-            if p in manifest_json['dependencies']:
-                del manifest_json['dependencies'][p]        
-
-        # 使用 for 循环遍历映射关系，动态设置 selectable_packages
-        for setting_key in setting_to_package:
-            enable = setting_to_package[setting_key]["enable"]
-            selectable_packages[setting_to_package[setting_key]["package_name"]] = enable
-            macro = setting_to_package[setting_key]["macro"]
-            if enable is True:
-                print(f'add {macro} to add_macros')
-                add_macros.append(macro)
-            else: 
-                remove_macros.append(macro)    
-
-        for p in cfg['packages']:
-            in_path = path_join(version_home, p)
-            if not os.path.exists(in_path):
-                print(f'package [{p}] not found, skip install...')
-                continue
+    for root in roots:
+        visit(root, '')
+    return order
 
-            if p in selectable_packages:
-                if selectable_packages[p] is False:
-                    continue
 
-            # 添加软连接
-            print(f'Add package at path: {in_path}')
-            make_softlink(in_path, p, upm_root)
+@traced('apply_install_plan', 'install')
+def apply_install_plan(unity_proj_path: str, plan: dict):
+    upm_root = path_join(unity_proj_path, UNITY_PACKAGES_ROOT)
+    manifest_path = path_join(unity_proj_path, f'{UNITY_PACKAGES_ROOT}/{UNITY_MANIFEST_JSON}')
 
-            # record deps
-            # 已经不再使用此方式引入 UPM
-            # manifest_json['dependencies'][p] = f'file:{UPM_PREFIX}{p}'
-            pass
-        # save the manifest file
-        save_unity_manifest_json(manifest_path, manifest_json)
-        pass
-    pass
+    print(f'install plan: +{len(plan["links_add"])} links, -{len(plan["links_remove"])} links, '
+          f'manifest {"changed" if plan["manifest"] is not None else "unchanged"}, '
+          f'lock {"changed" if plan.get("packages_lock") is not None else "unchanged"}')
+
+    # clean old or retargeted links
+    for name in plan['links_remove']:
+        delete_dir(path_join(upm_root, name))
+
+    # 添加软连接
+    for name, in_path in plan['links_add'].items():
+        print(f'Add package at path: {in_path}')
+        make_softlink(in_path, name[len(UPM_PREFIX):], upm_root)
+
+    # save the manifest file
+    if plan['manifest'] is not None:
+        save_unity_manifest_json(manifest_path, plan['manifest'])
+
+    # the lock file is written after the manifest, unity checks it against the manifest
+    if plan.get('packages_lock') is not None:
+        lock_path = path_join(unity_proj_path, f'{UNITY_PACKAGES_ROOT}/{UNITY_PACKAGES_LOCK_JSON}')
+        save_unity_manifest_json(lock_path, plan['packages_lock'])
 
     # 配置相关的宏
-    setup_unity_marcos(add_macros, remove_macros, unity_proj_path)
+    setup_unity_marcos(plan['add_macros'], plan['remove_macros'], unity_proj_path)
     # add .gitignore file
     make_git_ignore(unity_proj_path)
 
-    log_success('install complete')
 
+# the link at link_path exists and points to source_path
+def is_same_link(link_path: str, source_path: str):
+    if not os.path.islink(link_path):
+        return False
 
-def clean_old_soft_links(upm_root: str):
-    if not os.path.exists(upm_root):
-        print(f'Path not found: {upm_root}')
-        exit(ERROR_PATH_NOT_FOUND)
-
-    dirs = os.listdir(upm_root)
-    for d in dirs:
-        if d.startswith(UPM_PREFIX):
-            # clean the old softlink
-            delete_dir(path_join(upm_root, d))
-    pass
+    target = os.readlink(link_path)
+    if target.startswith('\\\\?\\'):
+        target = target[4:]  # windows extended path prefix
+    return os.path.normcase(os.path.abspath(target)) == os.path.normcase(os.path.abspath(source_path))
 
 
 # create softlink with os cmd
+@traced('make_softlink', 'file')
 def make_softlink(source_path: str, link_name: str, dest_dir: str):
     if is_empty_str(source_path):
         print(f'wrong source_path: [{source_path}]')
@@ -526,6 +2956,7 @@ def load_unity_manifest_json(path: str):
 
 
 # save jsonObject -> manifest.json
+@traced('save_unity_manifest_json', 'file')
 def save_unity_manifest_json(path: str, data: object):
     with open(path, 'w') as f:
         json_str = json.dumps(data, indent=2)
@@ -534,6 +2965,7 @@ def save_unity_manifest_json(path: str, data: object):
     pass
 
 
+@traced('make_git_ignore', 'install')
 def make_git_ignore(unity_project: str):
     file = path_join(unity_project, '.gitignore')
     comments = '# Guru UPM'
@@ -573,21 +3005,32 @@ def make_git_ignore(unity_project: str):
 
 # ---------------------- PUBLISH ----------------------
 # publish the new version
+@traced('publish_and_push', 'publish')
 def publish_and_push(source: str, output: str):
     # clone all remote upms
-    _version, sdk_config = build_version_packages_and_files(source, output)
+    _version, sdk_config, changed = build_version_packages_and_files(source, output)
 
-    # update version list
+    # update version list, and the sharded index made from it
     update_version_list(sdk_config, output)
+    changed += update_version_index(output)
 
     push_msg = f'Make version {_version} on  {datetime.datetime.now().strftime("%Y/%m/%d %H:%M:%S")}  by push'
 
-    # commit to the publishing repo
+    # commit to the publishing repo, only the changed packages are staged
     run_cmd(f'git lfs install', output)
-    run_cmd(f'git add .', output)
-    run_cmd(f'git commit -m \"{push_msg}\"', output)
-    run_cmd(f'git push', output)
-    run_cmd(f'git lfs push', output)
+    pathspec = path_join(output, '.git/guru-publish-paths')
+    write_file(pathspec, '\n'.join(changed + [VERSION_LIST]) + '\n')
+    # the archives are outside the sparse checkout of the publish workspace
+    sparse = ' --sparse' if is_sparse_sdk_repo(output) else ''
+    # a failed step exits with ERROR_CMD_FAILED, the version must not look published when it is not on the remote
+    run_cmd(f'git add -A{sparse} --pathspec-from-file="{pathspec}"', output, check=True)
+    run_cmd(f'git commit -m \"{push_msg}\"', output, check=True)
+    run_cmd(f'git lfs push origin {SDK_LIB_BRANCH}', output, check=True)
+    run_cmd(f'git push', output, check=True)
+
+    # the publish workspace keeps only the root files checked out for the next publish
+    if is_sparse_sdk_repo(output):
+        run_cmd(f'git sparse-checkout set', output)
 
     print('===== Publish is done! ======')
 
@@ -601,15 +3044,14 @@ def publish_and_push(source: str, output: str):
 
 # publish sdk vai cil or jenkins
 def publish_sdk_by_cli(publish_branch: str):
-    # clean old dirs
+    # clean old dirs, the output is the reused publish workspace
     td = path_join(CURRENT_PATH, 'source')
     delete_dir(td)
-    td = path_join(CURRENT_PATH, 'output')
-    delete_dir(td)
-    # download all repos
-    source = download_source_repo(publish_branch)
-    output = download_output_repo()
-    publish_and_push(source, output)
+    # the publish workspace is shared by every publish on this machine
+    with file_lock(PUBLISH_LOCK, PUBLISH_LOCK_TIMEOUT):
+        # download all repos
+        source, output = run_async(download_all_repos_async(publish_branch))
+        publish_and_push(source, output)
     pass
 
 
@@ -618,22 +3060,27 @@ def publish_from_unity_project(unity_project: str):
     # print('--- unity_project:', unity_project)
     source = os.path.dirname(unity_project)
     print('--- source:', source)
-    op = path_join(get_user_home(), SDK_TEMP_PATH)
-    output = download_output_repo(op)
-    print('--- output:', output)
-    publish_and_push(source, output)
-    delete_dir(output)
+    with file_lock(PUBLISH_LOCK, PUBLISH_LOCK_TIMEOUT):
+        output = download_output_repo()
+        print('--- output:', output)
+        publish_and_push(source, output)
     pass
 
 
 # download unity-gurusdk-dev repo to dest path ( the default pull_branch is 'main' )
+@traced('download_source_repo', 'publish')
 def download_source_repo(pull_branch: str = ''):
+    return run_async(download_source_repo_async(pull_branch))
+
+
+async def download_source_repo_async(pull_branch: str = ''):
+    import asyncio
     dest = path_join(CURRENT_PATH, 'source')
 
     # clear source from last pull
     if os.path.exists(dest):
         print('clear source path')
-        delete_dir(dest)
+        await asyncio.to_thread(delete_dir, dest)
 
     if len(pull_branch) == 0:
         pull_branch = 'main'
@@ -641,52 +3088,79 @@ def download_source_repo(pull_branch: str = ''):
     print(f'--- pull code form {SDK_DEV_REPO} with branch: {pull_branch}')
     print(f'--- create source at {dest}')
     os.makedirs(dest)
-    run_cmd(f'git clone -b {pull_branch} --depth=1 {SDK_DEV_REPO} .', dest)
-    run_cmd(f'git submodule update --init --recursive', dest)
+    await run_cmd_async(f'git clone -b {pull_branch} --depth=1 {SDK_DEV_REPO} .', dest, check=True)
+    await run_cmd_async(f'git submodule update --init --recursive', dest, check=True)
 
     return dest
     pass
 
 
 # download unity-gurusdk-library repo to dest path ( the default pull_branch is 'main' )
+# without a root the persistent publish workspace '~/.guru/unity/publish-workspace' is used
+@traced('download_output_repo', 'publish')
 def download_output_repo(root: str = ''):
-    if is_empty_str(root):
-        root = CURRENT_PATH
-        print(f'--- empty input root value, set to current dir: {root}')
+    return run_async(download_output_repo_async(root))
 
-    print('download_output_repo -> root:', root)
-    dest = path_join(root, 'output')
-    print('dest', dest)
 
-    # clear temp lib dir
-    if os.path.exists(dest):
-        print('clear output path')
-        delete_dir(dest)
-
-
-    # clone lib
-    print('create output at', dest)
-    os.makedirs(dest)
-    run_cmd(f'git clone {SDK_LIB_REPO} .', dest)
+async def download_output_repo_async(root: str = ''):
+    if is_empty_str(root):
+        dest = to_safe_path(f'{get_user_home()}/{PUBLISH_WORKSPACE_PATH}')
+    else:
+        dest = path_join(root, 'output')
+    print('download_output_repo -> dest:', dest)
 
+    await prepare_publish_workspace_async(dest)
     return dest
     pass
 
 
+# the publish workspace is a blob-less, depth 1 clone with sparse checkout,
+# only version_list.json (and the version being written, see build_version_packages_and_files) is checked out.
+# an existing workspace is refreshed by fetch + reset instead of a new clone
+async def prepare_publish_workspace_async(dest: str):
+    import asyncio
+    if not os.path.exists(path_join(dest, '.git')) or not is_sparse_sdk_repo(dest):
+        if os.path.exists(dest):
+            print('clear output path')
+            await asyncio.to_thread(delete_dir, dest)
+
+        print('create output at', dest)
+        os.makedirs(dest)
+        await run_cmd_async(f'git clone -c lfs.storage="{get_lfs_storage()}" --depth 1 --filter=blob:none --sparse '
+                            f'-b {SDK_LIB_BRANCH} {SDK_LIB_REPO} .', dest, check=True)
+        # the LFS files of the published versions are never needed on the publish machine
+        await run_cmd_async(f'git lfs install --local --skip-smudge', dest)
+        return
+
+    print('refresh output at', dest)
+    await run_cmd_async(f'git fetch --depth 1 --filter=blob:none origin {SDK_LIB_BRANCH}', dest, check=True)
+    await run_cmd_async(f'git reset -q --hard FETCH_HEAD', dest, check=True)
+    # drop the version checked out by the last publish, and the files left by a failed one
+    await run_cmd_async(f'git sparse-checkout set', dest, check=True)
+    await run_cmd_async(f'git clean -fdq', dest)
+
+
 # download the source proj 'unity-gurusdk-dev'
 # and the output proj 'unity-gurusdk-library'
 def download_all_repos(dev_branch: str):
     # download source and output
-    source = download_source_repo(dev_branch)
-    output = download_output_repo()
+    source, output = run_async(download_all_repos_async(dev_branch))
     log_success('download complete')
     return source, output
     pass
 
 
+# the source (clone + submodules) and the output are downloaded at the same time
+@traced('download_all_repos', 'publish')
+async def download_all_repos_async(dev_branch: str):
+    import asyncio
+    return await asyncio.gather(download_source_repo_async(dev_branch), download_output_repo_async())
+
+
 # collect call upm files from dev_project，
 # and collect them into ‘dev_project/packages’ path
 # all ump repos from GitHub will be cloned
+@traced('build_version_packages_and_files', 'publish')
 def build_version_packages_and_files(source: str, output: str):
     packages = path_join(source, 'packages')
     unity_proj_path = path_join(source, UNITY_DEV_PROJECT)
@@ -717,16 +3191,29 @@ def build_version_packages_and_files(source: str, output: str):
     sc = f'git submodule update --init --recursive'
     run_cmd(sc, source)
 
-    # clean and rebuild version folder
+    # the publish workspace only checks out the version being written
+    is_git_output = os.path.exists(path_join(output, '.git'))
+    if is_git_output and is_sparse_sdk_repo(output):
+        run_cmd(f'git sparse-checkout add {sdk_version}', output)
+
+    # the package hashes of this version when it is published again, and of the last published version
     dest = path_join(output, sdk_version)
-    if os.path.exists(dest):
+    old_hashes = load_package_hashes(output, sdk_version)
+    base_version = find_base_version(output, sdk_version)
+    base_hashes = load_package_hashes(output, base_version) if base_version else {}
+    old_manifest = load_version_json(output, sdk_version, FILE_MANIFEST_JSON).get('packages', {})
+    base_manifest = load_version_json(output, base_version, FILE_MANIFEST_JSON).get('packages', {}) \
+        if base_version else {}
+
+    # the version folder published before the package hashes can't be compared, rebuild it
+    changed = []
+    if os.path.exists(dest) and len(old_hashes) == 0:
         delete_dir(dest)
+        if is_git_output:
+            run_cmd(f'git rm -r -q --cached --ignore-unmatch {sdk_version}', output)
 
     ensure_dir(dest)
 
-    # copy submodules into version dir
-    run_cmd(f"cp {config_file} {path_join(dest, SDK_CONFIG_JSON)}")
-
     # # 1. copy all submodules in packages to dest
     # for item in os.listdir(submodules):
     #     dd = os.path.join(submodules, item)
@@ -740,19 +3227,24 @@ def build_version_packages_and_files(source: str, output: str):
         exit(ERROR_PATH_NOT_FOUND)
         pass
 
+    # the tree hash of each lib v2 folder
+    hashes = {}
+    lib_v2_packages = {}
     for item in os.listdir(lib_v2):
         from_path = os.path.join(lib_v2, item)
         if os.path.isdir(from_path):
             if item.startswith('.'):
                 continue
 
-            to_path = path_join(dest, item)
-            shutil.copytree(from_path, to_path)
+            lib_v2_packages[item] = from_path
+            with trace_span('hash_tree', 'file', path=from_path):
+                hashes[item] = hash_tree(from_path)
 
     # 2. clone all git upm from packages-lock.json to dest
     f = read_file(lock_file)
     lock_data = json.loads(f)
-    # additions = []
+    git_packages = []
+    all_git_packages = {}
     for pkg_id in lock_data['dependencies']:
 
         item = lock_data['dependencies'][pkg_id]
@@ -767,37 +3259,354 @@ def build_version_packages_and_files(source: str, output: str):
             if '#' in git_url:
                 git_url = git_url.split('#')[0]
 
-            to_path = path_join(dest, pkg_id)
+            # the lock hash of a git upm
+            all_git_packages[pkg_id] = (pkg_id, git_url, git_hash, path_join(dest, pkg_id))
+            hashes[pkg_id] = hashlib.sha1(f'git\0{git_url}#{git_hash}'.encode('utf-8')).hexdigest()
+        pass
 
-            if os.path.exists(to_path):
-                delete_dir(to_path)
+    # the packages which are dropped by this version
+    for name in old_hashes:
+        if name not in hashes:
+            delete_dir(path_join(dest, name))
+            changed.append(f'{sdk_version}/{name}')
+
+    # the file manifest of the unchanged packages is taken from the last publish
+    manifest = {}
+    kept, reused = 0, 0
+    for name, h in hashes.items():
+        to_path = path_join(dest, name)
+        if old_hashes.get(name) == h and os.path.exists(to_path) and name in old_manifest:
+            manifest[name] = old_manifest[name]
+            kept += 1
+            continue
 
-            os.mkdir(to_path)
+        if os.path.exists(to_path):
+            delete_dir(to_path)
+        if base_hashes.get(name) == h and name in base_manifest \
+                and reuse_base_package(output, base_version, sdk_version, name):
+            manifest[name] = base_manifest[name]
+            reused += 1
+            continue
 
-            print(f'clone {pkg_id}: {git_url} -> {to_path}')
+        changed.append(f'{sdk_version}/{name}')
+        if name in lib_v2_packages:
+            with trace_span('materialize_tree', 'file', path=to_path):
+                materialize_tree(lib_v2_packages[name], to_path)
+        else:
+            git_packages.append(all_git_packages[name])
 
-            sc = f'git clone --depth 1 {git_url} .'
-            run_cmd(sc, to_path)
-            sc = f'git checkout {git_hash}'
-            run_cmd(sc, to_path)
+    print(f'publish [{sdk_version}]: {kept} packages unchanged, {reused} reused from [{base_version}], '
+          f'{len(lib_v2_packages) + len(all_git_packages) - kept - reused} changed')
 
-            # 添加 LFS 文件拉取逻辑
-            cmd = f'git lfs install && git lfs pull'
-            run_cmd(cmd, to_path)
+    if not fetch_git_packages(git_packages):
+        exit(ERROR_GIT_PACKAGE_FAILED)
 
-            # delete .git folder in cloned folder
-            _git = path_join(to_path, '.git')
-            delete_dir(_git)
+    # copy submodules into version dir
+    materialize_file(config_file, path_join(dest, SDK_CONFIG_JSON))
+    write_file(path_join(dest, PACKAGE_HASHES_JSON), json.dumps({'packages': hashes}, indent=2))
+
+    # the file manifest of the version, the clients verify their caches with it
+    with trace_span('hash_files', 'file', path=dest):
+        for name in hashes:
+            if name not in manifest:
+                manifest[name] = hash_tree_files(path_join(dest, name))
+        root_files = hash_files([path_join(dest, SDK_CONFIG_JSON), path_join(dest, PACKAGE_HASHES_JSON)])
+    write_file(path_join(dest, FILE_MANIFEST_JSON), json.dumps({
+        'packages': manifest,
+        'files': {os.path.basename(p): h for p, h in root_files.items()},
+    }, indent=2))
+    changed += [f'{sdk_version}/{SDK_CONFIG_JSON}', f'{sdk_version}/{PACKAGE_HASHES_JSON}',
+                f'{sdk_version}/{FILE_MANIFEST_JSON}']
+    save_hash_memo()
+
+    # the package archives for the clients which install without git
+    with trace_span('build_version_archives', 'file', path=dest):
+        changed += build_version_archives(output, sdk_version, sdk_config['ts'], hashes, base_version)
+
+    return sdk_version, sdk_config, changed
+    pass
 
-            # additions.append(to_path)
-            pass
-        pass
 
-    return sdk_version, sdk_config
-    pass
+# {package: hash} of a published version
+def load_package_hashes(output: str, version: str):
+    return load_version_json(output, version, PACKAGE_HASHES_JSON).get('packages', {})
+
+
+# a json file of a published version, read from HEAD when the version is not checked out
+# a file which is not published returns {}, a broken one is reported and returns {}
+def load_version_json(output: str, version: str, name: str):
+    path = path_join(output, f'{version}/{name}')
+    try:
+        if os.path.exists(path):
+            return load_json_file(path)
+        if not os.path.exists(path_join(output, '.git')):
+            return {}
+        code, out = exec_cmd(f'git cat-file blob "HEAD:{version}/{name}"', output)
+        if code != 0:
+            # not in HEAD, e.g. the first publish of the version
+            return {}
+        return json.loads(out)
+    except json.JSONDecodeError as e:
+        print(f'can not parse {version}/{name}: {e}')
+        return {}
+
+
+# the latest published version (by ts) except sdk_version
+def find_base_version(output: str, sdk_version: str):
+    file_path = path_join(output, VERSION_LIST)
+    if not os.path.exists(file_path):
+        return ''
+
+    versions = json.loads(read_file(file_path)).get('versions', {})
+    for v in sorted(versions, key=lambda k: int(versions[k].get('ts', 0)), reverse=True):
+        if v != sdk_version:
+            return v
+    return ''
+
+
+# an unchanged package is staged from the tree of the base version (nothing is hashed again),
+# its files are hardlinked when the base version is checked out
+def reuse_base_package(output: str, base_version: str, sdk_version: str, name: str):
+    from_path = path_join(output, f'{base_version}/{name}')
+    prefix = f'{sdk_version}/{name}'
+
+    if os.path.exists(path_join(output, '.git')):
+        code, out = exec_cmd(f'git rm -r -q --cached --ignore-unmatch {prefix} '
+                             f'&& git read-tree --prefix={prefix}/ "HEAD:{base_version}/{name}"', output)
+        if code != 0:
+            print(f'can not reuse [{name}] from [{base_version}]: {out}')
+            return False
+        if not os.path.exists(from_path):
+            # only staged, the files of the sparse publish workspace are not checked out
+            return True
+    elif not os.path.exists(from_path):
+        return False
+
+    with trace_span('materialize_tree', 'file', path=from_path):
+        materialize_tree(from_path, path_join(output, prefix), True)
+    return True
+
+
+# pack every package of the version into 'archives/<package>/<hash>.tar.gz' and write 'archives/<version>.json',
+# an archive with the same package hash is already published (by this or the base version) and is not packed again
+# return the changed paths
+def build_version_archives(output: str, sdk_version: str, ts: str, hashes: dict, base_version: str):
+    dest = path_join(output, sdk_version)
+    is_git_output = os.path.exists(path_join(output, '.git'))
+    known = {}
+    for v in [base_version, sdk_version]:
+        if is_empty_str(v):
+            continue
+        doc = load_version_json(output, ARCHIVE_PATH, f'{v}.json')
+        for archive in doc.get('packages', {}).values():
+            # the archives outside the sparse publish workspace are only in HEAD
+            if is_git_output or os.path.exists(path_join(output, f'{ARCHIVE_PATH}/{archive["file"]}')):
+                known[archive['file']] = archive
+
+    jobs = []
+    packages = {}
+    for name, h in hashes.items():
+        file = f'{name}/{h}.tar.gz'
+        if file in known:
+            packages[name] = known[file]
+            continue
+        if not os.path.exists(path_join(dest, name)):
+            # reused from a base version which was published before the archives
+            print(f'can not pack [{name}], it is not checked out, the version is published without archives')
+            return []
+        jobs.append((name, file))
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    def pack(job: tuple):
+        name, file = job
+        return pack_archive(path_join(dest, name), path_join(output, f'{ARCHIVE_PATH}/{file}'))
+
+    with ThreadPoolExecutor(max_workers=MATERIALIZE_JOBS) as pool:
+        for (name, file), archive in zip(jobs, pool.map(pack, jobs)):
+            packages[name] = dict(archive, file=file)
+
+    # github refuses to push a file over 100 MB
+    too_large = [name for name, _ in jobs if packages[name]['size'] > ARCHIVE_MAX_MB * 1024 * 1024]
+    if len(too_large) > 0:
+        print(f'can not publish archives, {", ".join(too_large)} over {ARCHIVE_MAX_MB} MB, '
+              f'the version is published without archives')
+        for _, file in jobs:
+            os.remove(path_join(output, f'{ARCHIVE_PATH}/{file}'))
+        return []
+
+    # the root files change on every publish, the archive is named by its content
+    root_files = [SDK_CONFIG_JSON, PACKAGE_HASHES_JSON, FILE_MANIFEST_JSON]
+    temp = path_join(output, f'{ARCHIVE_PATH}/root/{sdk_version}.tmp')
+    root = pack_archive(dest, temp, root_files)
+    root['file'] = f'root/{sdk_version}-{root["sha256"][:16]}.tar.gz'
+    os.replace(temp, path_join(output, f'{ARCHIVE_PATH}/{root["file"]}'))
+
+    write_file(path_join(output, f'{ARCHIVE_PATH}/{sdk_version}.json'), json.dumps({
+        'version': sdk_version,
+        'ts': ts,
+        'root': root,
+        'packages': packages,
+    }, indent=2))
+
+    print(f'archives [{sdk_version}]: {len(jobs)} packed, {len(hashes) - len(jobs)} already published')
+    return [f'{ARCHIVE_PATH}/{file}' for _, file in jobs] + \
+        [f'{ARCHIVE_PATH}/{root["file"]}', f'{ARCHIVE_PATH}/{sdk_version}.json']
+
+
+# pack the files of source into a reproducible tar.gz: sorted, no owner and no mtime,
+# so the same files always make the same archive
+# files: the relative paths to pack, None means every file under source
+# return {size, sha256} of the archive
+def pack_archive(source: str, to_path: str, files: list = None):
+    import gzip
+    import tarfile
+
+    if files is None:
+        files = []
+        for root, dirs, names in os.walk(source):
+            if '.git' in dirs:
+                dirs.remove('.git')
+            files += [os.path.relpath(path_join(root, n), source).replace('\\', '/') for n in names]
+
+    ensure_dir(os.path.dirname(to_path))
+    temp = f'{to_path}.{secrets.token_hex(4)}.tmp'
+    with open(temp, 'wb') as raw:
+        with gzip.GzipFile(filename='', mode='wb', fileobj=raw, mtime=0) as gz:
+            with tarfile.open(fileobj=gz, mode='w|', format=tarfile.PAX_FORMAT) as tar:
+                for rel in sorted(files):
+                    path = path_join(source, rel)
+                    info = tarfile.TarInfo(rel)
+                    info.size = os.path.getsize(path)
+                    info.mode = 0o755 if os.access(path, os.X_OK) and not is_windows_platform() else 0o644
+                    with open(path, 'rb') as f:
+                        tar.addfile(info, f)
+    os.replace(temp, to_path)
+    return {'size': os.path.getsize(to_path), 'sha256': hash_sha256(to_path)}
+
+
+# fetch all git upm packages in a bounded worker pool, then print the summary
+# return False if any of the packages is failed
+@traced('fetch_git_packages', 'publish')
+def fetch_git_packages(git_packages: list):
+    if len(git_packages) == 0:
+        return True
+
+    # 'git lfs install' writes the global git config, only run it once
+    run_cmd(f'git lfs install')
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    jobs = max(1, publish_jobs)
+    print(f'fetch {len(git_packages)} git packages with {jobs} jobs')
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        results = list(pool.map(lambda p: fetch_git_package(*p), git_packages))
+
+    print('===== git packages =====')
+    failed = 0
+    for r in results:
+        if r['ok']:
+            print(f'[ OK ] {r["pkg_id"]}  {r["seconds"]:.1f}s')
+        else:
+            failed += 1
+            print(f'[FAIL] {r["pkg_id"]}  {r["seconds"]:.1f}s  {r["error"]}')
+            print(r['log'])
+    print(f'{len(results) - failed} succeeded, {failed} failed')
+    return failed == 0
+
+
+# checkout one git upm at the pinned hash into to_path from the local mirror, and strip the .git folder
+@traced('fetch_git_package', 'publish')
+def fetch_git_package(pkg_id: str, git_url: str, git_hash: str, to_path: str):
+    start = time.time()
+    result = {'pkg_id': pkg_id, 'ok': False, 'seconds': 0, 'error': '', 'log': ''}
+    logs = []
+
+    def step(cmdline: str):
+        code, out = exec_cmd(cmdline, to_path)
+        logs.append(f'> {cmdline}\n{out}')
+        if code != 0:
+            result['error'] = f'exit {code}: {cmdline}'
+        return code == 0
+
+    try:
+        if os.path.exists(to_path):
+            delete_dir(to_path)
+
+        os.mkdir(to_path)
+
+        mirror = get_git_mirror_path(git_url)
+        print(f'checkout {pkg_id}: {git_url}#{git_hash} -> {to_path}')
+
+        with get_git_mirror_lock(mirror):
+            result['ok'] = update_git_mirror(mirror, git_url, git_hash, step)
+
+        if result['ok']:
+            # borrow the objects of the mirror, nothing is downloaded for the checkout
+            step(f'git init -q .')
+            write_file(path_join(to_path, '.git/objects/info/alternates'), f'{to_safe_path(mirror)}/objects\n')
+
+            # 添加 LFS 文件拉取逻辑: the checkout leaves the LFS pointers (no download, no remote is needed),
+            # then lfs pull fetches the objects into the shared storage, the clone keeps no LFS objects itself.
+            # lfs.storage is in the local config, so every LFS command of the clone uses the shared storage
+            result['ok'] = step(f'git remote add origin {git_url}') \
+                and step(f'git config lfs.storage "{get_lfs_storage()}"') \
+                and step(f'git lfs install --local --skip-smudge') \
+                and step(f'git checkout -q {git_hash}') \
+                and step(f'git lfs pull')
+
+        # delete .git folder in cloned folder
+        if result['ok']:
+            delete_dir(path_join(to_path, '.git'))
+    except OSError as e:
+        result['error'] = str(e)
+
+    result['seconds'] = time.time() - start
+    result['log'] = ''.join(logs)
+    return result
+
+
+# the bare mirror of the git_url under '~/.guru/unity/mirrors'
+def get_git_mirror_path(git_url: str):
+    name = git_url.rstrip('/').split('/')[-1].split(':')[-1]
+    if name.endswith('.git'):
+        name = name[:-4]
+    key = hashlib.sha1(git_url.encode('utf-8')).hexdigest()[:12]
+    return to_safe_path(f'{get_user_home()}/{GIT_MIRROR_PATH}/{name}-{key}.git')
+
+
+def get_git_mirror_lock(mirror: str):
+    with git_mirror_locks_guard:
+        if mirror not in git_mirror_locks:
+            git_mirror_locks[mirror] = threading.Lock()
+        return git_mirror_locks[mirror]
+
+
+# make sure the pinned hash is in the mirror, only the hash is fetched when it's missing
+@traced('update_git_mirror', 'publish')
+def update_git_mirror(mirror: str, git_url: str, git_hash: str, step):
+    if not os.path.exists(mirror):
+        ensure_dir(os.path.dirname(mirror))
+        if not step(f'git init -q --bare "{mirror}"') \
+                or not step(f'git --git-dir="{mirror}" remote add origin {git_url}'):
+            return False
+
+    git = f'git --git-dir="{mirror}"'
+    if exec_cmd(f'{git} cat-file -e "{git_hash}^{{commit}}"')[0] == 0:
+        print(f'mirror hit: {git_url}#{git_hash}')
+        return True
+
+    # keep a ref for the hash so it will never be pruned
+    if step(f'{git} fetch --depth 1 origin +{git_hash}:refs/pins/{git_hash}'):
+        return True
+
+    # the server doesn't allow to fetch by hash, fetch all branches and tags instead
+    return step(f'{git} fetch origin "+refs/heads/*:refs/heads/*" "+refs/tags/*:refs/tags/*"') \
+        and step(f'{git} cat-file -e "{git_hash}^{{commit}}"')
 
 
 # update current version info into version_list file
+@traced('update_version_list', 'publish')
 def update_version_list(sdk_config: dict, out_path: str):
     if sdk_config is None:
         print('parse sdk-config with wrong value')
@@ -820,16 +3629,51 @@ def update_version_list(sdk_config: dict, out_path: str):
 
     version_list['latest'] = sdk_version
     version_list['versions'][sdk_version] = {}
-    version_list['versions'][sdk_version]['ts'] = get_timestamp()
+    # the same ts as the sdk-config and the archive index of the version
+    version_list['versions'][sdk_version]['ts'] = int(sdk_config.get('ts', get_timestamp()))
     version_list['versions'][sdk_version]['desc'] = desc
 
     write_file(file_path, json.dumps(version_list))
     pass
 
 
+# write the sharded version index from version_list.json, see fetch_version_doc
+# only the shards whose versions changed are written, the old shard files are kept for the cached roots
+# return the changed paths
+@traced('update_version_index', 'publish')
+def update_version_index(out_path: str):
+    version_list = load_json_file(path_join(out_path, VERSION_LIST))
+    old_root = load_version_json(out_path, VERSION_INDEX_PATH, 'root.json')
+
+    shards = {}
+    for v, info in version_list.get('versions', {}).items():
+        shards.setdefault(get_version_shard_key(v), {})[v] = info
+
+    index_home = path_join(out_path, VERSION_INDEX_PATH)
+    ensure_dir(index_home)
+    changed = []
+    pointers = {}
+    for key, versions in sorted(shards.items()):
+        data = json.dumps({'versions': dict(sorted(versions.items()))}, indent=2).encode('utf-8')
+        name = f'{key}-{hashlib.sha256(data).hexdigest()[:16]}.json'
+        pointers[key] = name
+        if old_root.get('shards', {}).get(key) != name:
+            write_file_atomic(path_join(index_home, name), data)
+            changed.append(f'{VERSION_INDEX_PATH}/{name}')
+
+    write_file(path_join(index_home, 'root.json'), json.dumps({
+        'latest': version_list.get('latest', ''),
+        'channels': version_list.get('channels', {}),
+        'shards': pointers,
+    }, indent=2))
+    changed.append(f'{VERSION_INDEX_PATH}/root.json')
+    return changed
+
+
 def debug_repos(branch: str):
-    source, output = download_all_repos(branch)
-    build_version_packages_and_files(source, output)
+    with file_lock(PUBLISH_LOCK, PUBLISH_LOCK_TIMEOUT):
+        source, output = download_all_repos(branch)
+        build_version_packages_and_files(source, output)
 
 
 def debug_test_func():
@@ -850,25 +3694,277 @@ def debug_test_func():
     pass
 
 
+# ---------------------- Daemon ----------------------
+# a local daemon keeps the python process, the http session and the caches warm,
+# the cli forwards the DAEMON_ACTIONS to it and runs them in-process when no daemon is running
+def get_daemon_json_path():
+    return to_safe_path(f'{get_user_home()}/{DAEMON_JSON}')
+
+
+# the hash of this cli file, a daemon started from another cli version is never used
+def get_cli_hash():
+    with open(os.path.abspath(__file__), 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+# the daemon server on a free local port, socketserver is only imported when the daemon starts
+def create_daemon_server():
+    import socketserver
+
+    class DaemonServer(socketserver.TCPServer):
+        allow_reuse_address = True
+        token = ''
+        running = True
+
+        def handle_timeout(self):
+            print(f'daemon is idle for {DAEMON_IDLE_TIMEOUT}s, stop it')
+            self.running = False
+
+    # one request per connection: {token, argv, cwd} -> streamed {out} lines, then {exit}
+    class DaemonHandler(socketserver.StreamRequestHandler):
+
+        def handle(self):
+            try:
+                req = json.loads(self.rfile.readline().decode('utf-8'))
+            except ValueError:
+                return
+            if req.get('token') != self.server.token:
+                return
+
+            if req.get('cmd') == 'stop':
+                self.server.running = False
+                self.send({'exit': 0})
+                return
+
+            code = run_daemon_request(req['argv'], req['cwd'], DaemonWriter(self))
+            self.send({'exit': code})
+
+        def send(self, msg: dict):
+            self.wfile.write((json.dumps(msg) + '\n').encode('utf-8'))
+            self.wfile.flush()
+
+    return DaemonServer(('127.0.0.1', 0), DaemonHandler)
+
+
+# redirect the prints of a request to the client. the worker threads and the async tasks of the request
+# all print through this one writer: the sends are locked, and each thread or task sends whole lines,
+# so the output of two of them never ends up in the same line
+class DaemonWriter:
+
+    def __init__(self, handler: 'socketserver.StreamRequestHandler'):
+        self.handler = handler
+        self.lock = threading.Lock()
+        self.pending = {}  # {writer key: the text after its last newline}
+
+    # the current thread, and the running task of its event loop
+    @staticmethod
+    def get_key():
+        asyncio = sys.modules.get('asyncio')
+        task = None
+        if asyncio is not None:
+            try:
+                task = asyncio.current_task()
+            except RuntimeError:
+                pass  # no running event loop in this thread
+        return threading.get_ident(), id(task) if task is not None else 0
+
+    def write(self, txt: str):
+        if len(txt) == 0:
+            return 0
+        key = self.get_key()
+        with self.lock:
+            buf = self.pending.pop(key, '') + txt
+            end = buf.rfind('\n') + 1
+            if end < len(buf):
+                self.pending[key] = buf[end:]
+            if end > 0:
+                self.send(buf[:end])
+        return len(txt)
+
+    def flush(self):
+        pass
+
+    # send the unfinished lines, at the end of the request
+    def close(self):
+        with self.lock:
+            for buf in self.pending.values():
+                self.send(buf)
+            self.pending.clear()
+
+    def send(self, txt: str):
+        try:
+            self.handler.send({'out': txt})
+        except OSError:
+            pass  # the client is gone, keep running the action
+
+
+# run the cli args inside the daemon process like a fresh run, return the exit code
+def run_daemon_request(argv: list, cwd: str, out: DaemonWriter):
+    global CURRENT_PATH, forward_cmd_stderr
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout = sys.stderr = out
+    forward_cmd_stderr = True
+    code = 0
+    try:
+        os.chdir(cwd)
+        CURRENT_PATH = cwd
+        run_cli(init_args(argv))
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else 1
+    except Exception as e:
+        print(f'daemon error: {e}')
+        code = 1
+    finally:
+        out.close()
+        sys.stdout, sys.stderr = stdout, stderr
+        forward_cmd_stderr = False
+    return code
+
+
+# start the daemon in the current process, it stops after DAEMON_IDLE_TIMEOUT or by 'daemon_stop'
+def run_daemon():
+    server = create_daemon_server()
+    server.timeout = DAEMON_IDLE_TIMEOUT
+    server.token = secrets.token_hex(16)
+
+    path = get_daemon_json_path()
+    ensure_dir(os.path.dirname(path))
+    write_file(path, json.dumps({
+        'port': server.server_address[1],
+        'token': server.token,
+        'pid': os.getpid(),
+        'cli_hash': get_cli_hash(),
+    }))
+    if not is_windows_platform():
+        os.chmod(path, 0o600)
+
+    print(f'GuruSDK daemon is listening on 127.0.0.1:{server.server_address[1]}')
+    try:
+        while server.running:
+            server.handle_request()
+    finally:
+        server.server_close()
+        if os.path.exists(path) and json.loads(read_file(path)).get('pid') == os.getpid():
+            os.remove(path)
+    pass
+
+
+def load_daemon_info():
+    path = get_daemon_json_path()
+    if not os.path.exists(path):
+        return None
+    try:
+        return json.loads(read_file(path))
+    except ValueError:
+        return None
+
+
+# send one request to the running daemon, stream its output
+# return the exit code, or None when there is no daemon to talk to
+def call_daemon(req: dict, check_hash: bool = True):
+    info = load_daemon_info()
+    if info is None or (check_hash and info.get('cli_hash') != get_cli_hash()):
+        return None
+
+    import socket
+
+    req['token'] = info['token']
+    try:
+        conn = socket.create_connection(('127.0.0.1', info['port']), timeout=0.5)
+    except OSError:
+        return None
+
+    with conn:
+        conn.settimeout(None)
+        conn.sendall((json.dumps(req) + '\n').encode('utf-8'))
+        for line in conn.makefile('r', encoding='utf-8'):
+            msg = json.loads(line)
+            if 'out' in msg:
+                sys.stdout.write(msg['out'])
+            elif 'exit' in msg:
+                return msg['exit']
+    # the daemon dropped the connection
+    return None
+
+
 # ======================================================================================================================
 # init all the args from input
-def init_args():
+def init_args(argv: list = None):
     parser = argparse.ArgumentParser(description='guru-sdk cli tool')
-    parser.add_argument('action', type=str,help='sync, install, unity_install, publish, quick_publish, delete_version, debug_source, test')
-    parser.add_argument('--version', type=str, help='version for publish')
+    parser.add_argument('action', type=str,help='sync, install, unity_install, list, resolve, verify, publish, quick_publish, delete_version, debug_source, daemon, daemon_stop, test')
+    parser.add_argument('--version', type=str, help='version for install and sync: 1.4.2, 1.4.x, ^1.4.0, ~1.4.2, >=1.2.0 <2.0.0, latest or a channel')
     parser.add_argument('-b','--branch', type=str, help='branch for pulling all library repo')
-    parser.add_argument('-p','--proj', type=str, help='unity project path')
+    parser.add_argument('-p','--proj', type=str, nargs='+', help='unity project path, install and unity_install also take many paths, globs or @file')
     parser.add_argument('--pkgs', type=str, help='package list which will be installed')
+    parser.add_argument('--full', action='store_true', help='sync the whole library repo instead of a single version')
+    parser.add_argument('--offline', action='store_true', help='never touch the network, trust the local caches')
+    parser.add_argument('--ttl', type=int, help=f'seconds to trust the cached version_list (default {VERSION_LIST_TTL})')
+    parser.add_argument('-j', '--jobs', type=int, help=f'parallel git packages on publish, or projects on batch install (default {PUBLISH_JOBS})')
+    parser.add_argument('--force', action='store_true', help='install again even if the project is up to date')
+    parser.add_argument('--no_archive', action='store_true', help='install from the library repo instead of the package archives')
+    parser.add_argument('--archive_url', type=str, help='base url of the package archives (default: next to version_list.json)')
+    parser.add_argument('--cache_size', type=int, help=f'disk budget of the sdk cache in MB (default {SDK_CACHE_BUDGET_MB})')
+
+    parser.add_argument('--no_daemon', action='store_true', help='always run in this process, never use the daemon')
+    parser.add_argument('--timing', action='store_true', help='print the startup and action timing report')
+    parser.add_argument('--trace', type=str, help='save the spans of this run as chrome trace json, e.g. --trace out.json')
 
-    return parser.parse_args()
+    return parser.parse_args(argv)
 
 
 # main function for cli enter point
 def main():
+    mark_timing('imports')
+    args = init_args()
+    mark_timing('args')
+
+    # the report is also printed when the action exits early (exit codes, errors)
+    try:
+        run_main(args)
+    finally:
+        if args.timing:
+            print_timing_report()
+
+
+def run_main(args):
+    # let the running daemon do the work
+    if args.action in DAEMON_ACTIONS and not args.no_daemon:
+        code = call_daemon({'argv': sys.argv[1:], 'cwd': CURRENT_PATH})
+        if code is not None:
+            mark_timing('daemon')
+            exit(code)
+
+    if args.action == 'daemon':
+        run_daemon()
+        return
+
+    if args.action == 'daemon_stop':
+        if call_daemon({'cmd': 'stop'}, False) is None:
+            print('daemon is not running')
+        return
+
+    try:
+        run_cli(args)
+    finally:
+        mark_timing('action')
+
+
+# run the action of the args, with the trace when --trace is set
+def run_cli(args):
+    if args.trace:
+        start_trace()
+    try:
+        with trace_span(f'guru_unity_cli {args.action}'):
+            run_action(args)
+    finally:
+        if args.trace:
+            export_trace(path_join(CURRENT_PATH, args.trace))
+
+
+def run_action(args):
     print(f'========== Welcome to GuruSDK CLI [{VERSION}] ==========')
     print(f'UPDATE:{DESC}\n')
 
-    args = init_args()
     print('OS:', os.name)
     print('Action:', args.action)
     print('CMD_ROOT:', CURRENT_PATH)
@@ -878,15 +3974,68 @@ def main():
     version: str = args.version
     branch: str = args.branch
     pkgs: str = args.pkgs
-    proj: str = args.proj
+    projs: list = args.proj or []
+    proj: str = projs[0] if len(projs) > 0 else None
+
+    # the daemon runs many actions in one process, so every option is set back from its default
+    global sdk_cache_budget_mb, offline_mode, version_list_ttl, publish_jobs, archive_mode, archive_base_url, \
+        force_install
+    sdk_cache_budget_mb = args.cache_size if args.cache_size is not None else SDK_CACHE_BUDGET_MB
+    version_list_ttl = args.ttl if args.ttl is not None else VERSION_LIST_TTL
+    offline_mode = args.offline
+    publish_jobs = args.jobs if args.jobs is not None else PUBLISH_JOBS
+    archive_mode = not args.no_archive
+    archive_base_url = args.archive_url or ''
+    force_install = args.force
+
+    # the versions in the index, filtered by --version
+    if action == 'list':
+        list_versions(version or '')
+
+    # the exact version of --version
+    if action == 'resolve':
+        resolved = resolve_version(version or 'latest')
+        if is_empty_str(resolved):
+            print(f'no version matches: {version}')
+            exit(ERROR_WRONG_VERSION)
+        print(resolved)
+
+    # verify the sdk cache (all versions, or --version) and repair the bad files
+    if action == 'verify':
+        if not verify_sdk_cache(version or ''):
+            exit(ERROR_VERIFY_FAILED)
+
+    # a range, latest or a channel is resolved to the exact version first
+    if action in ['sync', 'install'] and not is_empty_str(version) and not is_exact_version(version):
+        resolved = resolve_version(version)
+        if is_empty_str(resolved):
+            print(f'no version matches: {version}')
+            exit(ERROR_WRONG_VERSION)
+        print(f'resolve version: {version} -> {resolved}')
+        version = resolved
 
     # only sync version on client
     if action == 'sync':
         clear_log()
         # sync the latest version of guru_sdk
-        sync_sdk()
+        sync_sdk(True, version or '', args.full)
         pass
 
+    # sync and then install selected version for many projects
+    if action in ['install', 'unity_install']:
+        projs = expand_project_paths(projs)
+        proj = projs[0] if len(projs) > 0 else ''
+
+    if action in ['install', 'unity_install'] and len(projs) > 1:
+        if action == 'install':
+            if is_empty_str(version):
+                print('wrong version format')
+                exit(ERROR_WRONG_VERSION)
+            batch_install_sdk({p: version for p in projs})
+        else:
+            batch_install_sdk({p: get_unity_proj_version(p) for p in projs})
+        action = 'batch_install'
+
     # sync and then install selected version for client
     if action == 'install':
         if not os.path.exists(proj):
@@ -0,0 +1,319 @@
+#! /usr/bin/python3
+# coding=utf-8
+
+"""
+GuruSDK CLI Benchmarks
+Time sync, install and publish against local git fixtures, no network needed
+
+    python3 bench_cli.py                         # run and compare with bench_baseline.json
+    python3 bench_cli.py --save                  # run and store the results as the new baseline
+    python3 bench_cli.py --versions 3,20 --packages 5,20 --projects 4
+"""
+
+import argparse
+import contextlib
+import functools
+import io
+import json
+import os
+import pathlib
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+CMD_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, CMD_ROOT)
+
+import guru_unity_cli as cli
+
+BASELINE_JSON = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_baseline.json')
+LIB_PACKAGES = 8  # packages in each published version
+PACKAGE_FILES = 20  # files in each package
+FILE_SIZE = 16 * 1024  # bytes of each file
+WALL_TOLERANCE = 1.5  # a result is a regression when its wall time is over baseline * tolerance
+WALL_SLACK_MS = 250  # and over baseline + slack, the short runs are too noisy to compare by ratio alone
+
+# the fixtures are committed with a fixed identity, so they don't depend on the user's git config
+GIT_ENV = dict(os.environ,
+               GIT_AUTHOR_NAME='bench', GIT_AUTHOR_EMAIL='bench@guru',
+               GIT_COMMITTER_NAME='bench', GIT_COMMITTER_EMAIL='bench@guru')
+
+
+# ---------------------- FIXTURES ----------------------
+def git(args: list, cwd: str):
+    subprocess.run(['git'] + args, cwd=cwd, env=GIT_ENV, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def git_output(args: list, cwd: str):
+    return subprocess.run(['git'] + args, cwd=cwd, env=GIT_ENV, check=True,
+                          stdout=subprocess.PIPE).stdout.decode('utf-8').strip()
+
+
+def write_json(path: str, data: object):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2)
+
+
+# a package folder with package.json and some binary files
+def make_package(path: str, name: str, version: str, seed: int):
+    rnd = random.Random(seed)
+    write_json(os.path.join(path, 'package.json'), {'name': name, 'version': version, 'dependencies': {}})
+    for i in range(PACKAGE_FILES):
+        with open(os.path.join(path, f'file_{i}.bytes'), 'wb') as f:
+            f.write(rnd.randbytes(FILE_SIZE))
+
+
+# the bare library repo with n versions, and a checkout of it which is served as the online version_list
+def make_library_repo(root: str, n_versions: int):
+    work = os.path.join(root, 'library-src')
+    bare = os.path.join(root, 'library.git')
+    os.makedirs(work)
+    git(['init', '-q', '-b', cli.SDK_LIB_BRANCH], work)
+
+    versions = {}
+    for v in range(n_versions):
+        version = f'1.{v}.0'
+        packages = [f'com.guru.bench.p{p}' for p in range(LIB_PACKAGES)]
+        for p, name in enumerate(packages):
+            # half of the packages are the same in every version
+            seed = p if p < LIB_PACKAGES // 2 else v * 1000 + p
+            make_package(os.path.join(work, version, name), name, version, seed)
+        write_json(os.path.join(work, version, cli.SDK_CONFIG_JSON),
+                   {'version': version, 'desc': 'bench', 'ts': f'{v + 1}', 'packages': packages})
+        versions[version] = {'ts': v + 1, 'desc': 'bench'}
+
+    write_json(os.path.join(work, cli.VERSION_LIST), {'latest': f'1.{n_versions - 1}.0', 'versions': versions})
+    git(['add', '-A'], work)
+    git(['commit', '-q', '-m', 'bench versions'], work)
+    git(['clone', '-q', '--bare', work, bare], root)
+    git(['config', 'uploadpack.allowFilter', 'true'], bare)
+    git(['config', 'uploadpack.allowAnySHA1InWant', 'true'], bare)
+    return work, bare
+
+
+# the dev repo with the lib v2 packages, and m git upm packages pinned in packages-lock.json
+def make_dev_repo(root: str, m_packages: int):
+    dev = os.path.join(root, 'dev')
+    lib_v2 = os.path.join(dev, 'packages', cli.SDK_LIB_V2)
+    for p in range(LIB_PACKAGES):
+        make_package(os.path.join(lib_v2, f'com.guru.bench.p{p}'), f'com.guru.bench.p{p}', '9.0.0', p)
+
+    dependencies = {}
+    for p in range(m_packages):
+        name = f'com.bench.git.p{p}'
+        repo = os.path.join(root, 'upm', name)
+        os.makedirs(repo)
+        git(['init', '-q', '-b', 'main'], repo)
+        # the binaries are LFS files, as in the real upm repos
+        git(['lfs', 'install', '--local'], repo)
+        git(['lfs', 'track', '*.bytes'], repo)
+        make_package(repo, name, '1.0.0', 5000 + p)
+        git(['add', '-A'], repo)
+        git(['commit', '-q', '-m', 'v1'], repo)
+        dependencies[name] = {'version': f'{pathlib.Path(repo).as_uri()}#main', 'depth': 0, 'source': 'git',
+                              'dependencies': {}, 'hash': git_output(['rev-parse', 'HEAD'], repo)}
+    dependencies['com.unity.ugui'] = {'version': '1.0.0', 'depth': 0, 'source': 'builtin', 'dependencies': {}}
+
+    packages = os.path.join(dev, cli.UNITY_DEV_PROJECT, cli.UNITY_PACKAGES_ROOT)
+    write_json(os.path.join(packages, cli.UNITY_PACKAGES_LOCK_JSON), {'dependencies': dependencies})
+    write_json(os.path.join(packages, cli.SDK_CONFIG_JSON),
+               {'version': '9.0.0', 'desc': 'bench',
+                'packages': [f'com.guru.bench.p{p}' for p in range(LIB_PACKAGES)] + list(dependencies)})
+    git(['init', '-q', '-b', 'main'], dev)
+    git(['add', '-A'], dev)
+    git(['commit', '-q', '-m', 'dev'], dev)
+    return dev
+
+
+# a unity project with a realistic ProjectSettings.asset (the defines are in the middle of ~900 lines)
+def make_unity_project(path: str, version: str):
+    lines = ['%YAML 1.1', '%TAG !u! tag:unity3d.com,2011:', '--- !u!129 &1', 'PlayerSettings:']
+    lines += [f'  setting{i}: {i}' for i in range(450)]
+    lines += ['  scriptingDefineSymbols:',
+              '    Android: UNITY_POST_PROCESSING_STACK_V2;GURU_ADJUST',
+              '    Standalone: UNITY_POST_PROCESSING_STACK_V2',
+              '    iPhone: UNITY_POST_PROCESSING_STACK_V2',
+              '  additionalCompilerArguments: {}']
+    lines += [f'  platformSetting{i}: {{}}' for i in range(450)]
+    os.makedirs(os.path.join(path, 'ProjectSettings'))
+    with open(os.path.join(path, 'ProjectSettings', 'ProjectSettings.asset'), 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+
+    write_json(os.path.join(path, 'ProjectSettings', 'guru-sdk-installer.json'), {'install_version': version})
+    write_json(os.path.join(path, cli.UNITY_PACKAGES_ROOT, cli.UNITY_MANIFEST_JSON), {'dependencies': {
+        'com.unity.ugui': '1.0.0',
+        'com.unity.textmeshpro': '3.0.6',
+        'com.google.firebase.app': '11.0.0',
+        'com.guru.bench.p0': 'file:../old/com.guru.bench.p0',
+    }})
+
+
+# serve the library checkout as the online version_list.json
+def start_http_server(root: str):
+    handler = functools.partial(QuietHandler, directory=root)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+
+# ---------------------- MEASURE ----------------------
+# the bytes of the files which were created or rewritten after 'since'
+def bytes_written(roots: list, since: float):
+    total = 0
+    for root in roots:
+        for dir_path, dirs, files in os.walk(root):
+            for f in files:
+                p = os.path.join(dir_path, f)
+                try:
+                    st = os.lstat(p)
+                except OSError:
+                    continue
+                if st.st_mtime >= since:
+                    total += st.st_size
+    return total
+
+
+# run one action inside this process, the cli output is kept away from the report
+def measure(name: str, func, roots: list):
+    cli.cmd_count = 0
+    since = time.time() - 0.001
+    start = time.perf_counter()
+    ok = True
+    with contextlib.redirect_stdout(io.StringIO()):
+        try:
+            func()
+        except SystemExit as e:
+            ok = e.code in (None, 0)
+    wall = time.perf_counter() - start
+    return {'name': name, 'ok': ok, 'wall_ms': round(wall * 1000, 1),
+            'bytes': bytes_written(roots, since), 'cmds': cli.cmd_count}
+
+
+def use_home(home: str):
+    os.environ['HOME'] = home
+    os.environ['USERPROFILE'] = home
+    cli.json_file_memo.clear()
+    cli.http_session = None
+
+
+def bench_client(root: str, n_versions: int, n_projects: int):
+    lib_src, lib_bare = make_library_repo(root, n_versions)
+    server = start_http_server(lib_src)
+    cli.SDK_LIB_REPO = pathlib.Path(lib_bare).as_uri()
+    cli.VERSION_LIST_URL = f'http://127.0.0.1:{server.server_address[1]}/{cli.VERSION_LIST}'
+    cli.CURRENT_PATH = root
+
+    home = os.path.join(root, 'home')
+    use_home(home)
+    version = f'1.{n_versions - 1}.0'
+    projects = [os.path.join(root, f'project{i}') for i in range(n_projects)]
+    for p in projects:
+        make_unity_project(p, version)
+
+    scale = f'versions={n_versions}'
+    results = [
+        measure(f'sync/{scale}/cold', lambda: cli.sync_sdk(False, version), [home]),
+        measure(f'sync/{scale}/warm', lambda: cli.sync_sdk(False, version), [home]),
+        measure(f'install/{scale}/cold', lambda: cli.sync_and_install_sdk(projects[0], version), [home, projects[0]]),
+        measure(f'install/{scale}/warm', lambda: cli.sync_and_install_sdk(projects[0], version), [home, projects[0]]),
+    ]
+    if n_projects > 1:
+        scale = f'versions={n_versions},projects={n_projects}'
+        results.append(measure(f'batch_install/{scale}/warm',
+                               lambda: cli.batch_install_sdk({p: version for p in projects}), [home] + projects))
+
+    server.shutdown()
+    return results
+
+
+def bench_publish(root: str, m_packages: int):
+    dev = make_dev_repo(root, m_packages)
+    use_home(os.path.join(root, 'home'))
+    output = os.path.join(root, 'output')
+    os.makedirs(output)
+
+    scale = f'packages={m_packages}'
+    return [
+        measure(f'publish/{scale}/cold', lambda: cli.build_version_packages_and_files(dev, output), [output]),
+        measure(f'publish/{scale}/warm', lambda: cli.build_version_packages_and_files(dev, output), [output]),
+    ]
+
+
+# ---------------------- REPORT ----------------------
+def report(results: list, baseline: dict):
+    regressions = []
+    print(f'{"benchmark":<52} {"ok":<4} {"wall ms":>10} {"bytes":>12} {"cmds":>6}  baseline')
+    for r in results:
+        base = baseline.get(r['name'])
+        note = ''
+        if base is not None:
+            note = f'{base["wall_ms"]:.1f} ms / {base["cmds"]} cmds'
+            slow = r['wall_ms'] > max(base['wall_ms'] * WALL_TOLERANCE, base['wall_ms'] + WALL_SLACK_MS)
+            if slow or r['cmds'] > base['cmds']:
+                note += '  REGRESSION'
+                regressions.append(r['name'])
+        if not r['ok']:
+            regressions.append(r['name'])
+        print(f'{r["name"]:<52} {"yes" if r["ok"] else "NO":<4} {r["wall_ms"]:>10.1f} '
+              f'{r["bytes"]:>12} {r["cmds"]:>6}  {note}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='guru-sdk cli benchmarks')
+    parser.add_argument('--versions', type=str, default='3,10', help='versions in the library fixture, comma separated')
+    parser.add_argument('--packages', type=str, default='4,16', help='git upm packages in the dev fixture, comma separated')
+    parser.add_argument('--projects', type=int, default=3, help='unity projects for the batch install')
+    parser.add_argument('--baseline', type=str, default=BASELINE_JSON, help='the baseline json to compare with')
+    parser.add_argument('--save', action='store_true', help='save the results as the new baseline')
+    parser.add_argument('--keep', action='store_true', help='keep the fixtures folder')
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='guru-bench-')
+    results = []
+    try:
+        for n in [int(v) for v in args.versions.split(',')]:
+            results += bench_client(os.path.join(root, f'client-{n}'), n, args.projects)
+
+        if shutil.which('git-lfs') is None:
+            print('git-lfs not found, skip the publish benchmarks')
+        else:
+            for m in [int(v) for v in args.packages.split(',')]:
+                results += bench_publish(os.path.join(root, f'publish-{m}'), m)
+    finally:
+        if args.keep:
+            print(f'fixtures: {root}')
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    regressions = report(results, baseline)
+
+    if args.save:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump({r['name']: r for r in results}, f, indent=2)
+        print(f'baseline saved: {args.baseline}')
+    elif len(regressions) > 0:
+        print(f'{len(regressions)} regressions: {", ".join(regressions)}')
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
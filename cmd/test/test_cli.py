@@ -0,0 +1,860 @@
+#! /usr/bin/python3
+# coding=utf-8
+
+"""
+GuruSDK CLI Unit Tests
+The helpers of the cli against temp folders and local git fixtures, no network needed
+
+    python3 -m unittest discover -s cmd/test
+"""
+
+import asyncio
+import contextlib
+import copy
+import io
+import json
+import os
+import pathlib
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+CMD_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, CMD_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import guru_unity_cli as cli
+import bench_cli as bench
+
+
+# every test runs in its own temp folder with its own home (sdk cache, locks, caches),
+# the cli output is kept in self.out
+class CliTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='guru-test-')
+        self.addCleanup(shutil.rmtree, self.root, True)
+
+        env = {k: os.environ.get(k) for k in ['HOME', 'USERPROFILE']}
+        self.addCleanup(self.restore_env, env)
+        self.home = os.path.join(self.root, 'home')
+        bench.use_home(self.home)
+
+        self.out = io.StringIO()
+        redirect = contextlib.redirect_stdout(self.out)
+        redirect.__enter__()
+        self.addCleanup(redirect.__exit__, None, None, None)
+
+    @staticmethod
+    def restore_env(env: dict):
+        for k, v in env.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+        cli.json_file_memo.clear()
+
+    def path(self, *names):
+        return os.path.join(self.root, *names)
+
+
+# ---------------------- MACROS ----------------------
+class FindScriptingDefinesTest(unittest.TestCase):
+
+    def test_block(self):
+        data = (b'PlayerSettings:\n'
+                b'  scriptingDefineSymbols:\n'
+                b'    Android: A;B\n'
+                b'    iPhone: C\n'
+                b'  additionalCompilerArguments: {}\n')
+        block = cli.find_scripting_defines(data)
+        self.assertEqual(block['defines'], {'Android': ['A', 'B'], 'iPhone': ['C']})
+        self.assertEqual(block['indent'], '  ')
+        self.assertEqual(block['eol'], '\n')
+        self.assertFalse(block['numeric'])
+        self.assertEqual(data[block['end']:], b'  additionalCompilerArguments: {}\n')
+
+    def test_empty_block(self):
+        data = (b'PlayerSettings:\n'
+                b'  scriptingDefineSymbols: {}\n'
+                b'  additionalCompilerArguments: {}\n')
+        block = cli.find_scripting_defines(data)
+        self.assertEqual(block['defines'], {})
+        self.assertEqual(data[block['start']:block['end']], b'  scriptingDefineSymbols: {}\n')
+
+    def test_empty_values(self):
+        data = (b'  scriptingDefineSymbols:\n'
+                b'    Android:\n'
+                b'    Standalone: \n'
+                b'    iPhone: A;;B;\n')
+        block = cli.find_scripting_defines(data)
+        self.assertEqual(block['defines'], {'Android': [], 'Standalone': [], 'iPhone': ['A', 'B']})
+        self.assertEqual(block['end'], len(data))
+
+    def test_crlf(self):
+        data = (b'PlayerSettings:\r\n'
+                b'  scriptingDefineSymbols:\r\n'
+                b'    Android: A;B\r\n'
+                b'  additionalCompilerArguments: {}\r\n')
+        block = cli.find_scripting_defines(data)
+        self.assertEqual(block['eol'], '\r\n')
+        self.assertEqual(block['defines'], {'Android': ['A', 'B']})
+        self.assertEqual(data[block['end']:], b'  additionalCompilerArguments: {}\r\n')
+
+    def test_numeric_keys(self):
+        data = (b'  scriptingDefineSymbols:\n'
+                b'    1: A\n'
+                b'    4: B\n'
+                b'    7: C\n')
+        block = cli.find_scripting_defines(data)
+        self.assertTrue(block['numeric'])
+        self.assertEqual(block['defines'], {'1': ['A'], '4': ['B'], '7': ['C']})
+
+    def test_not_found(self):
+        self.assertIsNone(cli.find_scripting_defines(b'PlayerSettings:\n  productName: x\n'))
+
+
+class EditScriptingDefinesTest(unittest.TestCase):
+
+    def edit(self, data: bytes, add: list, remove: list, platforms: list = None):
+        fd, path = tempfile.mkstemp(suffix='.asset')
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        with open(path, 'wb') as f:
+            f.write(data)
+        changed = cli.edit_scripting_defines(path, add, remove, platforms)
+        with open(path, 'rb') as f:
+            return changed, f.read()
+
+    def test_only_platforms(self):
+        data = (b'  scriptingDefineSymbols:\n'
+                b'    Android: A\n'
+                b'    Standalone: A\n'
+                b'    iPhone: A\n'
+                b'  next: 1\n')
+        changed, out = self.edit(data, ['B'], ['A'], cli.MACRO_PLATFORMS)
+        self.assertTrue(changed)
+        self.assertEqual(out, b'  scriptingDefineSymbols:\n'
+                              b'    Android: B\n'
+                              b'    Standalone: A\n'
+                              b'    iPhone: B\n'
+                              b'  next: 1\n')
+
+    def test_empty_block_crlf(self):
+        data = b'  scriptingDefineSymbols: {}\r\n  next: 1\r\n'
+        changed, out = self.edit(data, ['B'], [], ['Android'])
+        self.assertTrue(changed)
+        self.assertEqual(out, b'  scriptingDefineSymbols:\r\n    Android: B\r\n  next: 1\r\n')
+
+    def test_numeric_keys(self):
+        data = b'  scriptingDefineSymbols:\n    1: A\n    7: A\n'
+        changed, out = self.edit(data, ['B'], [], ['Android'])
+        self.assertTrue(changed)
+        self.assertEqual(out, b'  scriptingDefineSymbols:\n    1: A\n    7: A;B\n')
+
+    def test_unchanged(self):
+        data = b'  scriptingDefineSymbols:\n    Android: A\n'
+        changed, out = self.edit(data, ['A'], ['B'], ['Android'])
+        self.assertFalse(changed)
+        self.assertEqual(out, data)
+
+
+# ---------------------- VERSIONS ----------------------
+# an index like get_version_index() builds it, newest first
+def make_index(versions: list, latest: str = '', channels: dict = None):
+    items = [{'version': v, 'ts': '', 'desc': '', 'key': cli.version_key(v)} for v in versions]
+    items.sort(key=lambda item: cli.to_version_key(item['key']), reverse=True)
+    return {'latest': latest, 'channels': channels or {}, 'versions': items}
+
+
+class VersionKeyTest(unittest.TestCase):
+
+    def key(self, version: str):
+        return cli.to_version_key(cli.version_key(version))
+
+    def test_order(self):
+        ordered = ['0.9.9', '1.0.0-alpha', '1.0.0-alpha.1', '1.0.0-alpha.beta', '1.0.0-beta.2', '1.0.0-beta.11',
+                   '1.0.0', '1.0.1', '1.10.0']
+        self.assertEqual(sorted(ordered, key=self.key), ordered)
+
+    def test_forms(self):
+        self.assertEqual(self.key('v1.4.2'), self.key('1.4.2'))
+        self.assertEqual(self.key('1.4.2+build.7'), self.key('1.4.2'))
+        self.assertEqual(self.key('1.4'), self.key('1.4.0'))
+
+    def test_not_a_version(self):
+        self.assertIsNone(cli.version_key('latest'))
+        self.assertIsNone(cli.version_key('1.x'))
+
+    def test_exact(self):
+        self.assertTrue(cli.is_exact_version('1.4.2'))
+        self.assertTrue(cli.is_exact_version('1.4.2-beta.1'))
+        self.assertFalse(cli.is_exact_version('v1.4.2'))
+        self.assertFalse(cli.is_exact_version('1.4'))
+        self.assertFalse(cli.is_exact_version('^1.4.2'))
+
+    def test_resolve_exact(self):
+        self.assertEqual(cli.resolve_version('v1.4.2'), '1.4.2')
+        self.assertEqual(cli.resolve_version('1.4.2'), '1.4.2')
+
+
+class ParseVersionRangeTest(unittest.TestCase):
+
+    def matches(self, spec: str, version: str):
+        alternatives = cli.parse_version_range(spec)
+        return cli.match_version_range(alternatives, cli.to_version_key(cli.version_key(version)))
+
+    def test_space_after_operator(self):
+        self.assertEqual(cli.parse_version_range('>= 1.4.0 < 2.0.0'), cli.parse_version_range('>=1.4.0 <2.0.0'))
+        self.assertTrue(self.matches('>= 1.4.0', '1.5.0'))
+        self.assertFalse(self.matches('>= 1.4.0', '1.3.9'))
+
+    def test_caret_and_tilde(self):
+        self.assertTrue(self.matches('^1.4.0', '1.9.3'))
+        self.assertFalse(self.matches('^1.4.0', '2.0.0'))
+        self.assertTrue(self.matches('^0.4.1', '0.4.9'))
+        self.assertFalse(self.matches('^0.4.1', '0.5.0'))
+        self.assertTrue(self.matches('~1.4.2', '1.4.9'))
+        self.assertFalse(self.matches('~1.4.2', '1.5.0'))
+
+    def test_partial_and_wildcard(self):
+        for spec in ['1.4', '1.4.x', '1.4.*']:
+            self.assertTrue(self.matches(spec, '1.4.7'), spec)
+            self.assertFalse(self.matches(spec, '1.5.0'), spec)
+        self.assertTrue(self.matches('*', '3.0.0'))
+
+    def test_or(self):
+        self.assertTrue(self.matches('1.2.0 || 1.3.x', '1.3.4'))
+        self.assertTrue(self.matches('1.2.0 || 1.3.x', '1.2.0'))
+        self.assertFalse(self.matches('1.2.0 || 1.3.x', '1.2.1'))
+
+    def test_v_prefix(self):
+        self.assertTrue(self.matches('>=v1.4.0', '1.4.0'))
+        self.assertTrue(self.matches('v1.4.2', '1.4.2'))
+
+    def test_invalid(self):
+        self.assertIsNone(cli.parse_version_range('>= abc'))
+        self.assertIsNone(cli.parse_version_range('1.4.0 >='))
+
+
+class FindVersionsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = make_index(['1.3.0', '1.4.0', '1.4.2', '1.5.0-beta.1', '2.0.0'],
+                                latest='1.4.2', channels={'beta': '1.5.0-beta.1', 'empty': ''})
+
+    def test_all(self):
+        self.assertEqual(cli.find_versions(self.index), ['2.0.0', '1.5.0-beta.1', '1.4.2', '1.4.0', '1.3.0'])
+
+    def test_latest_and_channels(self):
+        self.assertEqual(cli.find_versions(self.index, 'latest'), ['1.4.2'])
+        self.assertEqual(cli.find_versions(self.index, 'beta'), ['1.5.0-beta.1'])
+        # a channel without a version falls back to the newest release
+        self.assertEqual(cli.find_versions(self.index, 'empty'), ['2.0.0'])
+
+    def test_range_skips_prereleases(self):
+        self.assertEqual(cli.find_versions(self.index, '>= 1.4.0 <2.0.0'), ['1.4.2', '1.4.0'])
+        self.assertEqual(cli.find_versions(self.index, '>=1.5.0-beta.0 <2.0.0'), ['1.5.0-beta.1'])
+
+    def test_exact_and_missing(self):
+        self.assertEqual(cli.find_versions(self.index, '1.4.0'), ['1.4.0'])
+        self.assertEqual(cli.find_versions(self.index, 'v1.4.0'), ['1.4.0'])
+        self.assertEqual(cli.find_versions(self.index, '3.x'), [])
+        self.assertEqual(cli.find_versions(self.index, 'nope'), [])
+
+
+
+class ShardLookupTest(CliTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.lib = self.path('lib')
+        versions = {v: {'ts': i + 1, 'desc': v} for i, v in enumerate(['1.0.0', '1.0.1', '1.1.0', '2.0.0'])}
+        bench.write_json(os.path.join(self.lib, cli.VERSION_LIST), {'latest': '2.0.0', 'versions': versions})
+        cli.update_version_index(self.lib)
+
+        server = bench.start_http_server(self.lib)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = f'http://127.0.0.1:{server.server_address[1]}/{cli.VERSION_LIST}'
+        patcher = mock.patch.object(cli, 'VERSION_LIST_URL', url)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def cached_shards(self):
+        path = os.path.join(self.home, cli.VERSION_SHARD_CACHE)
+        return sorted(os.listdir(path)) if os.path.isdir(path) else []
+
+    def test_shard_key(self):
+        self.assertEqual(cli.get_version_shard_key('1.4.2'), '1.4')
+        self.assertEqual(cli.get_version_shard_key('1.4.2-beta.1'), '1.4')
+        self.assertEqual(cli.get_version_shard_key('v2.0.1+build.5'), '2.0')
+
+    def test_only_the_needed_shard(self):
+        doc = cli.fetch_version_doc('1.0.1')
+        self.assertEqual(sorted(doc['versions']), ['1.0.0', '1.0.1'])
+        self.assertEqual(doc['latest'], '2.0.0')
+        shards = self.cached_shards()
+        self.assertEqual(len(shards), 1)
+        self.assertTrue(shards[0].startswith('1.0-'))
+
+        # the cached root and shard answer without the server
+        self.assertEqual(cli.load_cached_version_doc('1.0.0'), doc)
+        self.assertIsNone(cli.load_cached_version_doc('1.1.0'))
+        self.assertEqual(cli.fetch_version_doc('9.0.0')['versions'], {})
+
+    def test_all_shards(self):
+        doc = cli.fetch_version_doc()
+        self.assertEqual(sorted(doc['versions']), ['1.0.0', '1.0.1', '1.1.0', '2.0.0'])
+        self.assertEqual(len(self.cached_shards()), 3)
+
+    def test_publish_rewrites_only_the_changed_shard(self):
+        list_path = os.path.join(self.lib, cli.VERSION_LIST)
+        version_list = cli.load_json_file(list_path)
+        version_list['versions']['1.1.1'] = {'ts': 9, 'desc': '1.1.1'}
+        bench.write_json(list_path, version_list)
+
+        changed = cli.update_version_index(self.lib)
+        self.assertEqual(len(changed), 2)
+        self.assertTrue(changed[0].startswith(f'{cli.VERSION_INDEX_PATH}/1.1-'))
+        self.assertEqual(changed[1], f'{cli.VERSION_INDEX_PATH}/root.json')
+
+
+# ---------------------- SYNC ----------------------
+class SyncSdkTest(CliTestCase):
+
+    def setUp(self):
+        super().setUp()
+        work, bare = bench.make_library_repo(self.path('lib'), 2)
+        bench.write_json(os.path.join(work, cli.ARCHIVE_PATH, '1.0.0.json'), {'archives': {}})
+        bench.git(['add', '-A'], work)
+        bench.git(['commit', '-q', '-m', 'archives'], work)
+        bench.git(['push', '-q', bare, cli.SDK_LIB_BRANCH], work)
+        patcher = mock.patch.object(cli, 'SDK_LIB_REPO', pathlib.Path(bare).as_uri())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.sdk_home = self.path('sdk')
+
+    # the blobs of the archives which were never downloaded
+    def missing_archives(self):
+        out = subprocess.run(['git', 'rev-list', '--objects', '--missing=print', 'HEAD'], cwd=self.sdk_home,
+                             capture_output=True, text=True, check=True).stdout
+        archive = bench.git_output(['rev-parse', f'HEAD:{cli.ARCHIVE_PATH}/1.0.0.json'], self.sdk_home)
+        return f'?{archive}' in out.split()
+
+    def test_full_clone_leaves_out_archives(self):
+        cli.clone_sdk_repo(self.sdk_home, full=True)
+        self.assertTrue(os.path.isfile(os.path.join(self.sdk_home, '1.1.0', cli.SDK_CONFIG_JSON)))
+        self.assertFalse(os.path.exists(os.path.join(self.sdk_home, cli.ARCHIVE_PATH)))
+        self.assertTrue(cli.is_full_sdk_repo(self.sdk_home))
+        self.assertTrue(self.missing_archives())
+
+    def test_fetch_converts_old_full_clone(self):
+        bench.git(['clone', '-q', '--depth', '1', cli.SDK_LIB_REPO, self.sdk_home], self.root)
+        cli.fetch_sdk_repo(self.sdk_home)
+        self.assertTrue(os.path.isfile(os.path.join(self.sdk_home, '1.1.0', cli.SDK_CONFIG_JSON)))
+        self.assertFalse(os.path.exists(os.path.join(self.sdk_home, cli.ARCHIVE_PATH)))
+        self.assertTrue(cli.is_full_sdk_repo(self.sdk_home))
+
+    def test_failed_clone_keeps_the_sdk(self):
+        cli.clone_sdk_repo(self.sdk_home, full=True)
+        with mock.patch.object(cli, 'SDK_LIB_REPO', pathlib.Path(self.path('missing.git')).as_uri()):
+            cli.clone_sdk_repo(self.sdk_home, full=True)
+        self.assertTrue(os.path.isfile(os.path.join(self.sdk_home, '1.1.0', cli.SDK_CONFIG_JSON)))
+        self.assertEqual([n for n in os.listdir(self.root) if n.startswith('sdk.')], [])
+
+
+# ---------------------- LOCK ----------------------
+class FileLockTest(CliTestCase):
+
+    # try the lock from another thread, return the exit code (None when it got the lock)
+    def lock_in_thread(self, name: str):
+        result = {}
+
+        def run():
+            try:
+                with cli.file_lock(name, 0.3):
+                    result['code'] = None
+            except SystemExit as e:
+                result['code'] = e.code
+
+        t = threading.Thread(target=run)
+        t.start()
+        t.join()
+        return result['code']
+
+    def test_reentrant(self):
+        with cli.file_lock(cli.SDK_LOCK):
+            with cli.file_lock(cli.SDK_LOCK, 0):
+                with cli.file_lock(cli.CACHE_LOCK, 0):
+                    pass
+            # the inner exit doesn't release the outer lock
+            self.assertEqual(self.lock_in_thread(cli.SDK_LOCK), cli.ERROR_LOCK_TIMEOUT)
+        self.assertIsNone(self.lock_in_thread(cli.SDK_LOCK))
+
+    def test_other_locks_are_free(self):
+        with cli.file_lock(cli.SDK_LOCK):
+            self.assertIsNone(self.lock_in_thread(cli.PUBLISH_LOCK))
+
+
+class SwapDirTest(CliTestCase):
+
+    def dirs(self):
+        return sorted(n for n in os.listdir(self.root) if n.startswith('dest'))
+
+    def make_dir(self, name: str, content: str):
+        os.makedirs(self.path(name))
+        with open(self.path(name, 'a.txt'), 'w') as f:
+            f.write(content)
+
+    def test_swap(self):
+        self.make_dir('dest', 'old')
+        self.make_dir('dest.staging-1', 'new')
+        cli.swap_dir(self.path('dest.staging-1'), self.path('dest'))
+        with open(self.path('dest', 'a.txt')) as f:
+            self.assertEqual(f.read(), 'new')
+        self.assertEqual(self.dirs(), ['dest'])
+
+    def test_swap_into_missing_dest(self):
+        self.make_dir('dest.staging-1', 'new')
+        cli.swap_dir(self.path('dest.staging-1'), self.path('dest'))
+        self.assertTrue(os.path.isfile(self.path('dest', 'a.txt')))
+
+    def test_clean_stale_dirs(self):
+        for name in ['dest', 'dest.staging-1', 'dest.old-2', 'dest2.old-3']:
+            self.make_dir(name, name)
+        cli.clean_stale_dirs(self.path('dest'))
+        self.assertEqual(self.dirs(), ['dest', 'dest2.old-3'])
+
+
+# ---------------------- CACHE ----------------------
+class CacheEntryTest(CliTestCase):
+
+    def setUp(self):
+        super().setUp()
+        work, bare = bench.make_library_repo(self.path('lib'), 3)
+        server = bench.start_http_server(work)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        for name, value in [('SDK_LIB_REPO', pathlib.Path(bare).as_uri()),
+                            ('VERSION_LIST_URL', f'http://127.0.0.1:{server.server_address[1]}/{cli.VERSION_LIST}')]:
+            patcher = mock.patch.object(cli, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def entries(self):
+        return sorted(cli.load_cache_index()['entries'])
+
+    def test_build_and_reuse(self):
+        entry = cli.prepare_sdk_version('1.1.0')
+        self.assertEqual(entry, cli.get_cache_entry_path('1.1.0', '2'))
+        self.assertEqual(self.entries(), ['1.1.0@2'])
+
+        # every file is a read-only link to an object
+        path = os.path.join(entry, 'com.guru.bench.p0', 'file_0.bytes')
+        st = os.stat(path)
+        self.assertGreaterEqual(st.st_nlink, 2)
+        self.assertEqual(st.st_mode & 0o222, 0)
+
+        cmds = cli.cmd_count
+        self.assertEqual(cli.prepare_sdk_version('1.1.0'), entry)
+        self.assertEqual(cli.cmd_count, cmds)
+        self.assertEqual(self.entries(), ['1.1.0@2'])
+
+    def test_versions_share_objects(self):
+        a = cli.prepare_sdk_version('1.0.0')
+        b = cli.prepare_sdk_version('1.1.0')
+        # the first half of the packages are the same in every version
+        same = os.path.join('com.guru.bench.p0', 'file_0.bytes')
+        self.assertTrue(os.path.samefile(os.path.join(a, same), os.path.join(b, same)))
+
+    def test_eviction_keeps_entries_in_use(self):
+        proj = self.path('proj')
+        bench.make_unity_project(proj, '1.0.0')
+        cli.sync_and_install_sdk(proj, '1.0.0')
+
+        with mock.patch.object(cli, 'sdk_cache_budget_mb', 0):
+            cli.prepare_sdk_version('1.1.0')
+            cli.prepare_sdk_version('1.2.0')
+        # 1.1.0 is the least recently used one, 1.0.0 is linked by the project and 1.2.0 is just built
+        self.assertEqual(self.entries(), ['1.0.0@1', '1.2.0@3'])
+        self.assertFalse(os.path.exists(cli.get_cache_entry_path('1.1.0', '2')))
+        self.assertTrue(os.path.isfile(os.path.join(cli.get_cache_entry_path('1.0.0', '1'), cli.SDK_CONFIG_JSON)))
+
+
+class ArchiveTest(CliTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.lib = self.path('lib')
+        self.source = os.path.join(self.lib, '1.0.0')
+        packages = [f'p{p}' for p in range(2)]
+        for p, name in enumerate(packages):
+            bench.make_package(os.path.join(self.source, name), name, '1.0.0', p)
+        bench.write_json(os.path.join(self.source, cli.SDK_CONFIG_JSON),
+                         {'version': '1.0.0', 'ts': '5', 'packages': packages})
+
+        hashes = {name: cli.hash_tree(os.path.join(self.source, name)) for name in packages}
+        bench.write_json(os.path.join(self.source, cli.PACKAGE_HASHES_JSON), {'packages': hashes})
+        files = cli.hash_files([os.path.join(self.source, cli.SDK_CONFIG_JSON),
+                                os.path.join(self.source, cli.PACKAGE_HASHES_JSON)])
+        bench.write_json(os.path.join(self.source, cli.FILE_MANIFEST_JSON), {
+            'packages': {name: cli.hash_tree_files(os.path.join(self.source, name)) for name in packages},
+            'files': {os.path.basename(k): v for k, v in files.items()},
+        })
+        cli.build_version_archives(self.lib, '1.0.0', '5', hashes, '')
+        bench.write_json(os.path.join(self.lib, cli.VERSION_LIST), {'latest': '1.0.0', 'versions': {'1.0.0': {'ts': 5}}})
+
+        server = bench.start_http_server(self.lib)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = f'http://127.0.0.1:{server.server_address[1]}/{cli.VERSION_LIST}'
+        patcher = mock.patch.object(cli, 'VERSION_LIST_URL', url)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def read(self, *names):
+        with open(os.path.join(*names), 'rb') as f:
+            return f.read()
+
+    def test_round_trip(self):
+        entry = cli.prepare_sdk_version_from_archives('1.0.0')
+        self.assertEqual(entry, cli.get_cache_entry_path('1.0.0', '5'))
+        for root, _, names in os.walk(self.source):
+            for name in names:
+                rel = os.path.relpath(os.path.join(root, name), self.source)
+                self.assertEqual(self.read(entry, rel), self.read(self.source, rel), rel)
+        self.assertFalse(os.path.exists(os.path.join(self.home, cli.SDK_HOME_PATH)))
+
+    def test_repair(self):
+        entry = cli.prepare_sdk_version_from_archives('1.0.0')
+        path = os.path.join(entry, 'p1', 'file_3.bytes')
+        os.chmod(path, 0o644)
+        with open(path, 'r+b') as f:
+            f.write(b'corrupt!')
+        os.remove(os.path.join(entry, cli.SDK_CONFIG_JSON))
+        cli.file_hash_memo = {}
+
+        self.assertTrue(cli.verify_sdk_cache())
+        self.assertIn('[ FIX] 1.0.0@5  2 files repaired', self.out.getvalue())
+        self.assertEqual(self.read(path), self.read(self.source, 'p1', 'file_3.bytes'))
+        self.assertEqual(self.read(entry, cli.SDK_CONFIG_JSON), self.read(self.source, cli.SDK_CONFIG_JSON))
+
+        self.out.truncate(0)
+        self.assertTrue(cli.verify_sdk_cache())
+        self.assertIn('[ OK ] 1.0.0@5', self.out.getvalue())
+
+
+# ---------------------- INSTALL ----------------------
+class InstallStampTest(CliTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.proj = self.path('proj')
+        bench.make_unity_project(self.proj, '1.0.0')
+        cli.save_install_stamp(self.proj, '1.0.0', self.path('cache', '1.0.0@100'))
+
+    def cache_version_list(self, ts: str, age: float = 0):
+        cli.save_version_list_cache({'url': cli.VERSION_LIST_URL, 'fetched_at': time.time() - age,
+                                     'doc': {'latest': '1.0.0', 'versions': {'1.0.0': {'ts': ts}}}})
+        cli.json_file_memo.clear()
+
+    def pin(self, ts: int):
+        bench.write_json(self.path('proj', 'ProjectSettings', 'guru-sdk-installer.json'),
+                         {'install_version': '1.0.0', 'install_ts': ts})
+        cli.json_file_memo.clear()
+
+    def test_ts_moves(self):
+        self.cache_version_list('100')
+        self.assertTrue(cli.is_install_up_to_date(self.proj, '1.0.0'))
+        self.cache_version_list('200')
+        self.assertFalse(cli.is_install_up_to_date(self.proj, '1.0.0'))
+
+    def test_stale_index(self):
+        self.cache_version_list('100', age=cli.version_list_ttl + 1)
+        self.assertFalse(cli.is_install_up_to_date(self.proj, '1.0.0'))
+        with mock.patch.object(cli, 'offline_mode', True):
+            self.assertTrue(cli.is_install_up_to_date(self.proj, '1.0.0'))
+
+    def test_pinned_ts(self):
+        self.cache_version_list('200')
+        self.pin(100)
+        self.assertTrue(cli.is_install_up_to_date(self.proj, '1.0.0'))
+        self.pin(200)
+        self.assertFalse(cli.is_install_up_to_date(self.proj, '1.0.0'))
+
+
+class BatchInstallTest(CliTestCase):
+
+    def test_broken_projects_fail_alone(self):
+        projs = {name: self.path(name) for name in ['missing', 'bad_json', 'no_version', 'bad_manifest']}
+        for name in ['bad_json', 'no_version', 'bad_manifest']:
+            bench.make_unity_project(projs[name], '1.0.0')
+        with open(os.path.join(projs['bad_json'], cli.INSTALLER_JSON), 'w') as f:
+            f.write('{"install_version": ')
+        bench.write_json(os.path.join(projs['no_version'], cli.INSTALLER_JSON), {})
+        with open(os.path.join(projs['bad_manifest'], cli.UNITY_PACKAGES_ROOT, cli.UNITY_MANIFEST_JSON), 'w') as f:
+            f.write('{')
+
+        with mock.patch.object(cli, 'CURRENT_PATH', self.root):
+            with self.assertRaises(SystemExit) as e:
+                cli.batch_install_sdk({p: cli.get_unity_proj_version(p) for p in projs.values()})
+        self.assertEqual(e.exception.code, cli.ERROR_BATCH_INSTALL_FAILED)
+
+        lines = {line.split()[1]: line for line in self.out.getvalue().splitlines() if line.startswith('[FAIL]')}
+        self.assertIn('unity project not found', lines[projs['missing']])
+        self.assertIn(f'wrong {cli.INSTALLER_JSON}', lines[projs['bad_json']])
+        self.assertIn(f'no install_version in {cli.INSTALLER_JSON}', lines[projs['no_version']])
+        self.assertIn(f'wrong {cli.UNITY_PACKAGES_ROOT}/{cli.UNITY_MANIFEST_JSON}', lines[projs['bad_manifest']])
+
+
+# the lock which unity wrote for the installer project
+UNITY_PACKAGES = os.path.join(os.path.dirname(CMD_ROOT), 'unity-sdk-installer', 'Packages')
+
+
+class PackagesLockTest(CliTestCase):
+
+    def setUp(self):
+        super().setUp()
+        with open(os.path.join(UNITY_PACKAGES, cli.UNITY_PACKAGES_LOCK_JSON), encoding='utf-8') as f:
+            self.unity_lock = json.load(f)
+        with open(os.path.join(UNITY_PACKAGES, cli.UNITY_MANIFEST_JSON), encoding='utf-8') as f:
+            self.manifest = json.load(f)
+        self.lock_path = self.path(cli.UNITY_PACKAGES_LOCK_JSON)
+        self.version_home = self.path('1.0.0')
+
+    def make_lock(self, lock: dict, linked: list = None, sdk_packages: list = None):
+        bench.write_json(self.lock_path, lock)
+        return cli.make_packages_lock(self.lock_path, self.version_home, linked or [], sdk_packages or [],
+                                      self.manifest)
+
+    def test_unity_lock_unchanged(self):
+        self.assertIsNone(self.make_lock(self.unity_lock))
+
+    def test_transitive_entry_as_unity_writes_it(self):
+        lock = copy.deepcopy(self.unity_lock)
+        del lock['dependencies']['com.unity.ext.nunit']
+        lock['dependencies']['com.unity.modules.subsystems']['depth'] = 3
+        new_lock = self.make_lock(lock)
+        self.assertEqual(json.dumps(new_lock, indent=2), json.dumps(self.unity_lock, indent=2))
+
+    def test_linked_packages(self):
+        self.manifest['scopedRegistries'] = [{'name': 'npm', 'url': 'https://npm.example.com',
+                                              'scopes': ['com.google']}]
+        bench.write_json(os.path.join(self.version_home, 'com.guru.a', 'package.json'), {'dependencies': {
+            'com.guru.b': '1.0.0',
+            'com.unity.ext.nunit': '2.0.0',
+            'com.unity.nuget.newtonsoft-json': '3.2.1',
+            'com.google.external-dependency-manager': '1.2.179',
+            'com.unity.modules.xr': '1.0.0',
+        }})
+        bench.write_json(os.path.join(self.version_home, 'com.guru.b', 'package.json'), {'name': 'com.guru.b'})
+
+        # an sdk package of the last install, and the registry package only it needed
+        lock = copy.deepcopy(self.unity_lock)
+        lock['dependencies']['com.guru.old'] = {'version': 'file:.upm.com.guru.old', 'depth': 0,
+                                                'source': 'embedded', 'dependencies': {'com.unity.old': '1.0.0'}}
+        lock['dependencies']['com.unity.old'] = {'version': '1.0.0', 'depth': 1, 'source': 'registry',
+                                                 'dependencies': {}, 'url': cli.UNITY_REGISTRY_URL}
+
+        deps = self.make_lock(lock, ['com.guru.a', 'com.guru.b'], ['com.guru.a', 'com.guru.b'])['dependencies']
+        expected = copy.deepcopy(self.unity_lock['dependencies'])
+        expected['com.guru.a'] = {'version': 'file:.upm.com.guru.a', 'depth': 0, 'source': 'embedded',
+                                  'dependencies': dict(deps['com.guru.a']['dependencies'])}
+        expected['com.guru.b'] = {'version': 'file:.upm.com.guru.b', 'depth': 0, 'source': 'embedded',
+                                  'dependencies': {}}
+        expected['com.unity.ext.nunit']['version'] = '2.0.0'
+        expected['com.unity.nuget.newtonsoft-json'] = {'version': '3.2.1', 'depth': 1, 'source': 'registry',
+                                                       'dependencies': {}, 'url': cli.UNITY_REGISTRY_URL}
+        expected['com.google.external-dependency-manager'] = {'version': '1.2.179', 'depth': 1,
+                                                              'source': 'registry', 'dependencies': {},
+                                                              'url': 'https://npm.example.com'}
+        self.assertEqual(deps, expected)
+        self.assertEqual(list(deps), sorted(deps, key=lambda d: (d.startswith(cli.UNITY_BUILTIN_PREFIX), d)))
+
+
+# ---------------------- CLI ----------------------
+class TimingReportTest(CliTestCase):
+
+    def test_report_on_exit(self):
+        argv = ['guru_unity_cli.py', 'list', '--version', '9.9.9', '--offline', '--no_daemon', '--timing']
+        with mock.patch.object(sys, 'argv', argv), mock.patch.object(cli, 'CURRENT_PATH', self.root):
+            with self.assertRaises(SystemExit) as e:
+                cli.main()
+        self.assertNotEqual(e.exception.code, 0)
+        self.assertIn('===== timing =====', self.out.getvalue())
+        self.assertIn('action', self.out.getvalue())
+
+
+class DaemonWriterTest(CliTestCase):
+
+    class Handler:
+
+        def __init__(self):
+            self.msgs = []
+
+        def send(self, msg: dict):
+            self.msgs.append(msg['out'])
+
+    def check_lines(self, msgs: list, names: list, n: int):
+        self.assertTrue(all(m.endswith('\n') for m in msgs))
+        lines = ''.join(msgs).splitlines()
+        self.assertEqual(sorted(lines), sorted(f'{name} line {j}' for name in names for j in range(n)))
+
+    def test_threads(self):
+        handler = self.Handler()
+        writer = cli.DaemonWriter(handler)
+
+        def work(name: str):
+            for j in range(50):
+                writer.write(name)
+                writer.write(f' line {j}')
+                writer.write('\n')
+
+        names = [f't{i}' for i in range(8)]
+        threads = [threading.Thread(target=work, args=(name,)) for name in names]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        writer.close()
+        self.check_lines(handler.msgs, names, 50)
+
+    def test_async_tasks(self):
+        handler = self.Handler()
+        writer = cli.DaemonWriter(handler)
+
+        async def work(name: str):
+            for j in range(20):
+                writer.write(name)
+                await asyncio.sleep(0)
+                writer.write(f' line {j}\n')
+
+        async def run():
+            await asyncio.gather(work('a'), work('b'))
+
+        asyncio.run(run())
+        writer.close()
+        self.check_lines(handler.msgs, ['a', 'b'], 20)
+
+    def test_forward_cmd_stderr(self):
+        with mock.patch.object(cli, 'forward_cmd_stderr', True):
+            log = cli.run_cmd('echo out && echo err 1>&2', show_log=False)
+        self.assertEqual(log.strip(), 'out')
+        self.assertIn('err', self.out.getvalue())
+        self.assertNotIn('out', self.out.getvalue())
+
+
+# ---------------------- PUBLISH ----------------------
+class PublishAndPushTest(CliTestCase):
+
+    # the publish workspace: a clone of a bare remote with version_list.json
+    def make_output(self):
+        remote = self.path('library.git')
+        output = self.path('output')
+        bench.git(['init', '-q', '--bare', '-b', cli.SDK_LIB_BRANCH, remote], self.root)
+        bench.git(['clone', '-q', remote, output], self.root)
+        bench.write_json(os.path.join(output, cli.VERSION_LIST), {'latest': '', 'versions': {}})
+        bench.git(['checkout', '-q', '-b', cli.SDK_LIB_BRANCH], output)
+        bench.git(['add', '-A'], output)
+        bench.git(['commit', '-q', '-m', 'init'], output)
+        bench.git(['push', '-q', 'origin', cli.SDK_LIB_BRANCH], output)
+        return remote, output
+
+    def test_failed_commit_exits(self):
+        remote, output = self.make_output()
+        head = bench.git_output(['rev-parse', cli.SDK_LIB_BRANCH], remote)
+        bench.write_json(os.path.join(output, '1.0.0', 'file.json'), {})
+        # the commit fails, like a machine without a git identity
+        with open(os.path.join(output, '.git', 'hooks', 'pre-commit'), 'w') as f:
+            f.write('#!/bin/sh\nexit 1\n')
+        os.chmod(os.path.join(output, '.git', 'hooks', 'pre-commit'), 0o755)
+
+        built = ('1.0.0', {'version': '1.0.0', 'desc': 'test', 'ts': '5'}, ['1.0.0/file.json'])
+        with mock.patch.object(cli, 'build_version_packages_and_files', return_value=built):
+            with self.assertRaises(SystemExit) as e:
+                cli.publish_and_push('', output)
+
+        self.assertEqual(e.exception.code, cli.ERROR_CMD_FAILED)
+        self.assertNotIn('Publish is done', self.out.getvalue())
+        self.assertEqual(bench.git_output(['rev-parse', cli.SDK_LIB_BRANCH], remote), head)
+
+
+
+class FetchGitPackageTest(CliTestCase):
+
+    def make_repo(self, name: str, lfs: bool):
+        repo = self.path('upm', name)
+        os.makedirs(repo)
+        bench.git(['init', '-q', '-b', 'main'], repo)
+        if lfs:
+            bench.git(['lfs', 'install', '--local'], repo)
+            bench.git(['lfs', 'track', '*.bytes'], repo)
+        bench.make_package(repo, name, '1.0.0', 1)
+        bench.git(['add', '-A'], repo)
+        bench.git(['commit', '-q', '-m', 'v1'], repo)
+        return repo, bench.git_output(['rev-parse', 'HEAD'], repo)
+
+    def test_remote_and_storage_before_checkout(self):
+        repo, git_hash = self.make_repo('com.test.plain', lfs=False)
+
+        # the git commands run for real, the LFS ones are only recorded
+        cmds = []
+        exec_cmd = cli.exec_cmd
+
+        def record(cmdline: str, work_path: str = ''):
+            cmds.append(cmdline)
+            return (0, '') if ' lfs ' in cmdline else exec_cmd(cmdline, work_path)
+
+        to_path = self.path('output', 'com.test.plain')
+        os.makedirs(os.path.dirname(to_path))
+        with mock.patch.object(cli, 'exec_cmd', record):
+            result = cli.fetch_git_package('com.test.plain', pathlib.Path(repo).as_uri(), git_hash, to_path)
+
+        self.assertTrue(result['ok'], result['log'])
+        clone = cmds[cmds.index('git init -q .'):]
+        self.assertEqual(clone, [
+            'git init -q .',
+            f'git remote add origin {pathlib.Path(repo).as_uri()}',
+            f'git config lfs.storage "{cli.get_lfs_storage()}"',
+            'git lfs install --local --skip-smudge',
+            f'git checkout -q {git_hash}',
+            'git lfs pull',
+        ])
+        self.assertTrue(os.path.isfile(os.path.join(to_path, 'file_0.bytes')))
+        self.assertFalse(os.path.exists(os.path.join(to_path, '.git')))
+
+    @unittest.skipIf(shutil.which('git-lfs') is None, 'git-lfs is not installed')
+    def test_lfs_files_go_to_the_shared_storage(self):
+        repo, git_hash = self.make_repo('com.test.lfs', lfs=True)
+
+        # the LFS objects of the package clone, counted right before its .git is deleted
+        clone_objects = []
+        delete_dir = cli.delete_dir
+
+        def count_and_delete(path: str):
+            if path.endswith('.git'):
+                lfs = os.path.join(path, 'lfs', 'objects')
+                clone_objects.extend(f for _, _, files in os.walk(lfs) for f in files)
+            delete_dir(path)
+
+        to_path = self.path('output', 'com.test.lfs')
+        os.makedirs(os.path.dirname(to_path))
+        with mock.patch.object(cli, 'delete_dir', count_and_delete):
+            result = cli.fetch_git_package('com.test.lfs', pathlib.Path(repo).as_uri(), git_hash, to_path)
+
+        self.assertTrue(result['ok'], result['log'])
+        self.assertEqual(clone_objects, [])
+        shared = [f for _, _, files in os.walk(cli.get_lfs_storage()) for f in files]
+        self.assertEqual(len(shared), bench.PACKAGE_FILES)
+        with open(os.path.join(repo, 'file_0.bytes'), 'rb') as a, open(os.path.join(to_path, 'file_0.bytes'), 'rb') as b:
+            self.assertEqual(a.read(), b.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
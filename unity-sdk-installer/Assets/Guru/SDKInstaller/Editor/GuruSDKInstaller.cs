@@ -213,6 +213,21 @@ namespace Guru.SDK
                 GUILayout.Label("Unknown sdk version...");
                 return;
             }
+
+            // 尚未加载的版本线: 加载完成后选中其中的最新版本
+            if (_controller.IsVersionLine(verName))
+            {
+                GUILayout.Label($"Loading sdk versions {verName} ...");
+                var key = SDKVersionIndexRoot.GetShardKey(verName);
+                _controller.LoadVersionLine(verName, () =>
+                {
+                    var names = _controller.GetVersionNames();
+                    _curSDKIndex = Math.Max(0, Array.FindLastIndex(names,
+                        n => !_controller.IsVersionLine(n) && SDKVersionIndexRoot.GetShardKey(n) == key));
+                    Repaint();
+                }, OnGetVersionListFailed);
+                return;
+            }
             
             // Error: 版本不在列表中
             var info = _controller.GetVersionInfo(verName);
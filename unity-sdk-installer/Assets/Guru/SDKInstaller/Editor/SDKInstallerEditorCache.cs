@@ -61,6 +61,36 @@ namespace Guru.SDK
 
     }
 
+    /// <summary>
+    /// 分片版本索引的 root (index/root.json)
+    /// shards: major.minor -> 分片文件名, 分片内容不会改变
+    /// </summary>
+    [Serializable]
+    public class SDKVersionIndexRoot
+    {
+        public string latest;
+        public Dictionary<string, string> channels;
+        public Dictionary<string, string> shards;
+
+        public static SDKVersionIndexRoot Parse(string json)
+        {
+            return JsonMapper.ToObject<SDKVersionIndexRoot>(json);
+        }
+
+        /// <summary>
+        /// 版本所在的分片: '1.4.2-beta.1' -> '1.4'
+        /// </summary>
+        /// <param name="version"></param>
+        /// <returns></returns>
+        public static string GetShardKey(string version)
+        {
+            if (string.IsNullOrEmpty(version)) return null;
+
+            var core = version.Trim().TrimStart('v', 'V').Split('+')[0].Split('-')[0];
+            return string.Join(".", core.Split('.').Take(2));
+        }
+    }
+
     /// <summary>
     /// SDK 版本信息
     /// </summary>
@@ -25,6 +25,8 @@ namespace Guru.SDK
         
         private const string VERSION_LIST_URL =
             "https://raw.githubusercontent.com/castbox/unity-gurusdk-library/refs/heads/main/version_list.json";
+        private const string VERSION_INDEX_URL =
+            "https://raw.githubusercontent.com/castbox/unity-gurusdk-library/refs/heads/main/index";
 
         private static readonly string SDKLibraryHome = Path.Combine(GetOSUserHome(), $"{SDK_HOME}/{SDK_LIB_NAME}");
         
@@ -35,6 +37,9 @@ namespace Guru.SDK
             Path.GetFullPath($"{Application.dataPath}/../Library/guru-sdk-installer");
 
         private static readonly string VersionListDocPath = Path.GetFullPath($"{Workspace}/version_list.json");
+        private static readonly string VersionRootPath = Path.GetFullPath($"{Workspace}/version-index-root.json");
+        private static readonly string VersionShardsHome = Path.GetFullPath($"{Workspace}/version-shards");
+        private const string VERSION_LINE_SUFFIX = ".x"; // 未加载的版本线在列表中的名称: 1.2.x
         private static readonly string UnityProjectHome = Path.GetFullPath($"{Application.dataPath}/../");
 
         private string CmdName
@@ -51,6 +56,9 @@ namespace Guru.SDK
 
         private SDKConfigFile _configFile;
         private SDKVersionListDoc _versionList;
+        private SDKVersionIndexRoot _versionRoot; // 分片索引, 旧 lib 仓库为 null
+        private readonly HashSet<string> _loadedShards = new HashSet<string>();
+        private readonly HashSet<string> _loadingShards = new HashSet<string>();
         private readonly SDKInstallerUserData _userData;
         private readonly string _pluginHome;
 
@@ -112,7 +120,7 @@ namespace Guru.SDK
         /// </summary>
         public void FetchVersionList(Action<SDKVersionListDoc> onSuccess, Action<string> onFailed = null)
         {
-            var cache_exists = TryLoadCachedVersionList(onSuccess);
+            var cache_exists = TryLoadCachedVersionList(onSuccess, onFailed);
             if (cache_exists)
                 return;
 
@@ -120,7 +128,197 @@ namespace Guru.SDK
         }
 
 
+        /// <summary>
+        /// 拉取分片版本索引: 只下载 root.json 和需要的分片 (最新版本和已安装版本所在的分片)
+        /// 其余版本线在列表中显示为 1.2.x, 选中时再加载. 分片内容不会改变, 下载过的分片直接从本地读取
+        /// </summary>
         private void DownloadOnlineVersionList(Action<SDKVersionListDoc> onSuccess, Action<string> onFailed = null)
+        {
+            var www = UnityWebRequest.Get($"{VERSION_INDEX_URL}/root.json");
+            www.timeout = 30;
+            www.SendWebRequest().completed += ao =>
+            {
+                SDKVersionIndexRoot root = null;
+                if (www.result == UnityWebRequest.Result.Success)
+                {
+                    try
+                    {
+                        root = SDKVersionIndexRoot.Parse(www.downloadHandler.text);
+                    }
+                    catch (Exception e)
+                    {
+                        Debug.LogWarning($"Wrong version index root: {e.Message}");
+                    }
+                }
+
+                if (root?.shards == null || root.shards.Count == 0)
+                {
+                    // 没有分片索引的旧 lib 仓库
+                    DownloadLegacyVersionList(onSuccess, onFailed);
+                    return;
+                }
+
+                // 只缓存 root, 分片各自缓存在 version-shards 中, 不会把部分版本当作完整列表保存
+                File.WriteAllText(VersionRootPath, www.downloadHandler.text);
+                if (File.Exists(VersionListDocPath))
+                    File.Delete(VersionListDocPath);
+                LoadVersionIndex(root, onSuccess, onFailed);
+            };
+        }
+
+
+        /// <summary>
+        /// 加载最新版本和已安装版本所在的分片
+        /// </summary>
+        private void LoadVersionIndex(SDKVersionIndexRoot root, Action<SDKVersionListDoc> onSuccess,
+            Action<string> onFailed)
+        {
+            var shardNames = new List<string>();
+            foreach (var version in new[] { root.latest, _userData.install_version })
+            {
+                var key = SDKVersionIndexRoot.GetShardKey(version);
+                if (key != null && root.shards.TryGetValue(key, out var name) && !shardNames.Contains(name))
+                {
+                    shardNames.Add(name);
+                }
+            }
+
+            var doc = new SDKVersionListDoc()
+            {
+                latest = root.latest,
+                versions = new Dictionary<string, SDKVersionInfo>(),
+            };
+            _loadedShards.Clear();
+            _loadingShards.Clear();
+            LoadVersionShards(shardNames, 0, doc, () =>
+            {
+                _versionRoot = root;
+                _versionList = doc;
+                onSuccess?.Invoke(doc);
+            }, onFailed);
+        }
+
+
+        /// <summary>
+        /// 是否为尚未加载的版本线 (如 1.2.x)
+        /// </summary>
+        /// <param name="versionName"></param>
+        /// <returns></returns>
+        public bool IsVersionLine(string versionName)
+        {
+            return _versionRoot != null && versionName != null && versionName.EndsWith(VERSION_LINE_SUFFIX)
+                   && _versionRoot.shards.ContainsKey(SDKVersionIndexRoot.GetShardKey(versionName));
+        }
+
+
+        /// <summary>
+        /// 加载一条版本线的分片, 合并到版本列表中
+        /// </summary>
+        /// <param name="versionLine"></param>
+        /// <param name="onLoaded"></param>
+        /// <param name="onFailed"></param>
+        public void LoadVersionLine(string versionLine, Action onLoaded, Action<string> onFailed = null)
+        {
+            if (!IsVersionLine(versionLine)) return;
+
+            var name = _versionRoot.shards[SDKVersionIndexRoot.GetShardKey(versionLine)];
+            if (!_loadingShards.Add(name)) return;
+
+            var doc = _versionList;
+            LoadVersionShards(new List<string> { name }, 0, doc, () =>
+            {
+                _loadingShards.Remove(name);
+                onLoaded?.Invoke();
+            }, error =>
+            {
+                _loadingShards.Remove(name);
+                onFailed?.Invoke(error);
+            });
+        }
+
+
+        /// <summary>
+        /// 依次加载分片, 并把分片中的版本合并到 doc 中
+        /// </summary>
+        private void LoadVersionShards(List<string> shardNames, int index, SDKVersionListDoc doc,
+            Action onComplete, Action<string> onFailed)
+        {
+            if (index >= shardNames.Count)
+            {
+                onComplete?.Invoke();
+                return;
+            }
+
+            var name = shardNames[index];
+            var path = Path.Combine(VersionShardsHome, name);
+            if (File.Exists(path))
+            {
+                SDKVersionListDoc shard = null;
+                try
+                {
+                    shard = SDKVersionListDoc.LoadFromFile(path);
+                }
+                catch (Exception e)
+                {
+                    Debug.LogWarning($"Broken version shard {name}, download it again: {e.Message}");
+                }
+
+                if (shard?.versions != null)
+                {
+                    MergeVersions(doc, shard);
+                    _loadedShards.Add(name);
+                    LoadVersionShards(shardNames, index + 1, doc, onComplete, onFailed);
+                    return;
+                }
+            }
+
+            var www = UnityWebRequest.Get($"{VERSION_INDEX_URL}/{name}");
+            www.timeout = 30;
+            www.SendWebRequest().completed += ao =>
+            {
+                if (www.result != UnityWebRequest.Result.Success)
+                {
+                    onFailed?.Invoke(www.error);
+                    return;
+                }
+
+                var json = www.downloadHandler.text;
+                SDKVersionListDoc shard;
+                try
+                {
+                    shard = SDKVersionListDoc.Parse(json);
+                }
+                catch (Exception e)
+                {
+                    onFailed?.Invoke($"Wrong version shard {name}: {e.Message}");
+                    return;
+                }
+
+                if (shard?.versions != null)
+                {
+                    if (!Directory.Exists(VersionShardsHome)) Directory.CreateDirectory(VersionShardsHome);
+                    File.WriteAllText(path, json);
+                    MergeVersions(doc, shard);
+                    _loadedShards.Add(name);
+                }
+                LoadVersionShards(shardNames, index + 1, doc, onComplete, onFailed);
+            };
+        }
+
+
+        private static void MergeVersions(SDKVersionListDoc doc, SDKVersionListDoc shard)
+        {
+            foreach (var kvp in shard.versions)
+            {
+                doc.versions[kvp.Key] = kvp.Value;
+            }
+        }
+
+
+        /// <summary>
+        /// 拉取完整的 version_list.json (没有分片索引时使用)
+        /// </summary>
+        private void DownloadLegacyVersionList(Action<SDKVersionListDoc> onSuccess, Action<string> onFailed = null)
         {
             var www = UnityWebRequest.Get(VERSION_LIST_URL);
             www.timeout = 30;
@@ -130,6 +328,7 @@ namespace Guru.SDK
                 {
                     var doc = SDKVersionListDoc.Parse(www.downloadHandler.text);
                     SaveVersionListToCache(doc);
+                    _versionRoot = null;
                     _versionList = doc;
                     onSuccess?.Invoke(doc);
                 }
@@ -143,11 +342,32 @@ namespace Guru.SDK
 
         /// <summary>
         /// 尝试缓存 Version List
+        /// 分片索引: 一小时内的 root + 本地的分片; 旧 lib 仓库: 一小时内的完整 version_list.json
         /// </summary>
         /// <param name="onSuccess"></param>
+        /// <param name="onFailed"></param>
         /// <returns></returns>
-        private bool TryLoadCachedVersionList(Action<SDKVersionListDoc> onSuccess)
+        private bool TryLoadCachedVersionList(Action<SDKVersionListDoc> onSuccess, Action<string> onFailed)
         {
+            if (File.Exists(VersionRootPath)
+                && (DateTime.UtcNow - File.GetLastWriteTimeUtc(VersionRootPath)).TotalHours <= 1)
+            {
+                SDKVersionIndexRoot root = null;
+                try
+                {
+                    root = SDKVersionIndexRoot.Parse(File.ReadAllText(VersionRootPath));
+                }
+                catch (Exception e)
+                {
+                    Debug.LogWarning($"Broken version index root cache: {e.Message}");
+                }
+
+                if (root?.shards != null && root.shards.Count > 0)
+                {
+                    LoadVersionIndex(root, onSuccess, onFailed);
+                    return true;
+                }
+            }
 
             if (!File.Exists(VersionListDocPath))
                 return false;
@@ -163,6 +383,7 @@ namespace Guru.SDK
                 return false; // 超过一小时以上，需要再次更新
             }
 
+            _versionRoot = null;
             _versionList = doc;
             onSuccess?.Invoke(doc);
             return true;
@@ -173,6 +394,8 @@ namespace Guru.SDK
         {
             if (File.Exists(VersionListDocPath))
                 File.Delete(VersionListDocPath);
+            if (File.Exists(VersionRootPath))
+                File.Delete(VersionRootPath);
         }
 
         private void SaveVersionListToCache(SDKVersionListDoc doc)
@@ -183,12 +406,23 @@ namespace Guru.SDK
 
 
         /// <summary>
-        /// 获取 Version 名称列表
+        /// 获取 Version 名称列表, 包含尚未加载的版本线 (如 1.2.x)
         /// </summary>
         /// <returns></returns>
         public string[] GetVersionNames()
         {
-            return _versionList?.GetVersionNames() ?? null;
+            var names = _versionList?.GetVersionNames();
+            if (names == null || _versionRoot == null)
+                return names;
+
+            var list = new List<string>(names);
+            foreach (var kvp in _versionRoot.shards)
+            {
+                if (!_loadedShards.Contains(kvp.Value))
+                    list.Add($"{kvp.Key}{VERSION_LINE_SUFFIX}");
+            }
+            list.Sort();
+            return list.ToArray();
         }
 
 
@@ -16,10 +16,12 @@ set CLI_HOME=%USERPROFILE%\.guru\unity
 set CLI=%CLI_HOME%\guru_unity_cli.py
 set CLI_URL=https://raw.githubusercontent.com/castbox/guru-unity-cli/refs/heads/main/cmd/guru_unity_cli.py
 
-:: if not exist "%CLI%" (
+:: download cli file, only when it is changed online (ETag)
 echo "Download guru-unity-cli"
-curl -o %CLI% %CLI_URL%
-::)
+if not exist "%CLI%" del /q "%CLI%.etag" 2>nul
+del /q "%CLI%.download" 2>nul
+curl -L -s --etag-compare "%CLI%.etag" --etag-save "%CLI%.etag" -o "%CLI%.download" %CLI_URL% || curl -L -o "%CLI%.download" %CLI_URL%
+if exist "%CLI%.download" for %%A in ("%CLI%.download") do if %%~zA GTR 0 (move /y "%CLI%.download" "%CLI%" >nul) else (del /q "%CLI%.download")
 
 :: switch running mode
 echo